@@ -0,0 +1,228 @@
+import os
+import shutil
+import types
+import hashlib
+import tempfile
+import dill
+import numpy as np
+
+from Utility.Logging_Extension import logger
+
+
+class _ArrayExternalizingPickler(dill.Pickler):
+    """
+    Stores large numpy arrays as separate .npy files (instead of embedding them in the pickle stream)
+    """
+
+    def __init__(self, file, array_dp, min_array_size_in_bytes):
+        dill.Pickler.__init__(self, file, protocol=dill.HIGHEST_PROTOCOL)
+        self.array_dp = array_dp
+        self.min_array_size_in_bytes = min_array_size_in_bytes
+        self.num_arrays = 0
+
+    def persistent_id(self, obj):
+        if isinstance(obj, np.ndarray) and obj.dtype != object and obj.nbytes >= self.min_array_size_in_bytes:
+            array_fn = 'array_' + str(self.num_arrays) + '.npy'
+            np.save(os.path.join(self.array_dp, array_fn), np.asarray(obj))
+            self.num_arrays += 1
+            return 'npy', array_fn
+        return None
+
+
+class _ArrayMappingUnpickler(dill.Unpickler):
+    """
+    Maps the externalized arrays (copy-on-write), i.e. the data is only read when it is accessed
+    """
+
+    def __init__(self, file, array_dp):
+        dill.Unpickler.__init__(self, file)
+        self.array_dp = array_dp
+
+    def persistent_load(self, pid):
+        pid_type, array_fn = pid
+        assert pid_type == 'npy'
+        return np.load(os.path.join(self.array_dp, array_fn), mmap_mode='c')
+
+
+class PersistentCache(object):
+    """
+    Content addressed cache for the results of (expensive) callbacks.
+
+    The key of an entry is computed from
+        - the identity of the callback (module, name and byte code)
+        - the parameters of the callback
+        - the paths, sizes and modification times (optionally the content hashes) of the input files
+    i.e. an entry is invalidated, if the code, the parameters or the inputs change.
+
+    Each entry is a directory containing the pickled result, where large numpy
+    arrays are stored as separate (memory mappable) .npy files. Entries are
+    written to a temporary directory first and renamed afterwards, i.e. a crash
+    never leaves a corrupt entry. If the cache exceeds max_size_in_bytes, the
+    least recently used entries are removed.
+    """
+
+    result_fn = 'result.dill'
+    tmp_prefix = '.tmp_'
+
+    def __init__(self,
+                 cache_dp=None,
+                 max_size_in_bytes=4 * 1024 ** 3,
+                 min_array_size_in_bytes=1024 ** 2,
+                 hash_file_content=False):
+
+        if cache_dp is None:
+            cache_dp = os.path.join(tempfile.gettempdir(), 'persistent_cache')
+        if not os.path.isdir(cache_dp):
+            os.makedirs(cache_dp)
+        self.cache_dp = cache_dp
+        self.max_size_in_bytes = max_size_in_bytes
+        self.min_array_size_in_bytes = min_array_size_in_bytes
+        self.hash_file_content = hash_file_content
+
+        self.num_hits = 0
+        self.num_misses = 0
+
+    @staticmethod
+    def _update_hash_with_callback(hash_obj, callback):
+        hash_obj.update(str(getattr(callback, '__module__', '')).encode())
+        hash_obj.update(str(getattr(callback, '__qualname__', getattr(callback, '__name__', ''))).encode())
+        code = getattr(callback, '__code__', None)
+        if code is not None:
+            PersistentCache._update_hash_with_code(hash_obj, code)
+
+    @staticmethod
+    def _update_hash_with_code(hash_obj, code):
+        hash_obj.update(code.co_code)
+        hash_obj.update(repr(code.co_names).encode())
+        for const in code.co_consts:
+            # The repr of nested code objects (comprehensions, lambdas, ...) contains their memory address
+            if isinstance(const, types.CodeType):
+                PersistentCache._update_hash_with_code(hash_obj, const)
+            else:
+                hash_obj.update(repr(const).encode())
+
+    @staticmethod
+    def _update_hash_with_file(hash_obj, ifp, hash_file_content):
+        file_stat = os.stat(ifp)
+        hash_obj.update(os.path.abspath(ifp).encode())
+        hash_obj.update(str(file_stat.st_size).encode())
+        if hash_file_content:
+            with open(ifp, 'rb') as input_file:
+                for block in iter(lambda: input_file.read(2 ** 20), b''):
+                    hash_obj.update(block)
+        else:
+            hash_obj.update(str(file_stat.st_mtime_ns).encode())
+
+    def compute_key(self, callback, params, input_fps=()):
+        hash_obj = hashlib.sha1()
+        PersistentCache._update_hash_with_callback(hash_obj, callback)
+        hash_obj.update(dill.dumps(params, protocol=dill.HIGHEST_PROTOCOL))
+        for ifp in input_fps:
+            PersistentCache._update_hash_with_file(hash_obj, ifp, self.hash_file_content)
+        return hash_obj.hexdigest()
+
+    def get_cached_result(self, callback, params, input_fps=()):
+        """
+        :param callback:
+        :param params: list of callback parameters
+        :param input_fps: files read by the callback (used to invalidate the entry)
+        :return: callback(*params)
+        """
+        key = self.compute_key(callback, params, input_fps)
+        entry_dp = os.path.join(self.cache_dp, key)
+
+        if os.path.isdir(entry_dp):
+            logger.info('Reading data from persistent cache: ' + key)
+            result = self._load_entry(entry_dp)
+            # The modification time of the entry defines the LRU order
+            os.utime(entry_dp, None)
+            self.num_hits += 1
+        else:
+            logger.info('Computing data (not in persistent cache): ' + key)
+            result = callback(*params)
+            self._store_entry(entry_dp, result)
+            self.num_misses += 1
+            self.evict()
+        return result
+
+    def _load_entry(self, entry_dp):
+        with open(os.path.join(entry_dp, PersistentCache.result_fn), 'rb') as result_file:
+            return _ArrayMappingUnpickler(result_file, entry_dp).load()
+
+    def _store_entry(self, entry_dp, result):
+        tmp_dp = tempfile.mkdtemp(prefix=PersistentCache.tmp_prefix, dir=self.cache_dp)
+        try:
+            with open(os.path.join(tmp_dp, PersistentCache.result_fn), 'wb') as result_file:
+                _ArrayExternalizingPickler(result_file, tmp_dp, self.min_array_size_in_bytes).dump(result)
+            os.rename(tmp_dp, entry_dp)
+        except OSError:
+            # Another process stored the same entry in the meantime
+            if not os.path.isdir(entry_dp):
+                raise
+        finally:
+            if os.path.isdir(tmp_dp):
+                shutil.rmtree(tmp_dp)
+
+    @staticmethod
+    def _get_dir_size(dp):
+        return sum(os.path.getsize(os.path.join(dp, fn)) for fn in os.listdir(dp))
+
+    def get_entries(self):
+        """
+        Returns a list of (modification time, size, path) tuples sorted from least to most recently used
+        """
+        entries = []
+        for entry_name in os.listdir(self.cache_dp):
+            entry_dp = os.path.join(self.cache_dp, entry_name)
+            if entry_name.startswith(PersistentCache.tmp_prefix) or not os.path.isdir(entry_dp):
+                continue
+            entries.append((os.path.getmtime(entry_dp), PersistentCache._get_dir_size(entry_dp), entry_dp))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.get_entries()
+        total_size = sum(entry[1] for entry in entries)
+        for modification_time, entry_size, entry_dp in entries:
+            if total_size <= self.max_size_in_bytes:
+                break
+            logger.info('Removing least recently used cache entry: ' + entry_dp)
+            shutil.rmtree(entry_dp, ignore_errors=True)
+            total_size -= entry_size
+
+    def clear(self):
+        for modification_time, entry_size, entry_dp in self.get_entries():
+            shutil.rmtree(entry_dp, ignore_errors=True)
+
+    def get_statistics(self):
+        num_requests = self.num_hits + self.num_misses
+        hit_rate = float(self.num_hits) / num_requests if num_requests > 0 else 0.0
+        entries = self.get_entries()
+        return {'num_hits': self.num_hits,
+                'num_misses': self.num_misses,
+                'hit_rate': hit_rate,
+                'num_entries': len(entries),
+                'size_in_bytes': sum(entry[1] for entry in entries)}
+
+    def log_statistics(self):
+        for statistic_name, statistic_value in self.get_statistics().items():
+            logger.vinfo(statistic_name, statistic_value)
+
+
+def _example_callback(values):
+    add_offset = lambda value: value + 1
+    return [add_offset(value) for value in values]
+
+
+if __name__ == '__main__':
+
+    import sys
+    import subprocess
+
+    # Checks that the key of a callback (with a nested code object) is stable across interpreter runs
+    if len(sys.argv) > 1 and sys.argv[1] == '--print_key':
+        print(PersistentCache().compute_key(_example_callback, [[1, 2, 3]]))
+    else:
+        keys = [subprocess.check_output([sys.executable, __file__, '--print_key']).decode('utf-8').strip()
+                for _ in range(2)]
+        logger.vinfo('keys', keys)
+        assert keys[0] == keys[1]
@@ -7,6 +7,8 @@ from Utility.Logging_Extension import logger
 
 class PythonCache(object):
 
+    # See Persistent_Cache.PersistentCache for a cache, which is invalidated if the inputs change
+
     def __init__(self):
         self.tmp_dir = tempfile.gettempdir()
 
@@ -25,7 +27,15 @@ class PythonCache(object):
                 result = dill.load(file)
         else:
             logger.info('Reading data from txt reconstruction')
-            with open(cache_fp, 'wb') as file:
-                result = callback(*params)
-                dill.dump(result, file)
+            result = callback(*params)
+            # Write to a temporary file first, i.e. a crash does not leave a corrupt cache file
+            tmp_fd, tmp_fp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_fp)))
+            try:
+                with os.fdopen(tmp_fd, 'wb') as file:
+                    dill.dump(result, file)
+            except BaseException:
+                # E.g. an unpicklable result
+                os.remove(tmp_fp)
+                raise
+            os.replace(tmp_fp, cache_fp)
         return result
@@ -0,0 +1,152 @@
+import os
+import sys
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from Utility.Logging_Extension import logger
+
+
+class RasterCache(object):
+    """
+    In-process LRU cache for decoded rasters (depth maps, h5 segmentations, images).
+
+    Entries are keyed by the path, the modification time and the size of the
+    file as well as a loader key (e.g. gray scale vs. rgb). The cache respects
+    a memory budget (the sum of the nbytes of the cached arrays) and allows to
+    read files ahead in background threads.
+
+    The returned arrays are shared between all callers and therefore read-only.
+    """
+
+    def __init__(self, max_size_in_bytes=2 * 1024 ** 3, num_prefetch_threads=2):
+        self.max_size_in_bytes = max_size_in_bytes
+        self.num_prefetch_threads = num_prefetch_threads
+
+        self._entries = OrderedDict()       # key -> raster (in LRU order)
+        self._entry_sizes = {}
+        self._size_in_bytes = 0
+        self._pending = {}                  # key -> future of a prefetch
+        self._lock = threading.Lock()
+        self._thread_pool = None
+
+        self.num_hits = 0
+        self.num_misses = 0
+
+    @staticmethod
+    def _compute_key(ifp, loader_key):
+        file_stat = os.stat(ifp)
+        return os.path.abspath(ifp), file_stat.st_mtime_ns, file_stat.st_size, loader_key
+
+    @staticmethod
+    def _compute_loader_key(loader):
+        qualname = getattr(loader, '__qualname__', None)
+        if qualname is not None and '<' not in qualname:
+            # Module level functions and (static) methods are identified by their name
+            return getattr(loader, '__module__', None), qualname
+        # Lambdas, nested functions and other callables (e.g. partials) may share the same name,
+        # i.e. they are identified by the callable itself
+        return loader
+
+    @staticmethod
+    def _compute_size(raster):
+        if isinstance(raster, np.ndarray):
+            return raster.nbytes
+        if isinstance(raster, (list, tuple)):
+            return sys.getsizeof(raster) + sum(RasterCache._compute_size(element) for element in raster)
+        if isinstance(raster, dict):
+            return sys.getsizeof(raster) + sum(RasterCache._compute_size(value) for value in raster.values())
+        return sys.getsizeof(raster)
+
+    def _get_thread_pool(self):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(self.num_prefetch_threads)
+        return self._thread_pool
+
+    def _insert(self, key, raster):
+        if isinstance(raster, np.ndarray):
+            raster.flags.writeable = False
+        raster_size = RasterCache._compute_size(raster)
+        with self._lock:
+            self._pending.pop(key, None)
+            if raster_size > self.max_size_in_bytes or key in self._entries:
+                return
+            self._entries[key] = raster
+            self._entry_sizes[key] = raster_size
+            self._size_in_bytes += raster_size
+            # Remove the least recently used entries
+            while self._size_in_bytes > self.max_size_in_bytes:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._size_in_bytes -= self._entry_sizes.pop(evicted_key)
+
+    def get(self, ifp, loader, loader_key=None):
+        """
+        :param ifp: path of the raster file
+        :param loader: callback, which reads / decodes the file, i.e. loader(ifp)
+        :param loader_key: distinguishes different loaders of the same file (defaults to the module and name
+            of the loader, anonymous loaders such as lambdas are distinguished by identity)
+        :return: loader(ifp) (read-only)
+        """
+        if loader_key is None:
+            loader_key = RasterCache._compute_loader_key(loader)
+        key = RasterCache._compute_key(ifp, loader_key)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.num_hits += 1
+                return self._entries[key]
+            pending_result = self._pending.get(key)
+            self.num_misses += 1
+
+        if pending_result is not None:
+            raster = pending_result.result()
+        else:
+            raster = loader(ifp)
+        self._insert(key, raster)
+        return raster
+
+    def prefetch(self, ifp, loader, loader_key=None):
+        """
+        Reads the file in a background thread (if it is not cached yet)
+        """
+        if not os.path.isfile(ifp):
+            return
+        if loader_key is None:
+            loader_key = RasterCache._compute_loader_key(loader)
+        key = RasterCache._compute_key(ifp, loader_key)
+
+        with self._lock:
+            if key in self._entries or key in self._pending:
+                return
+            future = self._get_thread_pool().submit(loader, ifp)
+            self._pending[key] = future
+        # The prefetched raster is inserted as soon as it is available
+        future.add_done_callback(
+            lambda done_future: self._insert(key, done_future.result())
+            if done_future.exception() is None else self._pending.pop(key, None))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._entry_sizes.clear()
+            self._size_in_bytes = 0
+            self._pending.clear()
+
+    def get_statistics(self):
+        num_requests = self.num_hits + self.num_misses
+        hit_rate = float(self.num_hits) / num_requests if num_requests > 0 else 0.0
+        return {'num_hits': self.num_hits,
+                'num_misses': self.num_misses,
+                'hit_rate': hit_rate,
+                'num_entries': len(self._entries),
+                'size_in_bytes': self._size_in_bytes}
+
+    def log_statistics(self):
+        for statistic_name, statistic_value in self.get_statistics().items():
+            logger.vinfo(statistic_name, statistic_value)
+
+
+# Shared by all file handlers (see use_cache parameters)
+raster_cache = RasterCache()
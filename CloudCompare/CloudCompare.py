@@ -6,11 +6,7 @@ import uuid
 from shutil import copyfile
 from Utility.Logging_Extension import logger
 from Utility.Config import Config
-
-class SubSamplingMode:
-    RANDOM = 'RANDOM'
-    SPATIAL = 'SPATIAL'
-    OCTREE = 'OCTREE'
+from Utility.Types.Enums.Sub_Sampling_Mode import SubSamplingMode
 
 class CloudCompare:
 
@@ -79,12 +75,22 @@ class CloudCompare:
         self.cmd_options += ['-O', file_path]
         self.loaded_file_path_list.append(file_path)
 
+    def cc_clear(self):
+        """
+        Removes all loaded entities (clouds and meshes), i.e. subsequent
+        commands of the same call operate on newly opened entities only
+        """
+        self.cmd_options += ['-CLEAR']
+        self.loaded_file_path_list = []
+
     def cc_statistical_outlier_removal(self, number_of_neighbors=6, sigma_multiplier=1.0):
         self.cmd_options += ['-SOR', str(number_of_neighbors), str(sigma_multiplier)]
 
     def cc_subsampling(self, subsampling_mode='OCTREE', subsampling_parameter=9):
         """
         -SS {algorithm} {parameter}
+
+        See PointCloudCollection.subsample_point_cloud() for an in-memory alternative
         """
         self.cmd_options += ['-SS', subsampling_mode, str(subsampling_parameter)]
 
@@ -104,6 +110,7 @@ class CloudCompare:
     def cc_compute_cloud_to_cloud_distance(self):
         """
         See documentation of compute_cloud_to_mesh_distance()
+        See PointCloudCollection.compute_cloud_to_cloud_distances() for an in-memory alternative
         :return:
         """
         self.cmd_options += ['-C2C_DIST']
@@ -127,6 +134,7 @@ class CloudCompare:
             '-SET_ACTIVE_SF {index}'
             '-REMOVE_ALL_SFS'
 
+        See PointCloudCollection.compute_cloud_to_mesh_distances() for an in-memory alternative
         """
         self.cmd_options += ['-C2M_DIST']
         self.output_suffix += '_C2M_DIST'
@@ -232,6 +240,7 @@ class CloudCompare:
         # https://www.cloudcompare.org/doc/wiki/index.php?title=SOR_filter
         # The 'SOR filter' tool resembles a lot the S.O.R. (Statistical Outlier Removal) of the PCL library
         # http://pointclouds.org/documentation/tutorials/statistical_outlier.php
+        # See PointCloudCollection.statistical_outlier_removal() for an in-memory alternative
 
         cloud_compare = CloudCompare()
         # cc_open checks presence of file
@@ -0,0 +1,153 @@
+import os
+import math
+import time
+import subprocess
+from pathos.pools import ThreadPool
+from pathos.helpers import cpu_count
+from Utility.CloudCompare.CloudCompare import CloudCompare
+from Utility.Logging_Extension import logger
+
+
+class CloudCompareJob(object):
+    """
+    A single CloudCompare call, which chains several independent operations.
+
+    Each operation opens its input, applies its commands, saves its output and
+    clears the loaded entities afterwards (-CLEAR), i.e. the start-up cost of
+    CloudCompare is paid only once per job (instead of once per operation).
+
+    Since a failing operation may abort the remaining operations of the call,
+    the outputs of all operations are checked after the execution (see
+    missing_output_fps).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.cloud_compare = CloudCompare()
+        self.operations = []
+        self.output_fps = []
+        self.return_code = None
+        self.wall_time = None
+        # Outputs, which have not been written by the execution
+        self.missing_output_fps = []
+
+    def __len__(self):
+        return len(self.output_fps)
+
+    def add_transformation(self, ifp_model, ifp_transformation, ofp_model, save_point_clouds, save_meshes):
+        if not (save_point_clouds ^ save_meshes):
+            logger.info('Either save_point_clouds or save_meshes must be True')
+            assert False
+        # cc_open checks presence of file
+        self.cloud_compare.cc_open(ifp_model)
+        self.cloud_compare.cc_apply_trans(ifp_transformation)
+        if save_point_clouds:
+            self.cloud_compare._cc_save_clouds(ofp_model)
+        if save_meshes:
+            self.cloud_compare._cc_save_meshes(ofp_model)
+        self.cloud_compare.cc_clear()
+        self.operations.append((ifp_model, ifp_transformation, ofp_model))
+        self.output_fps.append(ofp_model)
+
+    def get_call(self):
+        return [CloudCompare.path_to_executable] + self.cloud_compare.cmd_options
+
+    @staticmethod
+    def _get_modification_time(fp):
+        if os.path.isfile(fp):
+            return os.path.getmtime(fp)
+        return None
+
+    def execute(self):
+        # Existing outputs (e.g. if lazy is False) count only as written, if they have been modified
+        modification_times = [CloudCompareJob._get_modification_time(ofp) for ofp in self.output_fps]
+        start_time = time.time()
+        self.return_code = subprocess.call(self.get_call())
+        self.wall_time = time.time() - start_time
+        self.missing_output_fps = [
+            ofp for ofp, modification_time in zip(self.output_fps, modification_times)
+            if not os.path.isfile(ofp) or CloudCompareJob._get_modification_time(ofp) == modification_time]
+        return self
+
+    def get_failed_operations(self):
+        """
+        :return: the operations (ifp_model, ifp_transformation, ofp_model), whose output is missing
+        """
+        missing_output_fps = set(self.missing_output_fps)
+        return [operation for operation in self.operations if operation[2] in missing_output_fps]
+
+
+class CloudCompareJobRunner(object):
+    """
+    Distributes many independent CloudCompare operations on a small number of
+    CloudCompare calls (see CloudCompareJob), which are executed concurrently.
+    """
+
+    def __init__(self, max_num_workers=None, max_operations_per_job=64):
+        """
+        :param max_num_workers: maximum number of concurrent CloudCompare processes (defaults to the number of cpus)
+        :param max_operations_per_job: limits the length of a single command line
+        """
+        if max_num_workers is None:
+            max_num_workers = cpu_count()
+        self.max_num_workers = max_num_workers
+        self.max_operations_per_job = max_operations_per_job
+
+    def create_transformation_jobs(self, transformation_operations, save_point_clouds, save_meshes, lazy=True):
+        """
+        :param transformation_operations: list of (ifp_model, ifp_transformation, ofp_model) tuples
+        :param lazy: if True, operations with an existing output file are skipped
+        :return: list of CloudCompareJob
+        """
+        if lazy:
+            transformation_operations = [
+                operation for operation in transformation_operations if not os.path.isfile(operation[2])]
+        if len(transformation_operations) == 0:
+            return []
+
+        # Use as few jobs as possible, but enough to keep all workers busy
+        num_operations_per_job = int(math.ceil(len(transformation_operations) / float(self.max_num_workers)))
+        num_operations_per_job = max(1, min(num_operations_per_job, self.max_operations_per_job))
+
+        jobs = []
+        for first_index in range(0, len(transformation_operations), num_operations_per_job):
+            job = CloudCompareJob('transformation_job_' + str(len(jobs)))
+            for ifp_model, ifp_transformation, ofp_model in \
+                    transformation_operations[first_index: first_index + num_operations_per_job]:
+                job.add_transformation(ifp_model, ifp_transformation, ofp_model, save_point_clouds, save_meshes)
+            jobs.append(job)
+        return jobs
+
+    def run(self, jobs):
+        """
+        Executes the jobs (at most max_num_workers at once)
+        :return: the executed jobs (with return code, wall time and missing outputs)
+        """
+        logger.info('run: ...')
+        logger.vinfo('Number of jobs', len(jobs))
+        if len(jobs) == 0:
+            return []
+
+        start_time = time.time()
+        # The work is done by the CloudCompare processes, i.e. threads are sufficient
+        with ThreadPool(nodes=min(self.max_num_workers, len(jobs))) as pool:
+            results = []
+            for job in jobs:
+                result = pool.apipe(CloudCompareJob.execute, job)
+                results.append(result)
+            executed_jobs = [result.get() for result in results]
+
+        for job in executed_jobs:
+            logger.info(job.name + ': ' + str(len(job)) + ' operations, ' +
+                        'return code ' + str(job.return_code) + ', ' +
+                        'wall time ' + '{:.2f}'.format(job.wall_time) + 's')
+            if job.return_code != 0:
+                logger.info('CloudCompare call failed: ' + str(job.get_call()))
+            for ifp_model, ifp_transformation, ofp_model in job.get_failed_operations():
+                logger.info('Missing output: ' + ofp_model +
+                            ' (model: ' + ifp_model + ', transformation: ' + ifp_transformation + ')')
+        num_failed_operations = sum(len(job.missing_output_fps) for job in executed_jobs)
+        logger.vinfo('Number of failed operations', num_failed_operations)
+        logger.vinfo('Total wall time', time.time() - start_time)
+        logger.info('run: Done')
+        return executed_jobs
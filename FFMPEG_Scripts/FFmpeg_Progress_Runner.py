@@ -0,0 +1,158 @@
+import time
+import subprocess
+from collections import OrderedDict
+from Utility.Logging_Extension import logger
+
+
+class FFmpegProgressEvent(object):
+    """
+    A block of the "-progress" output of ffmpeg, i.e. the key=value lines up to (and including) the "progress" key.
+    Values, which are not available (N/A), are None.
+    """
+
+    def __init__(self, values):
+        self.values = values
+        self.frame = FFmpegProgressEvent._parse_number(values.get('frame'), int)
+        self.fps = FFmpegProgressEvent._parse_number(values.get('fps'), float)
+        # e.g. "1.23x"
+        self.speed = FFmpegProgressEvent._parse_number(values.get('speed', '').rstrip('x'), float)
+        self.out_time_seconds = FFmpegProgressEvent._parse_out_time_seconds(values)
+        self.is_end = values.get('progress') == 'end'
+
+    def __str__(self):
+        return 'frame=' + str(self.frame) + \
+               ', fps=' + str(self.fps) + \
+               ', speed=' + str(self.speed) + \
+               ', out_time=' + str(self.out_time_seconds)
+
+    @staticmethod
+    def _parse_number(value, number_type):
+        try:
+            return number_type(value)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _parse_out_time_seconds(values):
+        # Note: "out_time_ms" contains (despite its name) microseconds as well
+        for key in ['out_time_us', 'out_time_ms']:
+            microseconds = FFmpegProgressEvent._parse_number(values.get(key), int)
+            if microseconds is not None:
+                return microseconds / 1e6
+        out_time = values.get('out_time')
+        if out_time is None:
+            return None
+        try:
+            hours, minutes, seconds = out_time.split(':')
+            return 3600 * int(hours) + 60 * int(minutes) + float(seconds)
+        except ValueError:
+            return None
+
+
+class FFmpegJob(object):
+    """
+    Metrics of a single ffmpeg call (see FFmpegProgressRunner.run)
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.return_code = None
+        self.wall_time = None
+        self.last_event = None
+        self.num_events = 0
+
+    def get_num_frames(self):
+        if self.last_event is None or self.last_event.frame is None:
+            return 0
+        return self.last_event.frame
+
+    def get_out_time_seconds(self):
+        if self.last_event is None:
+            return None
+        return self.last_event.out_time_seconds
+
+    def get_throughput(self):
+        """
+        :return: processed frames per second (wall time)
+        """
+        if not self.wall_time:
+            return None
+        return self.get_num_frames() / self.wall_time
+
+    def get_statistics(self):
+        statistics = OrderedDict()
+        statistics['return_code'] = self.return_code
+        statistics['wall_time'] = self.wall_time
+        statistics['num_frames'] = self.get_num_frames()
+        statistics['out_time_seconds'] = self.get_out_time_seconds()
+        statistics['throughput'] = self.get_throughput()
+        statistics['speed'] = None if self.last_event is None else self.last_event.speed
+        return statistics
+
+
+class FFmpegProgressRunner(object):
+
+    # https://ffmpeg.org/ffmpeg.html#toc-Main-options
+    #   -progress url (global)
+    #       Progress information is written approximately every second and at the end of the encoding process.
+    #       It is made of "key=value" lines. The last key of a sequence of progress information is always "progress".
+    #   -nostats (global)
+    #       Disables the default (human readable) statistics, e.g. if these are replaced by the progress events
+    progress_options = ['-progress', 'pipe:1']
+    no_stats_options = ['-nostats']
+
+    @staticmethod
+    def _add_progress_options(cmd_list_or_string, show_stats=True):
+        options = list(FFmpegProgressRunner.progress_options)
+        if not show_stats:
+            options += FFmpegProgressRunner.no_stats_options
+        # The options are global, i.e. they are placed directly after the executable
+        if isinstance(cmd_list_or_string, list):
+            return cmd_list_or_string[:1] + options + cmd_list_or_string[1:]
+        executable, arguments = cmd_list_or_string.strip().split(None, 1)
+        return executable + ' ' + ' '.join(options) + ' ' + arguments
+
+    @staticmethod
+    def run(cmd_list_or_string, shell=False, show_progress=False, progress_callback=None):
+        """
+        Runs ffmpeg and parses its "-progress" output into FFmpegProgressEvents
+
+        :param cmd_list_or_string: ffmpeg call (without progress options)
+        :param shell: must be True, if cmd_list_or_string is a string
+        :param show_progress: log each progress event
+        :param progress_callback: called with each FFmpegProgressEvent
+        :return: FFmpegJob (with return code, wall time and throughput)
+        """
+        # The default statistics of ffmpeg are only replaced, if the progress events are consumed
+        show_stats = not show_progress and progress_callback is None
+        cmd = FFmpegProgressRunner._add_progress_options(cmd_list_or_string, show_stats)
+        job = FFmpegJob(cmd)
+
+        start_time = time.time()
+        # The default information of ffmpeg (and user questions) are still written to stderr
+        sub_process = subprocess.Popen(cmd, shell=shell, stdout=subprocess.PIPE, universal_newlines=True)
+        values = OrderedDict()
+        for line in sub_process.stdout:
+            line = line.strip()
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            values[key] = value.strip()
+            if key == 'progress':
+                event = FFmpegProgressEvent(values)
+                job.last_event = event
+                job.num_events += 1
+                if show_progress:
+                    logger.info(str(event))
+                if progress_callback is not None:
+                    progress_callback(event)
+                values = OrderedDict()
+        job.return_code = sub_process.wait()
+        job.wall_time = time.time() - start_time
+
+        throughput = job.get_throughput()
+        logger.info('ffmpeg: return code ' + str(job.return_code) + ', ' +
+                    'frames ' + str(job.get_num_frames()) + ', ' +
+                    'wall time ' + '{:.2f}'.format(job.wall_time) + 's' +
+                    ('' if throughput is None else ', ' + '{:.1f}'.format(throughput) + ' frames/s'))
+        return job
@@ -2,7 +2,11 @@ __author__ = 'sebastian'
 
 import os
 import re
+import fractions
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathos.pools import ThreadPool
+from pathos.helpers import cpu_count
 
 from Utility.Printing import ils
 from Utility.Printing import print_salient_message
@@ -45,6 +49,182 @@ class FrameFromVideoExtractor:
             os.rename(os.path.join(folder, image_file_old_name_with_ext),
                       os.path.join(folder, image_file_new_name_with_ext))
 
+    @staticmethod
+    def convert_time_str_to_seconds(time):
+        hours, minutes, seconds = time.split(':')
+        return 3600 * int(hours) + 60 * int(minutes) + float(seconds)
+
+    @staticmethod
+    def get_video_duration(path_to_input_video):
+        cmd = ['ffprobe', '-v', 'error',
+               '-show_entries', 'format=duration',
+               '-of', 'default=noprint_wrappers=1:nokey=1',
+               path_to_input_video]
+        return float(subprocess.check_output(cmd).decode('utf-8').strip())
+
+    @staticmethod
+    def get_video_keyframe_times(path_to_input_video, start_seconds=None, end_seconds=None):
+        """
+        Reads only the packet headers (no decoding), i.e. this is fast also for long videos
+        :return: sorted list with the presentation times (in seconds) of the keyframes
+        """
+        cmd = ['ffprobe', '-v', 'error',
+               '-select_streams', 'v:0',
+               '-show_entries', 'packet=pts_time,flags',
+               '-of', 'csv=p=0']
+        if start_seconds is not None or end_seconds is not None:
+            interval_start = '' if start_seconds is None else '{:.6f}'.format(start_seconds)
+            interval_end = '' if end_seconds is None else '{:.6f}'.format(end_seconds)
+            cmd += ['-read_intervals', interval_start + '%' + interval_end]
+        cmd += [path_to_input_video]
+        output = subprocess.check_output(cmd).decode('utf-8')
+
+        keyframe_times = []
+        for line in output.splitlines():
+            entries = line.strip().split(',')
+            if len(entries) < 2 or entries[0] == 'N/A':
+                continue
+            pts_time, flags = entries[0], entries[1]
+            if 'K' in flags:
+                keyframe_times.append(float(pts_time))
+        return sorted(keyframe_times)
+
+    @staticmethod
+    def parse_frame_rate(frame_rate):
+        """
+        :param frame_rate: e.g. 12.5, '12.5' or '30000/1001' (ffmpeg notation of fractional frame rates)
+        :return: frame rate as float
+        """
+        return float(fractions.Fraction(frame_rate))
+
+    @staticmethod
+    def compute_keyframe_aligned_segments(start_seconds, end_seconds, keyframe_times, frame_rate, num_segments):
+        """
+        Splits [start_seconds, end_seconds) into (at most) num_segments segments starting at keyframes.
+
+        The segment boundaries are snapped to the output frame grid (i.e. to multiples of 1 / frame_rate
+        relative to start_seconds), so that each segment contains an integral number of output frames.
+        :param frame_rate: number (see parse_frame_rate)
+        :return: list of (segment_start_seconds, segment_end_seconds, first_output_index) tuples
+        """
+        segment_length = (end_seconds - start_seconds) / num_segments
+        boundary_indices = set()
+        if len(keyframe_times) > 0:
+            for segment_index in range(1, num_segments):
+                desired_time = start_seconds + segment_index * segment_length
+                keyframe_time = min(keyframe_times, key=lambda time: abs(time - desired_time))
+                output_index = int(round((keyframe_time - start_seconds) * frame_rate))
+                if 0 < output_index < (end_seconds - start_seconds) * frame_rate:
+                    boundary_indices.add(output_index)
+        boundary_indices = [0] + sorted(boundary_indices)
+
+        segments = []
+        for segment_index, output_index in enumerate(boundary_indices):
+            segment_start_seconds = start_seconds + output_index / frame_rate
+            if segment_index + 1 < len(boundary_indices):
+                segment_end_seconds = start_seconds + boundary_indices[segment_index + 1] / frame_rate
+            else:
+                segment_end_seconds = end_seconds
+            segments.append((segment_start_seconds, segment_end_seconds, output_index))
+        return segments
+
+    @staticmethod
+    def _extract_segment_images(path_to_input_video,
+                                output_path_and_frame_name_scheme,
+                                frame_rate,
+                                frame_rate_value,
+                                jpg_quality,
+                                segment_start_seconds,
+                                segment_end_seconds,
+                                first_output_index,
+                                is_last_segment):
+
+        options = []
+        options += ['-nostdin']
+        options += ['-loglevel', 'error']
+        # frame_rate is passed to ffmpeg unchanged (i.e. exact fractional frame rates are preserved),
+        # frame_rate_value is the corresponding number (see parse_frame_rate)
+        # Input seeking (i.e. -ss before -i) jumps directly to the keyframe at the segment start
+        options += ['-ss', '{:.6f}'.format(segment_start_seconds)]
+        options += ['-i', path_to_input_video]
+        options += ['-r', str(frame_rate)]
+        options += ['-qscale:v', str(jpg_quality)]
+        if is_last_segment:
+            options += ['-t', '{:.6f}'.format(segment_end_seconds - segment_start_seconds)]
+        else:
+            # An exact number of frames ensures that consecutive segments neither overlap nor leave gaps
+            num_frames = int(round((segment_end_seconds - segment_start_seconds) * frame_rate_value))
+            options += ['-frames:v', str(num_frames)]
+        options += ['-start_number', str(first_output_index)]
+        options += [output_path_and_frame_name_scheme]
+        return subprocess.call(['ffmpeg'] + options)
+
+    @staticmethod
+    def convert_video_to_images_segmented(path_to_input_video,
+                                          path_to_output_frames,
+                                          output_frame_name_scheme,
+                                          frame_rate,
+                                          jpg_quality=2,
+                                          start_time=None,
+                                          end_time=None,
+                                          num_segments=None,
+                                          indent_level_space=1):
+
+        """
+        Splits the video in keyframe aligned segments and extracts the segments with concurrent ffmpeg processes.
+        Each process writes its frames with the correct (global) index, i.e. no renaming is required.
+
+        :param num_segments: number of concurrent ffmpeg processes (defaults to the number of cpus)
+        """
+
+        if num_segments is None:
+            num_segments = cpu_count()
+
+        if FrameFromVideoExtractor.is_time_in_number_format(start_time):
+            start_seconds = FrameFromVideoExtractor.convert_time_str_to_seconds(start_time)
+        else:
+            start_seconds = 0.0
+        if FrameFromVideoExtractor.is_time_in_number_format(end_time):
+            end_seconds = FrameFromVideoExtractor.convert_time_str_to_seconds(end_time)
+        else:
+            end_seconds = FrameFromVideoExtractor.get_video_duration(path_to_input_video)
+        assert start_seconds < end_seconds
+        frame_rate_value = FrameFromVideoExtractor.parse_frame_rate(frame_rate)
+
+        keyframe_times = FrameFromVideoExtractor.get_video_keyframe_times(
+            path_to_input_video, start_seconds, end_seconds)
+        segments = FrameFromVideoExtractor.compute_keyframe_aligned_segments(
+            start_seconds, end_seconds, keyframe_times, frame_rate_value, num_segments)
+        print(ils(indent_level_space) + 'Number of segments: ' + str(len(segments)))
+
+        output_path_and_frame_name_scheme = os.path.join(
+            path_to_output_frames, output_frame_name_scheme)
+
+        # The work is done by the ffmpeg processes, i.e. threads are sufficient.
+        # Note: A private executor is required, since pathos returns the same (cached) ThreadPool for the same
+        # number of nodes, i.e. segments submitted from process_image_extraction_tasks would wait on a full pool
+        with ThreadPoolExecutor(len(segments)) as executor:
+            results = []
+            for segment_index, (segment_start_seconds, segment_end_seconds, first_output_index) in \
+                    enumerate(segments):
+                result = executor.submit(
+                    FrameFromVideoExtractor._extract_segment_images,
+                    path_to_input_video,
+                    output_path_and_frame_name_scheme,
+                    frame_rate,
+                    frame_rate_value,
+                    jpg_quality,
+                    segment_start_seconds,
+                    segment_end_seconds,
+                    first_output_index,
+                    segment_index == len(segments) - 1)
+                results.append(result)
+            return_codes = [result.result() for result in results]
+
+        for segment, return_code in zip(segments, return_codes):
+            if return_code != 0:
+                logger.info('Extraction of segment failed: ' + str(segment))
+
     @staticmethod
     def convert_video_to_images(path_to_input_video,
                                 path_to_output_frames,
@@ -53,7 +233,8 @@ class FrameFromVideoExtractor:
                                 jpg_quality=2,
                                 start_time=None,
                                 end_time=None,
-                                indent_level_space=1):
+                                indent_level_space=1,
+                                num_segments=1):
 
         """
 
@@ -65,6 +246,7 @@ class FrameFromVideoExtractor:
         :param start_time:
         :param end_time:
         :param indent_level_space:
+        :param num_segments: if larger than 1 (or None), the video is extracted in parallel segments
         :return:
         """
 
@@ -74,6 +256,20 @@ class FrameFromVideoExtractor:
         print(ils(indent_level_space + 1) + 'Start time: ' + str(start_time))
         print(ils(indent_level_space + 1) + 'End time: ' + str(end_time))
 
+        if num_segments is None or num_segments > 1:
+            FrameFromVideoExtractor.convert_video_to_images_segmented(
+                path_to_input_video,
+                path_to_output_frames,
+                output_frame_name_scheme,
+                frame_rate,
+                jpg_quality,
+                start_time,
+                end_time,
+                num_segments,
+                indent_level_space=indent_level_space+1)
+            print(ils(indent_level_space) + 'Converting video to images: Done')
+            return
+
         options = []
         options += ['-nostdin']
         #options += ['-loglevel quiet']
@@ -86,6 +282,8 @@ class FrameFromVideoExtractor:
             options += ["-ss", start_time]
         if FrameFromVideoExtractor.is_time_in_number_format(end_time):
             options += ["-to", end_time]
+        # let the image index start with 0 (instead of renaming the images afterwards)
+        options += ['-start_number', '0']
         output_path_and_frame_name_schmeme = os.path.join(
             path_to_output_frames, output_frame_name_scheme)
         options += [output_path_and_frame_name_schmeme]
@@ -93,10 +291,6 @@ class FrameFromVideoExtractor:
         # Call: ffmpeg -i path_to_video -r frame_rate -qscale:v jpg_quality path_to_output_frames_scheme_names
         subprocess.call(["ffmpeg"] + options)
 
-        #rename the images, so the index is starting with 0
-        FrameFromVideoExtractor.decrease_image_index_by_one(
-            path_to_output_frames, output_frame_name_scheme)
-
         print(ils(indent_level_space) + 'Converting video to images: Done')
 
 
@@ -132,7 +326,8 @@ class FrameFromVideoExtractor:
                                     jpg_quality,
                                     start_time,
                                     end_time,
-                                    indent_level_space=1):
+                                    indent_level_space=1,
+                                    num_segments=1):
 
         path_to_output_frames = os.path.join(path_to_output, output_name_scheme + frames_img_folder_suffix)
         print_salient_message('Outputfolder is: ' + path_to_output_frames)
@@ -152,7 +347,8 @@ class FrameFromVideoExtractor:
                 jpg_quality,
                 start_time,
                 end_time,
-                indent_level_space=indent_level_space+1)
+                indent_level_space=indent_level_space+1,
+                num_segments=num_segments)
 
     @staticmethod
     def process_video_extraction_tasks(tasks):
@@ -166,20 +362,39 @@ class FrameFromVideoExtractor:
                 indent_level_space=task.indent_level_space)
 
     @staticmethod
-    def process_image_extraction_tasks(tasks):
-        for task in tasks:
+    def _process_image_extraction_task(task):
 
-            logger.info(str(task))
+        logger.info(str(task))
 
-            FrameFromVideoExtractor.extract_images_if_necessary(
-                task.path_to_input_video,
-                task.path_to_output,
-                task.output_name_scheme,
-                task.frames_img_folder_suffix,
-                task.output_frame_name_scheme,
-                task.frame_rate,
-                task.jpg_quality,
-                task.start_time,
-                task.end_time,
-                indent_level_space=task.indent_level_space)
+        FrameFromVideoExtractor.extract_images_if_necessary(
+            task.path_to_input_video,
+            task.path_to_output,
+            task.output_name_scheme,
+            task.frames_img_folder_suffix,
+            task.output_frame_name_scheme,
+            task.frame_rate,
+            task.jpg_quality,
+            task.start_time,
+            task.end_time,
+            indent_level_space=task.indent_level_space,
+            num_segments=task.num_segments)
+
+    @staticmethod
+    def process_image_extraction_tasks(tasks, max_num_workers=None):
+        """
+        Processes independent tasks concurrently (at most max_num_workers at once)
+        :param max_num_workers: defaults to the number of cpus
+        """
+        if len(tasks) == 0:
+            return
+        if max_num_workers is None:
+            max_num_workers = cpu_count()
 
+        # The work is done by the ffmpeg processes, i.e. threads are sufficient
+        with ThreadPool(nodes=min(max_num_workers, len(tasks))) as pool:
+            results = []
+            for task in tasks:
+                result = pool.apipe(FrameFromVideoExtractor._process_image_extraction_task, task)
+                results.append(result)
+            for result in results:
+                result.get()
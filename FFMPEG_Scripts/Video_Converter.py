@@ -5,6 +5,7 @@ import sys
 import shlex
 import json
 from Utility.FFMPEG_Scripts.FFmpeg import FFmpeg
+from Utility.FFMPEG_Scripts.FFmpeg_Progress_Runner import FFmpegProgressRunner
 
 
 class Unbuffered(object):
@@ -117,7 +118,13 @@ class VideoConverter(object):
         return VideoConverter.get_video_resolution(ifp)[1]
 
     @staticmethod
-    def stack_videos_vertically(ifp_list, ofp, show_progress=False):
+    def stack_videos_vertically(ifp_list, ofp, show_progress=False, progress_callback=None):
+
+        """
+        :param show_progress: log the progress events (instead of the default statistics of ffmpeg)
+        :param progress_callback: called with each FFmpegProgressEvent
+        :return: FFmpegJob with the return code, the wall time and the throughput of the call
+        """
 
         assert isinstance(ifp_list, list)
         # https://stackoverflow.com/questions/11552565/vertically-or-horizontally-stack-several-videos-using-ffmpeg/33764934#33764934
@@ -130,13 +137,16 @@ class VideoConverter(object):
 
         cmd = [FFmpeg.path_to_executable] + options
 
-        if show_progress:
-            VideoConverter._run_and_show_progress_in_stderr(cmd)
-        else:
-            subprocess.call(cmd)
+        return VideoConverter._run(cmd, show_progress=show_progress, progress_callback=progress_callback)
 
     @staticmethod
-    def stack_videos_horizontally(ifp_list, ofp, lazy=False):
+    def stack_videos_horizontally(ifp_list, ofp, lazy=False, show_progress=False, progress_callback=None):
+
+        """
+        :param show_progress: log the progress events (instead of the default statistics of ffmpeg)
+        :param progress_callback: called with each FFmpegProgressEvent
+        :return: FFmpegJob with the return code, the wall time and the throughput of the call
+        """
 
         assert isinstance(ifp_list, list)
 
@@ -217,7 +227,7 @@ class VideoConverter(object):
         options += [ofp]
         stack_call = ['ffmpeg'] + options
         print(stack_call)
-        subprocess.call(stack_call)
+        return VideoConverter._run(stack_call, show_progress=show_progress, progress_callback=progress_callback)
 
     @staticmethod
     def extract_subpart_video(video_ifp,
@@ -349,7 +359,13 @@ class VideoConverter(object):
                     os.rename(path_to_temp_file, path_to_file)
 
     @staticmethod
-    def subsample_framerate(ifp, ofp, factor=1.0):
+    def subsample_framerate(ifp, ofp, factor=1.0, show_progress=False, progress_callback=None):
+
+        """
+        :param show_progress: log the progress events (instead of the default statistics of ffmpeg)
+        :param progress_callback: called with each FFmpegProgressEvent
+        :return: FFmpegJob with the return code, the wall time and the throughput of the call
+        """
 
         options = ''
         options += ' ' + '-i'
@@ -358,12 +374,18 @@ class VideoConverter(object):
         options += ' ' + '"setpts=' + str(factor) + '*PTS"'
 
         call_str = 'ffmpeg' + ' ' + options + ' ' + ofp
-        subprocess.call(call_str, shell=True)
+        return VideoConverter._run(
+            call_str, shell=True, show_progress=show_progress, progress_callback=progress_callback)
 
     @staticmethod
-    def resize_video(ifp, ofp, new_width=None, new_height=None):
+    def resize_video(ifp, ofp, new_width=None, new_height=None, show_progress=False, progress_callback=None):
 
-        """ Either new_width or new_height has to be provided """
+        """
+        Either new_width or new_height has to be provided
+        :param show_progress: log the progress events (instead of the default statistics of ffmpeg)
+        :param progress_callback: called with each FFmpegProgressEvent
+        :return: FFmpegJob with the return code, the wall time and the throughput of the call
+        """
 
         options = ''
         options += ' ' + '-i'
@@ -385,63 +407,22 @@ class VideoConverter(object):
 
         call_str = 'ffmpeg' + ' ' + options + ' ' + ofp
         print('call_str', call_str)
-        subprocess.call(call_str, shell=True)
+        return VideoConverter._run(
+            call_str, shell=True, show_progress=show_progress, progress_callback=progress_callback)
 
 
     @staticmethod
-    def _run_and_show_progress_in_stderr(cmd_list_or_string, shell=False):
-
-        # The argument "universal_newlines" is necessary that FFmpeg writes out the progress immediately
-        # https://docs.python.org/3/glossary.html#term-universal-newlines
-        sub_process = subprocess.Popen(cmd_list_or_string, shell=shell, stderr=subprocess.PIPE, universal_newlines=True)
-        output_str = ''
-        printed_user_question = False
-        condition = True
-        while condition:  # asynchronous reading of the information
-
-            if not printed_user_question:
-                symbol = sub_process.stderr.read(1)
-                sys.stderr.write(symbol)
-
-                output_str += symbol
-                if 'frame=' in output_str or 'Overwrite ? [y/N]' in output_str:
-                    printed_user_question = True
-
-            else:
-                line = sub_process.stderr.readline()
-                sys.stderr.write(line)
+    def _run(cmd_list_or_string, shell=False, show_progress=False, progress_callback=None):
+        """
+        :return: FFmpegJob with the return code, the wall time and the throughput of the call
+        """
+        return FFmpegProgressRunner.run(
+            cmd_list_or_string, shell=shell, show_progress=show_progress, progress_callback=progress_callback)
 
-                if line.rstrip() == '':
-                    condition = False
+    @staticmethod
+    def _run_and_show_progress_in_stderr(cmd_list_or_string, shell=False):
+        return VideoConverter._run(cmd_list_or_string, shell=shell, show_progress=True)
 
     @staticmethod
     def _run_and_show_progress_in_stdout(cmd):
-
-        # Note: Better use "_run_and_show_progress_in_stderr"
-
-        # The default information of ffmpeg is written to stderr,
-        # therefore we write the progress information to stdout
-        # This way the progress out put can be easily parsed
-        cmd += ['-progress', 'pipe:1']
-
-        # - Provide the "stdout=subprocess.PIPE" argument to read ANY output
-        #   of the subprocess with sub_process.stdout.readline()
-        # - Provide the "stderr=subprocess.PIPE" argument to read ANY output
-        #   of the subprocess with sub_process.stdout.readline()
-        # - Since we want to see the standard output of FFMPEG (which is written to stderr),
-        #   the following must not contain "stderr=subprocess.PIPE"
-        sub_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
-
-        # parse the output written by progress to pipe:1 and show only the relevant information
-        condition = True
-        while condition:    # asynchronous reading of the information
-
-            # Read the output of the subprocess from stdout
-            line = sub_process.stdout.readline()
-            line = line.rstrip()
-
-            print(line)
-
-            if line == 'progress=end':
-                 condition = False
-
+        return VideoConverter._run(cmd, show_progress=True)
@@ -0,0 +1,174 @@
+import json
+import subprocess
+import numpy as np
+from Utility.FFMPEG_Scripts.Frame_From_Video_Extractor import FrameFromVideoExtractor
+from Utility.Logging_Extension import logger
+
+
+class VideoFrameStreamer(object):
+    """
+    Decodes a video with ffmpeg into a pipe (-f rawvideo) and yields the
+    frames as numpy arrays, i.e. without writing (and re-reading) images.
+
+    The frames are read into a preallocated ring buffer of num_buffered_frames
+    slots. A yielded frame is a view of its slot, i.e. it is overwritten after
+    num_buffered_frames further frames (copy it, if it is needed longer).
+
+    with VideoFrameStreamer(ifp, frame_rate=12.5, gray_scale=True) as streamer:
+        for frame in streamer:
+            ...
+    """
+
+    def __init__(self,
+                 path_to_input_video,
+                 frame_rate=None,
+                 start_time=None,
+                 end_time=None,
+                 gray_scale=False,
+                 num_buffered_frames=4):
+        """
+        :param frame_rate: output frame rate (None keeps the frame rate of the video)
+        :param start_time: e.g. '00:01:30' or seconds
+        :param end_time: e.g. '00:02:00' or seconds
+        :param gray_scale: yield (H,W) gray scale frames instead of (H,W,3) rgb frames
+        """
+        assert num_buffered_frames >= 1
+
+        self.path_to_input_video = path_to_input_video
+        self.frame_rate = frame_rate
+        self.start_seconds = VideoFrameStreamer._convert_time_to_seconds(start_time)
+        self.end_seconds = VideoFrameStreamer._convert_time_to_seconds(end_time)
+        self.gray_scale = gray_scale
+        self.height, self.width = VideoFrameStreamer.get_video_resolution(path_to_input_video)
+
+        if gray_scale:
+            self.frame_shape = (self.height, self.width)
+        else:
+            self.frame_shape = (self.height, self.width, 3)
+        self.frame_num_bytes = int(np.prod(self.frame_shape))
+        self._ring_buffer = np.empty((num_buffered_frames,) + self.frame_shape, dtype=np.uint8)
+        self.num_read_frames = 0
+        self._sub_process = None
+        self._is_released = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def __iter__(self):
+        while True:
+            frame = self.read_next_frame()
+            if frame is None:
+                break
+            yield frame
+
+    @staticmethod
+    def _convert_time_to_seconds(time):
+        if time is None:
+            return None
+        if isinstance(time, (int, float)):
+            return float(time)
+        assert FrameFromVideoExtractor.is_time_in_number_format(time)
+        return FrameFromVideoExtractor.convert_time_str_to_seconds(time)
+
+    @staticmethod
+    def get_video_rotation(stream):
+        """
+        :param stream: video stream entry of the ffprobe json output
+        :return: rotation in degrees (0 if the stream has no rotation meta data)
+        """
+        # Newer ffmpeg versions store the rotation as display matrix side data, older ones as "rotate" tag
+        for side_data in stream.get('side_data_list', []):
+            if 'rotation' in side_data:
+                return int(float(side_data['rotation']))
+        return int(float(stream.get('tags', {}).get('rotate', 0)))
+
+    @staticmethod
+    def get_video_resolution(path_to_input_video):
+        """
+        :return: height and width of the frames written by ffmpeg, i.e. after applying the rotation meta data
+            (ffmpeg rotates the frames automatically, e.g. for portrait videos of phones)
+        """
+        cmd = ['ffprobe', '-v', 'quiet',
+               '-print_format', 'json',
+               '-select_streams', 'v:0',
+               '-show_streams',
+               path_to_input_video]
+        ffprobe_output = json.loads(subprocess.check_output(cmd).decode('utf-8'))
+        stream = ffprobe_output['streams'][0]
+        height, width = stream['height'], stream['width']
+        if VideoFrameStreamer.get_video_rotation(stream) % 180 != 0:
+            height, width = width, height
+        return height, width
+
+    def get_call(self):
+        options = []
+        options += ['-nostdin']
+        options += ['-loglevel', 'error']
+        if self.start_seconds is not None:
+            # Input seeking (i.e. -ss before -i) jumps directly to the closest keyframe
+            options += ['-ss', '{:.6f}'.format(self.start_seconds)]
+        options += ['-i', self.path_to_input_video]
+        if self.end_seconds is not None:
+            start_seconds = 0.0 if self.start_seconds is None else self.start_seconds
+            assert start_seconds < self.end_seconds
+            options += ['-t', '{:.6f}'.format(self.end_seconds - start_seconds)]
+        if self.frame_rate is not None:
+            options += ['-r', str(self.frame_rate)]
+        options += ['-an']
+        options += ['-f', 'rawvideo']
+        options += ['-pix_fmt', 'gray' if self.gray_scale else 'rgb24']
+        options += ['pipe:1']
+        return ['ffmpeg'] + options
+
+    def _start(self):
+        self._sub_process = subprocess.Popen(self.get_call(), stdout=subprocess.PIPE)
+
+    def read_next_frame(self):
+        """
+        :return: the next frame (a view into the ring buffer) or None if there are no frames left
+        """
+        if self._is_released:
+            return None
+        if self._sub_process is None:
+            self._start()
+
+        frame = self._ring_buffer[self.num_read_frames % len(self._ring_buffer)]
+        frame_bytes = memoryview(frame.reshape(-1))
+        num_received_bytes = 0
+        while num_received_bytes < self.frame_num_bytes:
+            num_bytes = self._sub_process.stdout.readinto(frame_bytes[num_received_bytes:])
+            if not num_bytes:
+                break
+            num_received_bytes += num_bytes
+
+        if num_received_bytes < self.frame_num_bytes:
+            if num_received_bytes > 0:
+                logger.info('VideoFrameStreamer: Ignoring incomplete frame at the end of the stream')
+            self.release()
+            return None
+
+        self.num_read_frames += 1
+        return frame
+
+    def release(self):
+        self._is_released = True
+        if self._sub_process is None:
+            return
+        is_terminated = False
+        if self._sub_process.poll() is None:
+            # The stream is released before the end of the video. Terminate ffmpeg before closing the pipe,
+            # otherwise ffmpeg reports (several) broken pipe errors while writing further frames
+            self._sub_process.terminate()
+            is_terminated = True
+            # Drain the pipe, so that a pending write of ffmpeg completes and ffmpeg can exit
+            while self._sub_process.stdout.read(self.frame_num_bytes):
+                pass
+        self._sub_process.stdout.close()
+        return_code = self._sub_process.wait()
+        if return_code != 0 and not is_terminated:
+            logger.vinfo('ffmpeg return code', return_code)
+        self._sub_process = None
+
@@ -4,6 +4,9 @@ import os
 import subprocess
 import platform
 import shutil
+import numpy as np
+from pathos.pools import ThreadPool
+from pathos.helpers import cpu_count
 
 from Utility.Logging_Extension import logger
 
@@ -209,21 +212,139 @@ class VideoFromImageCreator:
                 shutil.rmtree(path_to_images)
 
             if add_ignore_file:
-                # Create an ignore file, which avoids that this file is reread by the reconstruction pipeline
-                ignore_file_name = os.path.splitext(video_ofp)[0] + '_ignore.txt'
-                if not os.path.isfile(ignore_file_name):
-                    os.mknod(ignore_file_name)
+                self._create_ignore_file(video_ofp)
 
         else:
             logger.info('Do not create video, it already exists')
 
         logger.info('create_video_from_images:Done')
 
-    def process_video_creation_tasks(self, video_creation_tasks):
-        for video_creation_task in video_creation_tasks:
-            self.create_video_from_images(
-                path_to_images=video_creation_task.path_to_images,
-                video_ofp=video_creation_task.output_video_path)
+    @staticmethod
+    def _create_ignore_file(video_ofp):
+        # Create an ignore file, which avoids that this file is reread by the reconstruction pipeline
+        ignore_file_name = os.path.splitext(video_ofp)[0] + '_ignore.txt'
+        if not os.path.isfile(ignore_file_name):
+            os.mknod(ignore_file_name)
+
+    def create_video_from_frames(self,
+                                 frames,
+                                 video_ofp,
+                                 codec='libx264',
+                                 preset='medium',
+                                 num_threads=0,
+                                 add_ignore_file=True,
+                                 lazy=True):
+
+        """
+        Creates a video from in-memory frames by piping the raw frames into ffmpeg, i.e. without writing images
+
+        :param frames: iterable of (H,W,3) rgb or (H,W) gray scale uint8 arrays (all with the same shape)
+        :param codec: e.g. 'libx264', 'libx265' or 'mpeg4'
+        :param preset: encoder preset, e.g. 'ultrafast' or 'medium' (None for codecs without presets)
+        :param num_threads: number of encoder threads (0 lets ffmpeg choose)
+        :return: the number of encoded frames
+        """
+
+        logger.info('create_video_from_frames: ...')
+        logger.info("path_to_output_video_and_name: " + video_ofp)
+
+        if not lazy and os.path.isfile(video_ofp):
+            os.remove(video_ofp)
+
+        if os.path.isfile(video_ofp):
+            logger.info('Do not create video, it already exists')
+            logger.info('create_video_from_frames: Done')
+            return 0
+
+        frame_iterator = iter(frames)
+        first_frame = next(frame_iterator, None)
+        if first_frame is None:
+            logger.info('No frames provided')
+            logger.info('create_video_from_frames: Done')
+            return 0
+        frame_shape = first_frame.shape
+        assert len(frame_shape) == 2 or (len(frame_shape) == 3 and frame_shape[2] == 3)
+        height, width = frame_shape[0], frame_shape[1]
+
+        options = []
+        options += ['-loglevel', 'error']
+        options += ['-f', 'rawvideo']
+        options += ['-pix_fmt', 'gray' if len(frame_shape) == 2 else 'rgb24']
+        options += ['-s', str(width) + 'x' + str(height)]
+        options += ['-framerate', str(self.frame_rate)]
+        options += ['-i', 'pipe:0']
+        options += ['-c:v', codec]
+        if preset is not None:
+            options += ['-preset', preset]
+        options += ['-threads', str(num_threads)]
+        # Round uneven image dimensions (see create_video_from_images)
+        options += ['-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2']
+        options += ['-pix_fmt', 'yuv420p']
+        # Encode into a temporary file, which replaces video_ofp only on success. Otherwise, a truncated video
+        # would be considered as complete by subsequent (lazy) calls
+        video_stem, video_ext = os.path.splitext(video_ofp)
+        incomplete_video_ofp = video_stem + '_incomplete' + video_ext
+        options += ['-y', incomplete_video_ofp]
+
+        sub_process = subprocess.Popen(['ffmpeg'] + options, stdin=subprocess.PIPE)
+
+        num_frames = 0
+        all_frames_written = False
+        try:
+            frame = first_frame
+            while frame is not None:
+                assert frame.shape == frame_shape
+                assert frame.dtype == np.uint8
+                sub_process.stdin.write(np.ascontiguousarray(frame).data)
+                num_frames += 1
+                frame = next(frame_iterator, None)
+            all_frames_written = True
+        except BrokenPipeError:
+            logger.info('ffmpeg closed the pipe after ' + str(num_frames) + ' frames')
+        finally:
+            if not all_frames_written and sub_process.poll() is None:
+                # Prevent ffmpeg from finalizing a truncated video
+                sub_process.kill()
+            try:
+                sub_process.stdin.close()
+            except BrokenPipeError:
+                pass
+            return_code = sub_process.wait()
+            if all_frames_written and return_code == 0:
+                os.replace(incomplete_video_ofp, video_ofp)
+            elif os.path.isfile(incomplete_video_ofp):
+                os.remove(incomplete_video_ofp)
+
+        if return_code != 0:
+            logger.vinfo('ffmpeg return code', return_code)
+        elif add_ignore_file:
+            self._create_ignore_file(video_ofp)
+
+        logger.vinfo('num_frames', num_frames)
+        logger.info('create_video_from_frames: Done')
+        return num_frames
+
+    def process_video_creation_tasks(self, video_creation_tasks, max_num_workers=None):
+        """
+        Creates the videos concurrently (at most max_num_workers at once)
+        :param max_num_workers: defaults to the number of cpus
+        """
+        if len(video_creation_tasks) == 0:
+            return
+        if max_num_workers is None:
+            max_num_workers = cpu_count()
+
+        # The work is done by the ffmpeg processes, i.e. threads are sufficient
+        with ThreadPool(nodes=min(max_num_workers, len(video_creation_tasks))) as pool:
+            results = []
+            for video_creation_task in video_creation_tasks:
+                result = pool.apipe(
+                    self.create_video_from_images,
+                    path_to_images=video_creation_task.path_to_images,
+                    video_ofp=video_creation_task.output_video_path)
+                results.append(result)
+            for result in results:
+                result.get()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,245 @@
+import os
+import struct
+import numpy as np
+from Utility.Classes.Frozen_Class import FrozenClass
+from Utility.File_Handler.ext.read_write_model import CAMERA_MODEL_IDS
+from Utility.Logging_Extension import logger
+
+# See src/base/reconstruction.cc of Colmap for the binary format.
+# In contrast to ext/read_write_model.py, each file is read into a single
+# buffer and the fixed-width records are decoded with numpy structured dtypes.
+
+_camera_record_dtype = np.dtype([
+    ('camera_id', '<i4'), ('model_id', '<i4'), ('width', '<u8'), ('height', '<u8')])
+
+_image_record_dtype = np.dtype([
+    ('image_id', '<i4'), ('qvec', '<f8', (4,)), ('tvec', '<f8', (3,)), ('camera_id', '<i4')])
+
+_point2D_record_dtype = np.dtype([
+    ('xy', '<f8', (2,)), ('point3D_id', '<i8')])
+
+_point3D_record_dtype = np.dtype([
+    ('point3D_id', '<u8'), ('xyz', '<f8', (3,)), ('rgb', 'u1', (3,)), ('error', '<f8'), ('track_length', '<u8')])
+
+_track_element_dtype = np.dtype([
+    ('image_id', '<i4'), ('point2D_idx', '<i4')])
+
+
+def _extract_regions(buffer_array, region_starts, region_lengths):
+    """
+    Returns the concatenated bytes of the (sorted, non-overlapping) regions of buffer_array
+    """
+    non_empty = region_lengths > 0
+    region_starts = region_starts[non_empty]
+    region_ends = region_starts + region_lengths[non_empty]
+    # Mark the regions with +1 / -1 at their boundaries, the cumulative sum yields a mask of the
+    # region bytes (this avoids index arrays, which are 8 times larger than the selected bytes)
+    boundaries = np.zeros(len(buffer_array) + 1, dtype=np.int8)
+    boundaries[region_starts] += 1
+    boundaries[region_ends] -= 1
+    region_mask = np.cumsum(boundaries[:-1], dtype=np.int8).view(bool)
+    return buffer_array[region_mask]
+
+
+def _gather_records(buffer_array, record_offsets, record_dtype):
+    """
+    Decodes records of record_dtype starting at the given (sorted) byte offsets of buffer_array
+    """
+    record_lengths = np.full(len(record_offsets), record_dtype.itemsize, dtype=np.int64)
+    return _extract_regions(buffer_array, record_offsets, record_lengths).view(record_dtype)
+
+
+def _gather_variable_length_records(buffer_array, record_offsets, record_counts, record_dtype):
+    """
+    Decodes record_counts[i] consecutive records of record_dtype starting at record_offsets[i]
+    """
+    return _extract_regions(buffer_array, record_offsets, record_counts * record_dtype.itemsize).view(record_dtype)
+
+
+class ColmapCameraArrays(FrozenClass):
+    """
+    Camera models (intrinsics) of a Colmap reconstruction
+    """
+
+    def __init__(self, ids, model_names, widths, heights, params):
+        self.ids = ids
+        self.model_names = model_names      # list of str
+        self.widths = widths
+        self.heights = heights
+        self.params = params                # list of arrays (the number of params depends on the model)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class ColmapImageArrays(FrozenClass):
+    """
+    Registered images (extrinsics) of a Colmap reconstruction. The 2D keypoints
+    of image i are stored at point2D_offsets[i], ..., point2D_offsets[i+1] - 1
+    """
+
+    def __init__(self, ids, qvecs, tvecs, camera_ids, names, point2D_offsets, xys, point3D_ids):
+        self.ids = ids
+        self.qvecs = qvecs
+        self.tvecs = tvecs
+        self.camera_ids = camera_ids
+        self.names = names                  # list of str
+        self.point2D_offsets = point2D_offsets
+        self.xys = xys
+        self.point3D_ids = point3D_ids      # -1 denotes keypoints without a 3D point
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_xys(self, image_index):
+        return self.xys[self.point2D_offsets[image_index]: self.point2D_offsets[image_index + 1]]
+
+    def get_point3D_ids(self, image_index):
+        return self.point3D_ids[self.point2D_offsets[image_index]: self.point2D_offsets[image_index + 1]]
+
+    def get_image_indices(self, image_ids):
+        """
+        Maps Colmap image ids to (row) indices of this container
+        """
+        sorted_order = np.argsort(self.ids)
+        image_indices = sorted_order[np.searchsorted(self.ids, image_ids, sorter=sorted_order)]
+        assert np.all(self.ids[image_indices] == image_ids)
+        return image_indices
+
+
+class ColmapPoint3DArrays(FrozenClass):
+    """
+    3D points of a Colmap reconstruction. The track of point i is stored at
+    track_offsets[i], ..., track_offsets[i+1] - 1
+    """
+
+    def __init__(self, ids, xyzs, rgbs, errors, track_offsets, track_image_ids, track_point2D_idxs):
+        self.ids = ids
+        self.xyzs = xyzs
+        self.rgbs = rgbs
+        self.errors = errors
+        self.track_offsets = track_offsets
+        self.track_image_ids = track_image_ids
+        self.track_point2D_idxs = track_point2D_idxs
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class ColmapBinaryModelReader(object):
+
+    @staticmethod
+    def _read_buffer(ifp):
+        with open(ifp, 'rb') as binary_file:
+            buffer_bytes = binary_file.read()
+        return buffer_bytes, np.frombuffer(buffer_bytes, dtype=np.uint8)
+
+    @staticmethod
+    def read_cameras_binary(ifp):
+        buffer_bytes, buffer_array = ColmapBinaryModelReader._read_buffer(ifp)
+        num_cameras = int(buffer_array[:8].view('<u8')[0])
+
+        # The number of cameras is usually small, but the records have a variable size
+        record_offsets = np.empty(num_cameras, dtype=np.int64)
+        offset = 8
+        for camera_index in range(num_cameras):
+            record_offsets[camera_index] = offset
+            model_id = struct.unpack_from('<i', buffer_bytes, offset + 4)[0]
+            offset += _camera_record_dtype.itemsize + 8 * CAMERA_MODEL_IDS[model_id].num_params
+
+        records = _gather_records(buffer_array, record_offsets, _camera_record_dtype)
+        model_names = [CAMERA_MODEL_IDS[model_id].model_name for model_id in records['model_id']]
+        num_params = np.array(
+            [CAMERA_MODEL_IDS[model_id].num_params for model_id in records['model_id']], dtype=np.int64)
+        params_flat = _gather_variable_length_records(
+            buffer_array, record_offsets + _camera_record_dtype.itemsize, num_params, np.dtype('<f8'))
+        params = np.split(params_flat, np.cumsum(num_params)[:-1]) if num_cameras > 0 else []
+
+        return ColmapCameraArrays(
+            records['camera_id'].astype(np.int64),
+            model_names,
+            records['width'].astype(np.int64),
+            records['height'].astype(np.int64),
+            params)
+
+    @staticmethod
+    def read_images_binary(ifp):
+        buffer_bytes, buffer_array = ColmapBinaryModelReader._read_buffer(ifp)
+        num_images = int(buffer_array[:8].view('<u8')[0])
+
+        # Walk over the (variable length) image records. Only the name and the
+        # number of keypoints are read here, the data is decoded below.
+        record_offsets = np.empty(num_images, dtype=np.int64)
+        point2D_offsets = np.empty(num_images, dtype=np.int64)
+        num_points2D = np.empty(num_images, dtype=np.int64)
+        names = []
+        offset = 8
+        for image_index in range(num_images):
+            record_offsets[image_index] = offset
+            name_start = offset + _image_record_dtype.itemsize
+            name_end = buffer_bytes.index(b'\x00', name_start)
+            names.append(buffer_bytes[name_start:name_end].decode('utf-8'))
+            num_points2D[image_index] = struct.unpack_from('<Q', buffer_bytes, name_end + 1)[0]
+            point2D_offsets[image_index] = name_end + 1 + 8
+            offset = point2D_offsets[image_index] + num_points2D[image_index] * _point2D_record_dtype.itemsize
+
+        records = _gather_records(buffer_array, record_offsets, _image_record_dtype)
+        point2D_records = _gather_variable_length_records(
+            buffer_array, point2D_offsets, num_points2D, _point2D_record_dtype)
+
+        point2D_csr_offsets = np.zeros(num_images + 1, dtype=np.int64)
+        np.cumsum(num_points2D, out=point2D_csr_offsets[1:])
+
+        return ColmapImageArrays(
+            records['image_id'].astype(np.int64),
+            records['qvec'],
+            records['tvec'],
+            records['camera_id'].astype(np.int64),
+            names,
+            point2D_csr_offsets,
+            point2D_records['xy'],
+            point2D_records['point3D_id'])
+
+    @staticmethod
+    def read_points3d_binary(ifp):
+        buffer_bytes, buffer_array = ColmapBinaryModelReader._read_buffer(ifp)
+        num_points = int(buffer_array[:8].view('<u8')[0])
+
+        # The position of a record depends on the track lengths of all previous
+        # points, i.e. only the track lengths are read sequentially
+        record_offsets = np.empty(num_points, dtype=np.int64)
+        track_lengths = np.empty(num_points, dtype=np.int64)
+        track_length_offset = _point3D_record_dtype.fields['track_length'][1]
+        track_element_size = _track_element_dtype.itemsize
+        record_size = _point3D_record_dtype.itemsize
+        unpack_track_length = struct.Struct('<Q').unpack_from
+        offset = 8
+        for point_index in range(num_points):
+            record_offsets[point_index] = offset
+            track_length = unpack_track_length(buffer_bytes, offset + track_length_offset)[0]
+            track_lengths[point_index] = track_length
+            offset += record_size + track_element_size * track_length
+
+        records = _gather_records(buffer_array, record_offsets, _point3D_record_dtype)
+        track_elements = _gather_variable_length_records(
+            buffer_array, record_offsets + record_size, track_lengths, _track_element_dtype)
+
+        track_offsets = np.zeros(num_points + 1, dtype=np.int64)
+        np.cumsum(track_lengths, out=track_offsets[1:])
+
+        return ColmapPoint3DArrays(
+            records['point3D_id'].astype(np.int64),
+            records['xyz'],
+            records['rgb'],
+            records['error'],
+            track_offsets,
+            track_elements['image_id'].astype(np.int64),
+            track_elements['point2D_idx'].astype(np.int64))
+
+    @staticmethod
+    def read_model(model_idp):
+        logger.info('Read Colmap binary model: ' + model_idp)
+        cameras = ColmapBinaryModelReader.read_cameras_binary(os.path.join(model_idp, 'cameras.bin'))
+        images = ColmapBinaryModelReader.read_images_binary(os.path.join(model_idp, 'images.bin'))
+        points3D = ColmapBinaryModelReader.read_points3d_binary(os.path.join(model_idp, 'points3D.bin'))
+        return cameras, images, points3D
@@ -13,8 +13,12 @@ from Utility.File_Handler.ext.read_write_model import Camera as ColmapCamera
 from Utility.File_Handler.ext.read_write_model import Image as ColmapImage
 from Utility.File_Handler.ext.read_write_model import Point3D as ColmapPoint3D
 
+from Utility.File_Handler.Colmap_Binary_Model_Reader import ColmapBinaryModelReader
+
 from Utility.Types.Camera import Camera
 from Utility.Types.Point import Point
+from Utility.Types.Point_Cloud import PointCloud
+from Utility.Types.Track_Table import TrackTable
 
 
 # From photogrammetry_importer\ext\read_write_model.py
@@ -177,7 +181,66 @@ class ColmapFileHandler(object):
         return points3D
 
     @staticmethod
-    def parse_colmap_model_folder(model_idp, image_idp):
+    def convert_colmap_arrays_to_cams(col_camera_arrays, col_image_arrays, image_dp):
+        id_to_col_cameras = {}
+        for camera_index, camera_id in enumerate(col_camera_arrays.ids):
+            id_to_col_cameras[camera_id] = ColmapCamera(
+                id=camera_id,
+                model=col_camera_arrays.model_names[camera_index],
+                width=col_camera_arrays.widths[camera_index],
+                height=col_camera_arrays.heights[camera_index],
+                params=col_camera_arrays.params[camera_index])
+
+        # The key points are not used by convert_colmap_cams_to_cams(), i.e. views are sufficient
+        id_to_col_images = {}
+        for image_index, image_id in enumerate(col_image_arrays.ids):
+            id_to_col_images[image_id] = ColmapImage(
+                id=image_id,
+                qvec=col_image_arrays.qvecs[image_index],
+                tvec=col_image_arrays.tvecs[image_index],
+                camera_id=col_image_arrays.camera_ids[image_index],
+                name=col_image_arrays.names[image_index],
+                xys=col_image_arrays.get_xys(image_index),
+                point3D_ids=col_image_arrays.get_point3D_ids(image_index))
+
+        return ColmapFileHandler.convert_colmap_cams_to_cams(
+            id_to_col_cameras, id_to_col_images, image_dp)
+
+    @staticmethod
+    def convert_colmap_arrays_to_point_cloud(col_point3D_arrays, col_image_arrays):
+        """
+        The measurements contain IMAGE IDS (which correspond to the ids of the
+        cameras returned by convert_colmap_cams_to_cams())
+        """
+        track_image_ids = col_point3D_arrays.track_image_ids
+        track_point2D_idxs = col_point3D_arrays.track_point2D_idxs
+
+        # Look up the key point positions of all observations at once
+        image_indices = col_image_arrays.get_image_indices(track_image_ids)
+        point2D_indices = col_image_arrays.point2D_offsets[image_indices] + track_point2D_idxs
+        xys = col_image_arrays.xys[point2D_indices]
+
+        measurements = TrackTable(
+            col_point3D_arrays.track_offsets,
+            track_image_ids,
+            track_point2D_idxs,
+            xys[:, 0],
+            xys[:, 1],
+            x_y_are_image_coords=True)
+
+        return PointCloud(
+            col_point3D_arrays.xyzs,
+            col_point3D_arrays.rgbs,
+            ids=col_point3D_arrays.ids,
+            measurements=measurements)
+
+    @staticmethod
+    def parse_colmap_model_folder(model_idp, image_idp, as_point_cloud=False):
+
+        """
+        :param as_point_cloud: if True, the points are returned as PointCloud (instead of a list of Points).
+            Binary models are decoded with ColmapBinaryModelReader in this case.
+        """
 
         print('Parse Colmap model folder: ' + model_idp)
 
@@ -190,6 +253,15 @@ class ColmapFileHandler(object):
         else:
             assert False  # No valid model folder
 
+        if as_point_cloud and ext == '.bin':
+            col_camera_arrays, col_image_arrays, col_point3D_arrays = ColmapBinaryModelReader.read_model(
+                model_idp)
+            cameras = ColmapFileHandler.convert_colmap_arrays_to_cams(
+                col_camera_arrays, col_image_arrays, image_idp)
+            points3D = ColmapFileHandler.convert_colmap_arrays_to_point_cloud(
+                col_point3D_arrays, col_image_arrays)
+            return cameras, points3D
+
         # cameras represent information about the camera model
         # images contain pose information
         id_to_col_cameras, id_to_col_images, id_to_col_points3D = read_model(
@@ -200,6 +272,8 @@ class ColmapFileHandler(object):
 
         points3D = ColmapFileHandler.convert_colmap_points_to_points(
             id_to_col_points3D)
+        if as_point_cloud:
+            points3D = PointCloud.init_from_points(points3D)
 
         return cameras, points3D
 
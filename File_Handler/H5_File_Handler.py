@@ -2,6 +2,8 @@ __author__ = 'bullin'
 
 import h5py
 import matplotlib
+from functools import partial
+from Utility.Cache.Raster_Cache import raster_cache
 
 class H5FileHandler(object):
 
@@ -11,7 +13,13 @@ class H5FileHandler(object):
     # ==========================
 
     @staticmethod
-    def read_h5(file_path_and_name, dataset_name=None):
+    def read_h5(file_path_and_name, dataset_name=None, use_cache=False):
+
+        if use_cache:
+            return raster_cache.get(
+                file_path_and_name,
+                partial(H5FileHandler.read_h5, dataset_name=dataset_name),
+                loader_key=('read_h5', dataset_name))
 
         # if not os.path.isfile(file_path_and_name):
         #     logger.vinfo('file_path_and_name', file_path_and_name)
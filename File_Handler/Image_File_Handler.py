@@ -5,13 +5,16 @@ from PIL import ImageDraw
 import numpy as np
 import os
 from Utility.Logging_Extension import logger
+from Utility.Cache.Raster_Cache import raster_cache
 from pathos.multiprocessing import ProcessingPool
 from pathos.helpers import cpu_count
 
 class ImageFileHandler:
 
     @staticmethod
-    def read_image_as_np_array(file_path_and_name):
+    def read_image_as_np_array(file_path_and_name, use_cache=False):
+        if use_cache:
+            return raster_cache.get(file_path_and_name, ImageFileHandler.read_image_as_np_array)
         return np.asarray(Image.open(file_path_and_name).convert('L'))
 
     @staticmethod
@@ -1,6 +1,12 @@
 import os
 import dill
+import multiprocessing
+import numpy as np
+from pathos.multiprocessing import ProcessingPool
 from Utility.Types.Point import Point, Measurement
+from Utility.Types.Point_Cloud import PointCloud
+from Utility.Types.Track_Table import TrackTable
+from Utility.File_Handler.TXT_File_Handler import TXTFileHandler
 from Utility.Logging_Extension import logger
 
 from collections import defaultdict
@@ -19,10 +25,12 @@ class MVSColmapFileHandler:
         return dense_img_index_to_name
 
     @staticmethod
-    def parse_MVS_colmap_file(mvs_colmap_ifp, file_name_to_camera_id, with_nxnynz=True, n_th_point=1):
+    def parse_MVS_colmap_file(mvs_colmap_ifp, file_name_to_camera_id, with_nxnynz=True, n_th_point=1,
+                              as_point_cloud=False):
 
         """
         :param mvs_colmap_ifp:
+        :param as_point_cloud: if True, the points are returned as PointCloud (instead of a list of Points)
         :return:
         """
         logger.info('parse_MVS_colmap_file: ...')
@@ -30,7 +38,6 @@ class MVSColmapFileHandler:
         logger.vinfo('n_th_point', n_th_point)
 
         camera_index_to_current_feature_index = defaultdict(int)
-        points = []
 
         with open(mvs_colmap_ifp, 'r') as input_file:
 
@@ -72,34 +79,28 @@ class MVSColmapFileHandler:
             # POINT3D_ID, X, Y, Z, NX, NY, NZ, R, G, B, TRACK[] as (DENSE_IMAGE_ID, DENSE_COL, DENSE_ROW)
             remaining_content = remaining_content[::n_th_point]
             num_points = len(remaining_content)
+
+            coords = np.empty((num_points, 3), dtype=float)
+            normals = np.empty((num_points, 3), dtype=float) if with_nxnynz else None
+            colors = np.empty((num_points, 3), dtype=np.uint8)
+            measurements_per_point = []
+
             for index, point_line in enumerate(remaining_content):
 
                 if index % 100000 == 0:
                     logger.pinfo(index, num_points)
 
                 point_line_elements = (point_line.rstrip()).split()
-                current_point = Point()
 
-                # Adjust the point_3d id w.r.t n_th_point
-                point_3d_id = index     # int(point_line_elements[0])
-                current_point.id = point_3d_id
-
-                xyz_vec = list(map(float, point_line_elements[1:4]))
-                current_point.set_coord(xyz_vec)
+                coords[index] = list(map(float, point_line_elements[1:4]))
 
                 if with_nxnynz:
-                    nxnynz_vec = list(map(float, point_line_elements[4:7]))
-                    current_point.set_normal(nxnynz_vec)
-
-                    rgb_vec = list(map(int, point_line_elements[7:10]))
-                    current_point.set_color(rgb_vec)
-
+                    normals[index] = list(map(float, point_line_elements[4:7]))
+                    colors[index] = list(map(int, point_line_elements[7:10]))
                     img_id_col_row_triples_as_str = point_line_elements[10:]
 
                 else:
-                    rgb_vec = list(map(int, point_line_elements[4:7]))
-                    current_point.set_color(rgb_vec)
-
+                    colors[index] = list(map(int, point_line_elements[4:7]))
                     img_id_col_row_triples_as_str = point_line_elements[7:]
 
                 assert len(img_id_col_row_triples_as_str) % 3 == 0
@@ -128,12 +129,22 @@ class MVSColmapFileHandler:
 
                     camera_index_to_current_feature_index[camera_id] += 1
 
-                current_point.measurements = measurements
-                points.append(current_point)
+                measurements_per_point.append(measurements)
 
-            # Detect bad point ids
-            point_ids = [point.id for point in points]
-            assert len(list(set(point_ids))) == len(point_ids)
+        # Adjust the point_3d ids w.r.t n_th_point, i.e. point_3d_id = index (instead of int(point_line_elements[0]))
+        if as_point_cloud:
+            points = PointCloud(coords, colors, normals, measurements=measurements_per_point)
+        else:
+            points = []
+            for index in range(num_points):
+                current_point = Point()
+                current_point.id = index
+                current_point.set_coord(coords[index])
+                if with_nxnynz:
+                    current_point.set_normal(normals[index])
+                current_point.set_color(colors[index])
+                current_point.measurements = measurements_per_point[index]
+                points.append(current_point)
 
         # Compute REAL 2D image coordinates (the one of colmap are probably not correct)
         #cameras_background
@@ -141,6 +152,175 @@ class MVSColmapFileHandler:
 
         return points
 
+    @staticmethod
+    def _parse_MVS_colmap_header(mvs_colmap_ifp):
+        """
+        Returns the dense image names and the byte offset of the point section
+        """
+        dense_index_to_image_name = dict()
+        with open(mvs_colmap_ifp, 'rb') as input_file:
+            # first line is a comment
+            input_file.readline()
+            num_dense_images = int(input_file.readline().strip())
+            for index in range(num_dense_images):
+                dense_index_and_image_name = input_file.readline().decode().split()
+                assert len(dense_index_and_image_name) == 2
+                dense_index_to_image_name[int(dense_index_and_image_name[0])] = \
+                    dense_index_and_image_name[1]
+            # next 3 lines are comments
+            for index in range(3):
+                input_file.readline()
+            point_section_offset = input_file.tell()
+        return dense_index_to_image_name, point_section_offset
+
+    @staticmethod
+    def _compute_line_aligned_byte_ranges(mvs_colmap_ifp, section_start, num_chunks):
+        """
+        Splits [section_start, file_size) into (at most) num_chunks ranges, which start at line beginnings
+        """
+        file_size = os.path.getsize(mvs_colmap_ifp)
+        chunk_starts = [section_start]
+        with open(mvs_colmap_ifp, 'rb') as input_file:
+            for chunk_index in range(1, num_chunks):
+                approximate_start = section_start + (file_size - section_start) * chunk_index // num_chunks
+                if approximate_start <= chunk_starts[-1]:
+                    continue
+                # Move to the beginning of the next line
+                input_file.seek(approximate_start - 1)
+                input_file.readline()
+                chunk_start = input_file.tell()
+                if chunk_starts[-1] < chunk_start < file_size:
+                    chunk_starts.append(chunk_start)
+        chunk_ends = chunk_starts[1:] + [file_size]
+        return list(zip(chunk_starts, chunk_ends))
+
+    @staticmethod
+    def _read_byte_range(mvs_colmap_ifp, byte_range):
+        with open(mvs_colmap_ifp, 'rb') as input_file:
+            input_file.seek(byte_range[0])
+            return input_file.read(byte_range[1] - byte_range[0])
+
+    @staticmethod
+    def _parse_MVS_colmap_byte_range(mvs_colmap_ifp, byte_range, with_nxnynz):
+        """
+        Parses all points (lines) of a byte range into columnar arrays.
+        Note: The selection of every n-th point requires the global line indices, i.e. it is done afterwards
+        """
+        range_bytes = MVSColmapFileHandler._read_byte_range(mvs_colmap_ifp, byte_range)
+        # The last line of the file may not be terminated
+        num_points = range_bytes.count(b'\n')
+        if len(range_bytes) > 0 and not range_bytes.endswith(b'\n'):
+            num_points += 1
+
+        # POINT3D_ID, X, Y, Z, NX, NY, NZ, R, G, B, TRACK[] as (DENSE_IMAGE_ID, DENSE_COL, DENSE_ROW)
+        values, values_per_point = TXTFileHandler.tokenize_numeric_lines(range_bytes, num_points)
+        num_header_values = 10 if with_nxnynz else 7
+        header_offsets = np.zeros(num_points, dtype=np.int64)
+        np.cumsum(values_per_point[:-1], out=header_offsets[1:])
+        header_values = values[header_offsets[:, np.newaxis] + np.arange(num_header_values)]
+
+        track_lengths, remainder = np.divmod(values_per_point - num_header_values, 3)
+        assert np.all(remainder == 0)
+
+        is_track_value = np.ones(len(values), dtype=bool)
+        is_track_value[(header_offsets[:, np.newaxis] + np.arange(num_header_values)).ravel()] = False
+        track_mat = values[is_track_value].reshape((-1, 3))
+
+        coords = header_values[:, 1:4]
+        if with_nxnynz:
+            normals = header_values[:, 4:7]
+            colors = header_values[:, 7:10].astype(np.uint8)
+        else:
+            normals = None
+            colors = header_values[:, 4:7].astype(np.uint8)
+
+        return coords, normals, colors, track_lengths, track_mat[:, 0].astype(np.int64), track_mat[:, 1], track_mat[:, 2]
+
+    @staticmethod
+    def parse_MVS_colmap_file_parallel(mvs_colmap_ifp, file_name_to_camera_id, with_nxnynz=True, n_th_point=1,
+                                       as_point_cloud=True, num_chunks=None):
+
+        """
+        Parallel version of parse_MVS_colmap_file(), which yields the same points and measurements.
+        The point section is split into byte ranges (on line boundaries), which are tokenized in a process pool.
+        :param mvs_colmap_ifp:
+        :param num_chunks: number of byte ranges (by default, 4 times the number of cpus)
+        :return:
+        """
+        logger.info('parse_MVS_colmap_file_parallel: ...')
+        logger.vinfo('mvs_colmap_ifp', mvs_colmap_ifp)
+        logger.vinfo('n_th_point', n_th_point)
+
+        if num_chunks is None:
+            num_chunks = 4 * multiprocessing.cpu_count()
+
+        dense_index_to_image_name, point_section_offset = MVSColmapFileHandler._parse_MVS_colmap_header(
+            mvs_colmap_ifp)
+        byte_ranges = MVSColmapFileHandler._compute_line_aligned_byte_ranges(
+            mvs_colmap_ifp, point_section_offset, num_chunks)
+
+        with ProcessingPool() as pool:
+            results = []
+            for byte_range in byte_ranges:
+                result = pool.apipe(
+                    MVSColmapFileHandler._parse_MVS_colmap_byte_range,
+                    *[mvs_colmap_ifp, byte_range, with_nxnynz])
+                results.append(result)
+            chunk_results = [result.get() for result in results]
+
+        if len(chunk_results) > 0:
+            coords, normals, colors, track_lengths, dense_image_ids, cols, rows = [
+                np.concatenate(chunk_arrays) if chunk_arrays[0] is not None else None
+                for chunk_arrays in zip(*chunk_results)]
+        else:
+            coords, colors = np.empty((0, 3), dtype=float), np.empty((0, 3), dtype=np.uint8)
+            normals = np.empty((0, 3), dtype=float) if with_nxnynz else None
+            track_lengths = np.empty(0, dtype=np.int64)
+            dense_image_ids, cols, rows = np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+
+        if n_th_point > 1:
+            # Select the same points as the sequential parser (i.e. the lines with line_index % n_th_point == 0)
+            is_selected = np.arange(len(track_lengths)) % n_th_point == 0
+            is_selected_measurement = np.repeat(is_selected, track_lengths)
+            coords, colors = coords[is_selected], colors[is_selected]
+            if normals is not None:
+                normals = normals[is_selected]
+            track_lengths = track_lengths[is_selected]
+            dense_image_ids = dense_image_ids[is_selected_measurement]
+            cols, rows = cols[is_selected_measurement], rows[is_selected_measurement]
+
+        # DENSE_IMAGE_ID != CAMERA_ID and DENSE_IMAGE_ID != IMAGE_ID
+        if file_name_to_camera_id is not None:
+            # Like the sequential parser, this raises a KeyError for unknown dense image ids
+            unique_dense_image_ids, inverse_indices = np.unique(dense_image_ids, return_inverse=True)
+            camera_ids_of_unique_dense_image_ids = np.array(
+                [file_name_to_camera_id[dense_index_to_image_name[int(dense_image_id)]]
+                 for dense_image_id in unique_dense_image_ids],
+                dtype=np.int64)
+            camera_ids = camera_ids_of_unique_dense_image_ids[inverse_indices.reshape(-1)]
+        else:
+            camera_ids = dense_image_ids
+
+        # The feature index of a measurement is the number of previous measurements in the same camera
+        # (w.r.t. the global order of the measurements)
+        sorted_order = np.argsort(camera_ids, kind='stable')
+        sorted_camera_ids = camera_ids[sorted_order]
+        is_group_start = np.concatenate(([True], sorted_camera_ids[1:] != sorted_camera_ids[:-1]))
+        group_starts = np.flatnonzero(is_group_start)
+        ranks_in_sorted_order = np.arange(len(camera_ids)) - np.repeat(
+            group_starts, np.diff(np.append(group_starts, len(camera_ids))))
+        feature_indices = np.empty(len(camera_ids), dtype=np.int64)
+        feature_indices[sorted_order] = ranks_in_sorted_order
+
+        measurements = TrackTable.init_from_track_lengths(
+            track_lengths, camera_ids, feature_indices, cols, rows, x_y_are_image_coords=True)
+        points = PointCloud(coords, colors, normals, measurements=measurements)
+        if not as_point_cloud:
+            points = points.to_points()
+
+        logger.info('parse_MVS_colmap_file_parallel: Done')
+        return points
+
     @staticmethod
     def write_MVS_colmap_file(points, dense_id_to_file_name, mvs_colmap_ofp):
         logger.info('write_MVS_colmap_file: ...')
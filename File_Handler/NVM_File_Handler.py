@@ -7,6 +7,9 @@ from Utility.Logging_Extension import logger
 from Utility.Types.Camera import Camera
 from Utility.Types.Point import Measurement
 from Utility.Types.Point import Point
+from Utility.Types.Point_Cloud import PointCloud
+from Utility.Types.Track_Table import TrackTable
+from Utility.File_Handler.TXT_File_Handler import TXTFileHandler
 from Utility.Math.Conversion.Conversion_Collection import compute_camera_coordinate_system_translation_vector
 
 
@@ -157,9 +160,67 @@ class NVMFileHandler(object):
 
         return points
 
+    @staticmethod
+    def _parse_nvm_points_as_point_cloud(input_file, num_3D_points):
+
+        """
+        Reads the point section as a single buffer and tokenizes it in bulk,
+        i.e. without a python loop over the points or the measurements.
+        """
+
+        # <Point>  = <XYZ> <RGB> <number of measurements> <List of Measurements>
+        # <Measurement> = <Image index> <Feature Index> <xy>
+        # x and y are relative to the image center (see _parse_nvm_points())
+        num_header_values = 7
+        num_measurement_values = 4
+
+        if num_3D_points == 0:
+            return PointCloud(np.empty((0, 3), dtype=float), measurements=TrackTable([0], [], [], [], []))
+
+        remaining_bytes = input_file.read().encode()
+
+        # Each point is stored in a single line, i.e. the point section ends with the n-th line
+        newline_positions = np.flatnonzero(np.frombuffer(remaining_bytes, dtype=np.uint8) == ord('\n'))
+        if len(newline_positions) >= num_3D_points:
+            section_end = newline_positions[num_3D_points - 1]
+        else:
+            section_end = len(remaining_bytes)
+
+        values, values_per_point = TXTFileHandler.tokenize_numeric_lines(
+            remaining_bytes[:section_end], num_3D_points)
+
+        header_offsets = np.zeros(num_3D_points, dtype=np.int64)
+        np.cumsum(values_per_point[:-1], out=header_offsets[1:])
+        header_indices = header_offsets[:, np.newaxis] + np.arange(num_header_values)
+        header_values = values[header_indices]
+
+        coords = header_values[:, 0:3]
+        colors = header_values[:, 3:6].astype(np.uint8)
+        track_lengths = header_values[:, 6].astype(np.int64)
+        assert np.all(values_per_point == num_header_values + num_measurement_values * track_lengths)
+
+        is_measurement_value = np.ones(len(values), dtype=bool)
+        is_measurement_value[header_indices.ravel()] = False
+        measurement_mat = values[is_measurement_value].reshape((-1, num_measurement_values))
+        measurements = TrackTable.init_from_track_lengths(
+            track_lengths,
+            measurement_mat[:, 0].astype(np.int64),
+            measurement_mat[:, 1].astype(np.int64),
+            measurement_mat[:, 2],
+            measurement_mat[:, 3])
+
+        return PointCloud(coords, colors, measurements=measurements)
+
     @staticmethod
     def _set_point_measurement_interval_flag(points):
 
+        if isinstance(points, PointCloud):
+            track_table = points.measurements
+            negative_value_found = track_table.get_num_observations() > 0 and \
+                min(track_table.xs.min(), track_table.ys.min()) < 0
+            track_table.x_y_are_image_coords = not negative_value_found
+            return
+
         negative_value_found = False
         for point in points:
             for measurement in point.measurements:
@@ -187,12 +248,14 @@ class NVMFileHandler(object):
         return calib_mat
 
     @staticmethod
-    def parse_nvm_file(input_visual_fsm_file_name, parse_only_cams=False):
+    def parse_nvm_file(input_visual_fsm_file_name, parse_only_cams=False, as_point_cloud=False):
 
         """
         Remark:
             VisualSFM stores measurements coordinates within [-width/2, width/2] x [-height/2, height/2]
             Colmap stores measurements coordinates within [0, width] x [0, height]
+
+        :param as_point_cloud: if True, the points are returned as PointCloud (instead of a list of Points)
         """
 
         logger.info('Parse NVM file: ' + str(input_visual_fsm_file_name))
@@ -229,11 +292,17 @@ class NVMFileHandler(object):
         if current_line.isdigit() and not parse_only_cams:
             amount_points = int(current_line)
             logger.info(logger.ils() + 'Amount Sparse Points (Points in NVM file): ' + str(amount_points))
-            points = NVMFileHandler._parse_nvm_points(input_file, amount_points)
+            if as_point_cloud:
+                points = NVMFileHandler._parse_nvm_points_as_point_cloud(input_file, amount_points)
+            else:
+                points = NVMFileHandler._parse_nvm_points(input_file, amount_points)
             NVMFileHandler._set_point_measurement_interval_flag(points)
 
         else:
-            points = []
+            if as_point_cloud:
+                points = PointCloud(np.empty((0, 3), dtype=float))
+            else:
+                points = []
 
         logger.info('Parse NVM file: Done')
         return cameras, points
@@ -1,16 +1,19 @@
 __author__ = 'bullin'
 
 import numpy as np
+from collections import OrderedDict
 from Utility.Types.Point import Point
 # try:
 #     from plyfile import PlyData, PlyElement
 # except:
-#     from Utility.File_Handler.ext.plyfile import PlyData, PlyElement
-from Utility.File_Handler.ext.plyfile import PlyData, PlyElement
+#     from Utility.File_Handler.ext.plyfile import PlyData, PlyElement, PlyListProperty
+from Utility.File_Handler.ext.plyfile import PlyData, PlyElement, PlyListProperty
 
 from Utility.Types.Face import Face
 from Utility.Logging_Extension import logger
 from Utility.Types.Point import Point, Measurement
+from Utility.Types.Point_Cloud import PointCloud
+from Utility.Types.Track_Table import TrackTable
 
 
 # REMARK: In PLY file format FLOAT is SINGLE precision (32 bit) and DOUBLE is DOUBLE PRECISION (64 bit)
@@ -62,6 +65,57 @@ class PLYFileHandler:
 
         return vertices, ply_data_vertex_dtype, ply_data_vertex_data_dtype
 
+    @staticmethod
+    def __ply_data_vertices_to_point_cloud(ply_data):
+        return PLYFileHandler.__vertex_data_to_point_cloud(ply_data['vertex'].data)
+
+    @staticmethod
+    def __vertex_data_to_point_cloud(vertex_data):
+
+        vertex_data_type_names = vertex_data.dtype.names
+
+        value_keys = [x for x, y in sorted(vertex_data.dtype.fields.items(), key=lambda k: k[1])]
+        non_scalar_value_keys = ['x', 'y', 'z', 'red', 'green', 'blue', 'nx', 'ny', 'nz', 'measurements']
+        scalar_value_keys = [value_key for value_key in value_keys if not value_key in non_scalar_value_keys]
+        logger.info('Found the following vertex properties: ' + str(value_keys))
+        logger.info('Found ' + str(len(vertex_data)) + ' vertices')
+
+        coords = np.column_stack((vertex_data['x'], vertex_data['y'], vertex_data['z']))
+
+        colors = None
+        if 'red' in vertex_data_type_names and 'green' in vertex_data_type_names and 'blue' in vertex_data_type_names:
+            colors = np.column_stack((vertex_data['red'], vertex_data['green'], vertex_data['blue']))
+
+        normals = None
+        if 'nx' in vertex_data_type_names and 'ny' in vertex_data_type_names and 'nz' in vertex_data_type_names:
+            normals = np.column_stack((vertex_data['nx'], vertex_data['ny'], vertex_data['nz']))
+
+        scalars = OrderedDict(
+            [(scalar_value_key, np.asarray(vertex_data[scalar_value_key]))
+             for scalar_value_key in scalar_value_keys])
+
+        measurements = None
+        if 'measurements' in vertex_data_type_names:
+            elements_per_measurement = 4
+            measurement_lists = vertex_data['measurements']
+            track_lengths = np.array(
+                [len(measurement_values) // elements_per_measurement for measurement_values in measurement_lists],
+                dtype=np.int64)
+            if len(measurement_lists) > 0 and track_lengths.sum() > 0:
+                measurement_mat = np.concatenate(
+                    [np.asarray(measurement_values, dtype=float) for measurement_values in measurement_lists]
+                ).reshape((-1, elements_per_measurement))
+            else:
+                measurement_mat = np.zeros((0, elements_per_measurement), dtype=float)
+            measurements = TrackTable.init_from_track_lengths(
+                track_lengths,
+                measurement_mat[:, 0].astype(np.int64),
+                measurement_mat[:, 1].astype(np.int64),
+                measurement_mat[:, 2],
+                measurement_mat[:, 3])
+
+        return PointCloud(coords, colors, normals, scalars, measurements=measurements)
+
     @staticmethod
     def __ply_data_faces_to_face_list(ply_data):
         faces = []
@@ -101,11 +155,49 @@ class PLYFileHandler:
         return faces, ply_data_face_type, ply_data_face_data_type
 
 
+    @staticmethod
+    def __point_cloud_to_ply_vertex_array(point_cloud, ply_data_vertex_data_dtype):
+
+        # Assign complete columns instead of single points
+        vertex_output_array = np.empty((len(point_cloud),), dtype=ply_data_vertex_data_dtype)
+        names = ply_data_vertex_data_dtype.names
+
+        for dim_index, dim_name in enumerate(['x', 'y', 'z']):
+            vertex_output_array[dim_name] = point_cloud.coords[:, dim_index]
+
+        if 'red' in names and 'green' in names and 'blue' in names:
+            for dim_index, dim_name in enumerate(['red', 'green', 'blue']):
+                vertex_output_array[dim_name] = point_cloud.colors[:, dim_index]
+
+        if 'nx' in names and 'ny' in names and 'nz' in names:
+            for dim_index, dim_name in enumerate(['nx', 'ny', 'nz']):
+                vertex_output_array[dim_name] = point_cloud.normals[:, dim_index]
+
+        for scalar_key, scalar_values in point_cloud.scalars.items():
+            vertex_output_array[scalar_key] = scalar_values
+
+        if 'measurements' in names:
+            track_table = point_cloud.measurements
+            measurement_mat = track_table.get_measurement_mat()
+            for index in range(len(point_cloud)):
+                start, end = track_table.get_track_range(index)
+                vertex_output_array[index]['measurements'] = measurement_mat[start:end].ravel()
+
+        return vertex_output_array
+
     @staticmethod
     def __vertices_to_ply_vertex_element(point_list, ply_data_vertex_data_dtype_list):
 
         ply_data_vertex_data_dtype = np.dtype(ply_data_vertex_data_dtype_list)
 
+        if isinstance(point_list, PointCloud):
+            vertex_output_array = PLYFileHandler.__point_cloud_to_ply_vertex_array(
+                point_list, ply_data_vertex_data_dtype)
+            return PlyElement.describe(
+                vertex_output_array,
+                name='vertex',
+                val_types={'measurements': 'float'})
+
         # if measurements are used, then we do not know one dimension of the array
         vertex_output_array = np.empty((len(point_list),), dtype=ply_data_vertex_data_dtype)
 
@@ -234,13 +326,123 @@ class PLYFileHandler:
 
         return vertices, faces
 
+    @staticmethod
+    def parse_ply_file_as_point_cloud(path_to_file):
+        """
+        Returns the vertices as PointCloud (instead of a list of Points)
+
+        Vertex-only binary files with fixed-size properties are mapped with
+        np.memmap, all other files are parsed with plyfile.
+        """
+        logger.info('Parse PLY File as point cloud: ...')
+        logger.vinfo('path_to_file', path_to_file)
+
+        ply_data_header, data_offset = PLYFileHandler.__parse_ply_header(path_to_file)
+        vertex_layout = PLYFileHandler.__get_memmap_vertex_layout(ply_data_header, data_offset)
+        element_names = [element.name for element in ply_data_header.elements]
+
+        if vertex_layout is not None and element_names == ['vertex']:
+            vertex_data = PLYFileHandler.parse_ply_file_as_memmap(path_to_file)
+            point_cloud = PLYFileHandler.__vertex_data_to_point_cloud(vertex_data)
+            faces = []
+        else:
+            ply_data = PlyData.read(path_to_file)
+            point_cloud = PLYFileHandler.__ply_data_vertices_to_point_cloud(ply_data)
+            faces, _, _ = PLYFileHandler.__ply_data_faces_to_face_list(ply_data)
+
+        logger.info('Parse PLY File as point cloud: Done')
+
+        return point_cloud, faces
+
+    @staticmethod
+    def __parse_ply_header(path_to_file):
+        """
+        Returns the header (PlyData without element data) and the byte offset of the data section
+        """
+        with open(path_to_file, 'rb') as ply_file:
+            ply_data_header = PlyData._parse_header(ply_file)
+            data_offset = ply_file.tell()
+        return ply_data_header, data_offset
+
+    @staticmethod
+    def __get_memmap_vertex_layout(ply_data_header, data_offset):
+        """
+        Returns the vertex dtype (as stored on disk), the byte offset and the
+        number of vertices, if the vertex block of the file can be mapped
+        directly. Otherwise, the method returns None.
+        This requires a binary file, where the vertex element contains only
+        fixed-size properties and all preceding elements have a fixed size.
+        """
+        if ply_data_header.text:
+            return None
+
+        offset = data_offset
+        for element in ply_data_header.elements:
+            has_list_properties = any(
+                isinstance(ply_property, PlyListProperty) for ply_property in element.properties)
+            if has_list_properties:
+                return None
+            element_dtype = element.dtype(ply_data_header.byte_order)
+            if element.name == 'vertex':
+                return element_dtype, offset, element.count
+            offset += element.count * element_dtype.itemsize
+        return None
+
+    @staticmethod
+    def is_ply_file_memmappable(path_to_file):
+        return PLYFileHandler.__get_memmap_vertex_layout(
+            *PLYFileHandler.__parse_ply_header(path_to_file)) is not None
+
+    @staticmethod
+    def parse_ply_file_as_memmap(path_to_file, columnar=False):
+        """
+        Maps the vertex block of a binary PLY file (with fixed-size vertex
+        properties) into memory WITHOUT reading / copying the data.
+        :param columnar: if True, returns an ordered dict mapping each vertex
+            property to a (strided) view of the memory map
+        :return: read-only structured memmap (or ordered dict of column views)
+        """
+        logger.info('Parse PLY File as memmap: ...')
+        logger.vinfo('path_to_file', path_to_file)
+
+        vertex_layout = PLYFileHandler.__get_memmap_vertex_layout(
+            *PLYFileHandler.__parse_ply_header(path_to_file))
+        assert vertex_layout is not None    # Use parse_ply_file() for ascii files or list properties
+        vertex_dtype, offset, num_vertices = vertex_layout
+        logger.info('Found ' + str(num_vertices) + ' vertices')
+
+        if num_vertices == 0:
+            vertex_data = np.empty(0, dtype=vertex_dtype)
+        else:
+            vertex_data = np.memmap(
+                path_to_file, dtype=vertex_dtype, mode='r', offset=offset, shape=(num_vertices,))
+
+        logger.info('Parse PLY File as memmap: Done')
+        if columnar:
+            return OrderedDict([(name, vertex_data[name]) for name in vertex_dtype.names])
+        return vertex_data
+
+    @staticmethod
+    def iterate_ply_file_vertex_chunks(path_to_file, chunk_size=1000000, as_point_cloud=False):
+        """
+        Yields the vertices of a binary PLY file in chunks of (at most) chunk_size
+        vertices. Only the pages of the current chunk are loaded, which allows
+        to process clouds that are bigger than the main memory.
+        :param as_point_cloud: if True, yields PointClouds (otherwise views of the structured memmap)
+        """
+        assert chunk_size > 0
+        vertex_data = PLYFileHandler.parse_ply_file_as_memmap(path_to_file)
+        for chunk_start in range(0, len(vertex_data), chunk_size):
+            vertex_data_chunk = vertex_data[chunk_start: chunk_start + chunk_size]
+            if as_point_cloud:
+                yield PLYFileHandler.__vertex_data_to_point_cloud(vertex_data_chunk)
+            else:
+                yield vertex_data_chunk
+
     @staticmethod
     def write_ply_file_from_vertex_mat(output_path_to_file,
                                        vertex_mat):
-        vertices = []
-        for entry in vertex_mat:
-            vertices.append(Point(coord=entry))
-        PLYFileHandler.write_ply_file(output_path_to_file, vertices)
+        PLYFileHandler.write_ply_file(output_path_to_file, PointCloud(vertex_mat))
 
     @staticmethod
     def build_type_list(vertices, with_colors, with_normals, with_measurements):
@@ -259,6 +461,106 @@ class PLYFileHandler:
                 ply_data_vertex_data_dtype_list += [('measurements', object)]
         return ply_data_vertex_data_dtype_list
 
+    @staticmethod
+    def build_vertex_dtype(with_colors, with_normals, scalar_keys=()):
+        ply_data_vertex_data_dtype_list = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+        if with_colors:
+            ply_data_vertex_data_dtype_list += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+        if with_normals:
+            ply_data_vertex_data_dtype_list += [('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4')]
+        for scalar_key in scalar_keys:
+            ply_data_vertex_data_dtype_list += [(scalar_key, '<f4')]
+        return np.dtype(ply_data_vertex_data_dtype_list)
+
+    @staticmethod
+    def build_vertex_array(coords, colors=None, normals=None, scalars=None):
+        """
+        Fills a structured vertex array column by column (i.e. without a loop over the points)
+        :param coords: (N,3) array
+        :param colors: (N,3) array or None
+        :param normals: (N,3) array or None
+        :param scalars: (ordered) dict mapping a scalar name to an (N,) array or None
+        """
+        coords = np.asarray(coords).reshape((-1, 3))
+        if scalars is None:
+            scalars = OrderedDict()
+        vertex_dtype = PLYFileHandler.build_vertex_dtype(
+            colors is not None, normals is not None, list(scalars.keys()))
+
+        vertex_array = np.empty(len(coords), dtype=vertex_dtype)
+        for dim_index, dim_name in enumerate(['x', 'y', 'z']):
+            vertex_array[dim_name] = coords[:, dim_index]
+        if colors is not None:
+            colors = np.asarray(colors).reshape((-1, 3))
+            for dim_index, dim_name in enumerate(['red', 'green', 'blue']):
+                vertex_array[dim_name] = colors[:, dim_index]
+        if normals is not None:
+            normals = np.asarray(normals).reshape((-1, 3))
+            for dim_index, dim_name in enumerate(['nx', 'ny', 'nz']):
+                vertex_array[dim_name] = normals[:, dim_index]
+        for scalar_key, scalar_values in scalars.items():
+            vertex_array[scalar_key] = scalar_values
+        return vertex_array
+
+    @staticmethod
+    def build_vertex_header(vertex_dtype, num_vertices, plain_text_output=False, count_width=None):
+        """
+        :param count_width: if not None, the vertex count is padded (with spaces) to count_width
+            characters. This allows to overwrite the count later without moving the data.
+        """
+        vertex_element = PlyElement.describe(np.empty(0, dtype=vertex_dtype), 'vertex')
+        header = PlyData([vertex_element], text=plain_text_output, byte_order='<').header
+
+        count_str = str(num_vertices)
+        if count_width is not None:
+            assert len(count_str) <= count_width
+            count_str = count_str.ljust(count_width)
+        header_lines = header.split('\n')
+        header_lines[header_lines.index('element vertex 0')] = 'element vertex ' + count_str
+        return '\n'.join(header_lines) + '\n'
+
+    @staticmethod
+    def write_vertex_array_as_text(ply_file, vertex_array):
+        vertex_dtype = vertex_array.dtype
+        value_formats = []
+        for name in vertex_dtype.names:
+            kind = vertex_dtype[name].kind
+            if kind == 'f':
+                value_formats.append('%.9g' if vertex_dtype[name].itemsize == 4 else '%.17g')
+            else:
+                value_formats.append('%d')
+        np.savetxt(ply_file, vertex_array, fmt=' '.join(value_formats))
+
+    @staticmethod
+    def write_ply_file_from_arrays(ofp,
+                                   coords,
+                                   colors=None,
+                                   normals=None,
+                                   scalars=None,
+                                   plain_text_output=False):
+        """
+        Writes the vertices given as arrays without creating a Point (or PlyElement) per vertex.
+        Binary files are written with a single buffer write.
+        :param ofp:
+        :param coords: (N,3) array
+        :param colors: (N,3) array or None
+        :param normals: (N,3) array or None
+        :param scalars: (ordered) dict mapping a scalar name to an (N,) array or None
+        :param plain_text_output:
+        :return:
+        """
+        logger.info('write_ply_file_from_arrays: ' + ofp)
+        vertex_array = PLYFileHandler.build_vertex_array(coords, colors, normals, scalars)
+        header = PLYFileHandler.build_vertex_header(
+            vertex_array.dtype, len(vertex_array), plain_text_output)
+
+        with open(ofp, 'wb') as ply_file:
+            ply_file.write(header.encode('ascii'))
+            if plain_text_output:
+                PLYFileHandler.write_vertex_array_as_text(ply_file, vertex_array)
+            else:
+                ply_file.write(vertex_array.tobytes())
+
     @staticmethod
     def write_ply_file(ofp,
                        vertices,
@@ -268,8 +570,22 @@ class PLYFileHandler:
                        plain_text_output=False,
                        with_measurements=False):
 
+        """
+        :param vertices: list of Points or PointCloud
+        """
+
         logger.info('write_ply_file: ' + ofp)
 
+        if isinstance(vertices, PointCloud) and not with_measurements and (faces is None or len(faces) == 0):
+            PLYFileHandler.write_ply_file_from_arrays(
+                ofp,
+                vertices.coords,
+                vertices.colors if with_colors else None,
+                vertices.normals if with_normals else None,
+                vertices.scalars,
+                plain_text_output)
+            return
+
         ply_data_vertex_data_dtype_list = PLYFileHandler.build_type_list(
             vertices, with_colors, with_normals, with_measurements)
 
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from Utility.File_Handler.PLY_File_Handler import PLYFileHandler
+from Utility.Logging_Extension import logger
+
+
+class PLYStreamWriter(object):
+    """
+    Writes a binary PLY file (vertices only) chunk by chunk, i.e. the output
+    can be assembled incrementally without holding the whole cloud in memory.
+
+    The vertex count in the header is padded, so that the final count can be
+    written (in place) when the writer is closed.
+
+    with PLYStreamWriter(ofp, with_colors=True) as writer:
+        for coords, colors in chunks:
+            writer.append_chunk(coords, colors)
+    """
+
+    # Enough characters for any 64 bit vertex count
+    count_width = 20
+
+    def __init__(self, ofp, with_colors=True, with_normals=False, scalar_keys=()):
+
+        self.ofp = ofp
+        self.with_colors = with_colors
+        self.with_normals = with_normals
+        self.scalar_keys = list(scalar_keys)
+        self.vertex_dtype = PLYFileHandler.build_vertex_dtype(
+            with_colors, with_normals, self.scalar_keys)
+        self.num_vertices = 0
+
+        logger.info('PLYStreamWriter: ' + ofp)
+        self._ply_file = open(ofp, 'wb')
+        self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_header(self):
+        header = PLYFileHandler.build_vertex_header(
+            self.vertex_dtype, self.num_vertices, count_width=self.count_width)
+        self._ply_file.write(header.encode('ascii'))
+
+    def append_chunk(self, coords, colors=None, normals=None, scalars=None):
+        """
+        :param coords: (N,3) array
+        :param colors: (N,3) array (required if with_colors is True)
+        :param normals: (N,3) array (required if with_normals is True)
+        :param scalars: dict mapping each scalar key to an (N,) array
+        """
+        assert self._ply_file is not None
+        assert (colors is not None) == self.with_colors
+        assert (normals is not None) == self.with_normals
+        if scalars is None:
+            scalars = {}
+        assert sorted(scalars.keys()) == sorted(self.scalar_keys)
+
+        ordered_scalars = OrderedDict([(scalar_key, scalars[scalar_key]) for scalar_key in self.scalar_keys])
+        vertex_array = PLYFileHandler.build_vertex_array(coords, colors, normals, ordered_scalars)
+        self._ply_file.write(vertex_array.tobytes())
+        self.num_vertices += len(vertex_array)
+
+    def append_point_cloud(self, point_cloud):
+        self.append_chunk(
+            point_cloud.coords,
+            point_cloud.colors if self.with_colors else None,
+            point_cloud.normals if self.with_normals else None,
+            {scalar_key: point_cloud.scalars[scalar_key] for scalar_key in self.scalar_keys})
+
+    def close(self):
+        if self._ply_file is None:
+            return
+        # Replace the (padded) vertex count in the header
+        self._ply_file.seek(0)
+        self._write_header()
+        self._ply_file.close()
+        self._ply_file = None
+        logger.vinfo('num_vertices', self.num_vertices)
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class TXTFileHandler(object):
 
     @staticmethod
@@ -16,6 +19,31 @@ class TXTFileHandler(object):
             lines.append(as_type(res))
         return lines
 
+    @staticmethod
+    def tokenize_numeric_lines(line_bytes, num_lines=None):
+        """
+        Converts the whitespace separated numbers of all lines at once, i.e.
+        without a python loop over the lines or the values.
+        :param line_bytes: bytes containing '\n' separated lines
+        :param num_lines: number of lines (allows to count empty lines at the end)
+        :return: values (float array), values_per_line (int array)
+        """
+        chars = np.frombuffer(line_bytes, dtype=np.uint8)
+
+        # Space, tab, carriage return and newline are the only characters <= ' '
+        is_whitespace = chars <= ord(' ')
+        follows_whitespace = np.concatenate(([True], is_whitespace[:-1]))
+        token_starts = np.flatnonzero(~is_whitespace & follows_whitespace)
+        line_index_of_token = np.cumsum(chars == ord('\n'))[token_starts]
+        values_per_line = np.bincount(line_index_of_token, minlength=num_lines or 0)
+
+        if len(token_starts) == 0:
+            values = np.empty(0, dtype=float)
+        else:
+            values = np.fromstring(line_bytes.decode(), dtype=float, sep=' ')
+        assert len(values) == len(token_starts)
+        return values, values_per_line
+
     @staticmethod
     def read_lines_as_tuples(ifp, delimiter=' ', as_type=None):
         " Returns a list of tuples"
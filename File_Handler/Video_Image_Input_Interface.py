@@ -1,58 +1,151 @@
 import os
 import cv2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from Utility.OS_Extension import natural_key
 from Utility.Logging_Extension import logger
+from Utility.Cache.Raster_Cache import raster_cache
+from Utility.FFMPEG_Scripts.Video_Frame_Streamer import VideoFrameStreamer
 
 
 class VideoImageInputInterface:
     # can read input videos or image folders
-    def __init__(self, path_to_input):
+    def __init__(self, path_to_input, use_ffmpeg_stream=False, frame_rate=None, start_time=None, end_time=None,
+                 num_prefetched_images=0, num_decoder_threads=2):
+        """
+        :param use_ffmpeg_stream: decode videos with ffmpeg (see VideoFrameStreamer) instead of opencv
+        :param frame_rate: only used if use_ffmpeg_stream is True
+        :param start_time: only used if use_ffmpeg_stream is True
+        :param end_time: only used if use_ffmpeg_stream is True
+        :param num_prefetched_images: number of subsequent images decoded in the background (0 disables prefetching)
+        :param num_decoder_threads: only used for image folders (the frames of a video are decoded sequentially)
+        """
 
         self.current_image_index = 0
+        self.frame_streamer = None
+        self.num_prefetched_images = num_prefetched_images
+        self._decoder_pool = None
+        self._prefetched_images = deque()      # futures of (gray_image, image_name) in reading order
 
         # check for video file
         if os.path.isfile(path_to_input):
             self.mode = 'VIDEO'
-            self.cap = cv2.VideoCapture(path_to_input)
+            if use_ffmpeg_stream:
+                self.frame_streamer = VideoFrameStreamer(
+                    path_to_input, frame_rate, start_time, end_time, gray_scale=True)
+            else:
+                self.cap = cv2.VideoCapture(path_to_input)
+            # Reading frames of a video is stateful, i.e. a single decoder thread preserves the order
+            num_decoder_threads = 1
 
         elif os.path.isdir(path_to_input):
             self.mode = 'IMAGES'
-            self.file_paths = [
+            self.file_paths = deque(sorted([
                 os.path.join(path_to_input, file_name)
                 for file_name in os.listdir(path_to_input)
-                if os.path.isfile(os.path.join(path_to_input, file_name))]
-            print(self.file_paths)
+                if os.path.isfile(os.path.join(path_to_input, file_name))], key=natural_key))
+            logger.vinfo('Number of images', len(self.file_paths))
 
         else:
             assert False
 
-    def read_next_image_as_gray_scale(self):
+        if self.num_prefetched_images > 0:
+            self._decoder_pool = ThreadPoolExecutor(num_decoder_threads)
+
+    def _read_next_video_image_as_gray_scale(self):
         gray_image = None
         current_image_name = None
-        if self.mode == 'VIDEO':
+        if self.frame_streamer is not None:
+            gray_image = self.frame_streamer.read_next_frame()
+            if gray_image is not None:
+                # The frames of the streamer are overwritten by subsequent reads
+                gray_image = gray_image.copy()
+        else:
             # cap.read() returns None if there are no more frames left
             ret, bgr_image = self.cap.read()
             if bgr_image is not None:
                 gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-                current_image_name = str(self.current_image_index)
-                self.current_image_index += 1
+        if gray_image is not None:
+            current_image_name = str(self.current_image_index)
+            self.current_image_index += 1
+        return gray_image, current_image_name
+
+    @staticmethod
+    def _read_image_file_as_gray_scale(path_to_image):
+        gray_image = VideoImageInputInterface.read_image_from_path_as_gray_scale(path_to_image)
+        return gray_image, os.path.basename(path_to_image)
+
+    def _submit_next_image(self):
+        """
+        :return: True, if a further image has been scheduled for decoding
+        """
+        if self.mode == 'VIDEO':
+            future = self._decoder_pool.submit(self._read_next_video_image_as_gray_scale)
         elif self.mode == 'IMAGES':
-            if self.file_paths: # check that the list is not empty
-                current_image_path = self.file_paths.pop(0)
-                bgr_image = cv2.imread(current_image_path, cv2.IMREAD_COLOR)
-                if bgr_image is not None:
-                    gray_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY)
-                current_image_name = os.path.basename(current_image_path)
+            if not self.file_paths:
+                return False
+            future = self._decoder_pool.submit(
+                VideoImageInputInterface._read_image_file_as_gray_scale, self.file_paths.popleft())
+        else:
+            assert False
+        self._prefetched_images.append(future)
+        return True
+
+    def _fill_prefetch_queue(self):
+        while len(self._prefetched_images) < self.num_prefetched_images:
+            if not self._submit_next_image():
+                break
+
+    def read_next_image_as_gray_scale(self):
+        if self._decoder_pool is not None:
+            self._fill_prefetch_queue()
+            if not self._prefetched_images:
+                return None, None
+            future = self._prefetched_images.popleft()
+            # Keep the decoder threads busy, while the current image is processed
+            self._fill_prefetch_queue()
+            return future.result()
+
+        gray_image = None
+        current_image_name = None
+        if self.mode == 'VIDEO':
+            gray_image, current_image_name = self._read_next_video_image_as_gray_scale()
+        elif self.mode == 'IMAGES':
+            if self.file_paths: # check that the deque is not empty
+                gray_image, current_image_name = VideoImageInputInterface._read_image_file_as_gray_scale(
+                    self.file_paths.popleft())
         else:
             assert False
 
         return gray_image, current_image_name
 
     def release(self):
+        if self._decoder_pool is not None:
+            for future in self._prefetched_images:
+                future.cancel()
+            self._prefetched_images.clear()
+            self._decoder_pool.shutdown(wait=True)
+            self._decoder_pool = None
         if self.mode == 'VIDEO':
-            self.cap.release()
+            if self.frame_streamer is not None:
+                self.frame_streamer.release()
+            else:
+                self.cap.release()
+
+    @staticmethod
+    def stream_video_frames(path_to_video, frame_rate=None, start_time=None, end_time=None, gray_scale=False):
+        """
+        Iterates over the (gray scale or rgb) frames of the video without writing images to disk
+        (the frames are views into a ring buffer, see VideoFrameStreamer)
+        """
+        with VideoFrameStreamer(path_to_video, frame_rate, start_time, end_time, gray_scale) as frame_streamer:
+            for frame in frame_streamer:
+                yield frame
 
     @staticmethod
-    def read_image_from_path_as_gray_scale(path_to_image):
+    def read_image_from_path_as_gray_scale(path_to_image, use_cache=False):
+        if use_cache:
+            return raster_cache.get(path_to_image, VideoImageInputInterface.read_image_from_path_as_gray_scale)
         gray_image = None
         bgr_image = cv2.imread(path_to_image, cv2.IMREAD_COLOR)
         if bgr_image is not None:
@@ -61,10 +154,12 @@ class VideoImageInputInterface:
 
 
     @staticmethod
-    def read_image_from_path_as_rgb(path_to_image):
+    def read_image_from_path_as_rgb(path_to_image, use_cache=False):
         if not os.path.isfile(path_to_image):
             logger.vinfo('path_to_image', path_to_image)
             assert False
+        if use_cache:
+            return raster_cache.get(path_to_image, VideoImageInputInterface.read_image_from_path_as_rgb)
         grb_image = None
         bgr_image = cv2.imread(path_to_image, cv2.IMREAD_COLOR)
         if bgr_image is not None:
@@ -0,0 +1,435 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from Utility.Logging_Extension import logger
+from Utility.Types.Triangle import Triangle
+
+
+class BoundingVolumeHierarchy(object):
+    """
+    Bounding volume hierarchy (of axis aligned bounding boxes) over an array of triangles.
+
+    The hierarchy is built once (median split along the axis with the largest
+    centroid extent) and is stored as flat node arrays. Queries process batches
+    of rays: all (ray, node) pairs of the current traversal front are tested at
+    once and the triangles of the reached leaves are intersected with a
+    vectorized Moeller-Trumbore kernel.
+    """
+
+    epsilon = 0.000001
+
+    def __init__(self, triangle_vertices, max_leaf_size=4):
+        """
+        :param triangle_vertices: (T,3,3) array, i.e. triangle_vertices[i, j] is the j-th vertex of the i-th triangle
+        :param max_leaf_size: maximum number of triangles per leaf
+        """
+        triangle_vertices = np.asarray(triangle_vertices, dtype=float)
+        assert triangle_vertices.ndim == 3 and triangle_vertices.shape[1:] == (3, 3)
+        assert max_leaf_size > 0
+        self.triangle_vertices = triangle_vertices
+        self.max_leaf_size = max_leaf_size
+        self._build()
+
+    @classmethod
+    def init_from_triangles(cls, triangles, max_leaf_size=4):
+        """
+        :param triangles: list of Triangle objects
+        """
+        triangle_vertices = Triangle.convert_triangles_to_vertex_array(triangles)
+        return cls(triangle_vertices, max_leaf_size=max_leaf_size)
+
+    def __len__(self):
+        return len(self.triangle_vertices)
+
+    def get_num_nodes(self):
+        return len(self.node_left)
+
+    def _build(self):
+
+        logger.info('_build: ...')
+        num_triangles = len(self.triangle_vertices)
+        centroids = self.triangle_vertices.mean(axis=1)
+        triangle_mins = self.triangle_vertices.min(axis=1)
+        triangle_maxs = self.triangle_vertices.max(axis=1)
+
+        # The triangles of each node are stored at triangle_order[start:end]
+        triangle_order = np.arange(num_triangles)
+        node_bb_mins = []
+        node_bb_maxs = []
+        node_left = []
+        node_right = []
+        node_start = []
+        node_end = []
+
+        def add_node(start, end):
+            node_bb_mins.append(None)
+            node_bb_maxs.append(None)
+            node_left.append(-1)
+            node_right.append(-1)
+            node_start.append(start)
+            node_end.append(end)
+            return len(node_left) - 1
+
+        stack = [add_node(0, num_triangles)]
+        while stack:
+            node_index = stack.pop()
+            start = node_start[node_index]
+            end = node_end[node_index]
+            node_triangles = triangle_order[start:end]
+
+            if end > start:
+                node_bb_mins[node_index] = triangle_mins[node_triangles].min(axis=0)
+                node_bb_maxs[node_index] = triangle_maxs[node_triangles].max(axis=0)
+            else:
+                # Only possible for an empty hierarchy, such a box is never hit
+                node_bb_mins[node_index] = np.full(3, np.inf)
+                node_bb_maxs[node_index] = np.full(3, -np.inf)
+
+            if end - start <= self.max_leaf_size:
+                continue
+            node_centroids = centroids[node_triangles]
+            extent = node_centroids.max(axis=0) - node_centroids.min(axis=0)
+            split_axis = np.argmax(extent)
+            if extent[split_axis] == 0:
+                # All centroids coincide, a split would not separate the triangles
+                continue
+
+            split_offset = (end - start) // 2
+            partition = np.argpartition(node_centroids[:, split_axis], split_offset)
+            triangle_order[start:end] = node_triangles[partition]
+
+            node_left[node_index] = add_node(start, start + split_offset)
+            node_right[node_index] = add_node(start + split_offset, end)
+            stack.append(node_left[node_index])
+            stack.append(node_right[node_index])
+
+        # Pad the boxes to compensate rounding errors of the slab test
+        padding = BoundingVolumeHierarchy.epsilon * max(1.0, np.abs(self.triangle_vertices).max(initial=0.0))
+        self.node_bb_mins = np.array(node_bb_mins, dtype=float) - padding
+        self.node_bb_maxs = np.array(node_bb_maxs, dtype=float) + padding
+        self.node_left = np.array(node_left, dtype=np.int64)
+        self.node_right = np.array(node_right, dtype=np.int64)
+        self.node_start = np.array(node_start, dtype=np.int64)
+        self.node_end = np.array(node_end, dtype=np.int64)
+
+        # Store the vertices in leaf order, i.e. the triangles of a leaf are contiguous
+        self.triangle_order = triangle_order
+        self._ordered_vertices_0 = np.ascontiguousarray(self.triangle_vertices[triangle_order, 0])
+        self._ordered_vertices_1 = np.ascontiguousarray(self.triangle_vertices[triangle_order, 1])
+        self._ordered_vertices_2 = np.ascontiguousarray(self.triangle_vertices[triangle_order, 2])
+        logger.vinfo('num_nodes', self.get_num_nodes())
+        logger.info('_build: Done')
+
+    @staticmethod
+    def compute_ray_triangle_intersection_parameters_paired(origins,
+                                                            directions,
+                                                            vertices_0,
+                                                            vertices_1,
+                                                            vertices_2,
+                                                            epsilon=epsilon):
+        """
+        Moeller-Trumbore intersection of the i-th ray with the i-th triangle (for all i).
+        See GeometryCollection.compute_ray_triangle_intersection_intersecting_parameter().
+
+        :param origins: (N,3) array
+        :param directions: (N,3) array
+        :param vertices_0: (N,3) array
+        :param vertices_1: (N,3) array
+        :param vertices_2: (N,3) array
+        :return: t, u, v, is_valid (arrays of length N, t, u and v are only meaningful where is_valid is True)
+        """
+        edges_1 = vertices_1 - vertices_0
+        edges_2 = vertices_2 - vertices_0
+        pvecs = np.cross(directions, edges_2)
+        dets = np.einsum('ij,ij->i', edges_1, pvecs)
+
+        # The non-culling branch
+        is_valid = np.abs(dets) >= epsilon
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_dets = 1.0 / dets
+
+        tvecs = origins - vertices_0
+        u = np.einsum('ij,ij->i', tvecs, pvecs) * inv_dets
+        is_valid &= (u >= 0.0) & (u <= 1.0)
+
+        qvecs = np.cross(tvecs, edges_1)
+        v = np.einsum('ij,ij->i', directions, qvecs) * inv_dets
+        is_valid &= (v >= 0.0) & (u + v <= 1.0)
+
+        t = np.einsum('ij,ij->i', edges_2, qvecs) * inv_dets
+        return t, u, v, is_valid
+
+    @staticmethod
+    def compute_point_triangle_closest_points_paired(points, vertices_0, vertices_1, vertices_2):
+        """
+        Closest point on the i-th triangle to the i-th point (for all i), see section 5.1.5 of
+        "Real-Time Collision Detection" by Christer Ericson.
+
+        :param points: (N,3) array
+        :return: (N,3) array
+        """
+        ab = vertices_1 - vertices_0
+        ac = vertices_2 - vertices_0
+        ap = points - vertices_0
+        bp = points - vertices_1
+        cp = points - vertices_2
+        d1 = np.einsum('ij,ij->i', ab, ap)
+        d2 = np.einsum('ij,ij->i', ac, ap)
+        d3 = np.einsum('ij,ij->i', ab, bp)
+        d4 = np.einsum('ij,ij->i', ac, bp)
+        d5 = np.einsum('ij,ij->i', ab, cp)
+        d6 = np.einsum('ij,ij->i', ac, cp)
+        va = d3 * d6 - d5 * d4
+        vb = d5 * d2 - d1 * d6
+        vc = d1 * d4 - d3 * d2
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Projection inside the face region
+            denom = 1.0 / (va + vb + vc)
+            closest_points = vertices_0 + ab * (vb * denom)[:, np.newaxis] + ac * (vc * denom)[:, np.newaxis]
+
+            # The feature regions are assigned in reverse order, i.e. the first matching region wins
+            is_bc = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+            w = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+            closest_points[is_bc] = (vertices_1 + (vertices_2 - vertices_1) * w[:, np.newaxis])[is_bc]
+
+            is_ac = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+            w = d2 / (d2 - d6)
+            closest_points[is_ac] = (vertices_0 + ac * w[:, np.newaxis])[is_ac]
+
+            is_c = (d6 >= 0) & (d5 <= d6)
+            closest_points[is_c] = vertices_2[is_c]
+
+            is_ab = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+            v = d1 / (d1 - d3)
+            closest_points[is_ab] = (vertices_0 + ab * v[:, np.newaxis])[is_ab]
+
+        is_b = (d3 >= 0) & (d4 <= d3)
+        closest_points[is_b] = vertices_1[is_b]
+
+        is_a = (d1 <= 0) & (d2 <= 0)
+        closest_points[is_a] = vertices_0[is_a]
+        return closest_points
+
+    def _intersect_node_boxes(self, origins, inv_directions, node_indices):
+        """
+        Slab test of the i-th ray with the box of the i-th node, returns the
+        parameter interval [t_near, t_far] of the corresponding line inside the box
+        """
+        with np.errstate(invalid='ignore'):
+            t_0 = (self.node_bb_mins[node_indices] - origins) * inv_directions
+            t_1 = (self.node_bb_maxs[node_indices] - origins) * inv_directions
+        # fmin / fmax ignore the nan values of rays parallel to (and lying on) a slab boundary
+        t_near = np.fmax.reduce(np.fmin(t_0, t_1), axis=1)
+        t_far = np.fmin.reduce(np.fmax(t_0, t_1), axis=1)
+        return t_near, t_far
+
+    def _compute_closest_intersections_of_chunk(self, origins, directions, t_min, t_max):
+
+        num_rays = len(origins)
+        closest_t = np.full(num_rays, t_max, dtype=float)
+        closest_triangle_ids = np.full(num_rays, -1, dtype=np.int64)
+        closest_u = np.full(num_rays, np.nan)
+        closest_v = np.full(num_rays, np.nan)
+
+        with np.errstate(divide='ignore'):
+            inv_directions = 1.0 / directions
+
+        # The traversal front consists of (ray, node) pairs
+        ray_indices = np.arange(num_rays, dtype=np.int64)
+        node_indices = np.zeros(num_rays, dtype=np.int64)
+        while len(ray_indices) > 0:
+            t_near, t_far = self._intersect_node_boxes(
+                origins[ray_indices], inv_directions[ray_indices], node_indices)
+            is_hit = (t_near <= t_far) & (t_far >= t_min) & (t_near <= closest_t[ray_indices])
+            ray_indices = ray_indices[is_hit]
+            node_indices = node_indices[is_hit]
+
+            is_leaf = self.node_left[node_indices] < 0
+            leaf_ray_indices = ray_indices[is_leaf]
+            leaf_node_indices = node_indices[is_leaf]
+            if len(leaf_ray_indices) > 0:
+                # Expand the (ray, leaf) pairs to (ray, triangle) pairs
+                leaf_starts = self.node_start[leaf_node_indices]
+                leaf_sizes = self.node_end[leaf_node_indices] - leaf_starts
+                pair_ray_indices = np.repeat(leaf_ray_indices, leaf_sizes)
+                pair_offsets = np.arange(len(pair_ray_indices)) - np.repeat(np.cumsum(leaf_sizes) - leaf_sizes, leaf_sizes)
+                pair_positions = np.repeat(leaf_starts, leaf_sizes) + pair_offsets
+
+                t, u, v, is_valid = BoundingVolumeHierarchy.compute_ray_triangle_intersection_parameters_paired(
+                    origins[pair_ray_indices],
+                    directions[pair_ray_indices],
+                    self._ordered_vertices_0[pair_positions],
+                    self._ordered_vertices_1[pair_positions],
+                    self._ordered_vertices_2[pair_positions])
+                is_valid &= (t >= t_min) & (t <= closest_t[pair_ray_indices])
+
+                self._update_closest_intersections(
+                    pair_ray_indices[is_valid],
+                    self.triangle_order[pair_positions[is_valid]],
+                    t[is_valid], u[is_valid], v[is_valid],
+                    closest_t, closest_triangle_ids, closest_u, closest_v)
+
+            inner_ray_indices = ray_indices[~is_leaf]
+            inner_node_indices = node_indices[~is_leaf]
+            ray_indices = np.concatenate((inner_ray_indices, inner_ray_indices))
+            node_indices = np.concatenate(
+                (self.node_left[inner_node_indices], self.node_right[inner_node_indices]))
+
+        closest_t[closest_triangle_ids < 0] = np.inf
+        return closest_t, closest_triangle_ids, closest_u, closest_v
+
+    @staticmethod
+    def _update_closest_intersections(ray_indices, triangle_ids, t, u, v,
+                                      closest_t, closest_triangle_ids, closest_u, closest_v):
+        if len(ray_indices) == 0:
+            return
+        # Select the smallest t per ray (ties are resolved by the triangle id)
+        order = np.lexsort((triangle_ids, t, ray_indices))
+        ray_indices = ray_indices[order]
+        is_first = np.ones(len(ray_indices), dtype=bool)
+        is_first[1:] = ray_indices[1:] != ray_indices[:-1]
+        selection = order[is_first]
+        ray_indices = ray_indices[is_first]
+
+        previous_t = closest_t[ray_indices]
+        previous_triangle_ids = closest_triangle_ids[ray_indices]
+        is_closer = (t[selection] < previous_t) | (
+            (t[selection] == previous_t) &
+            ((previous_triangle_ids < 0) | (triangle_ids[selection] < previous_triangle_ids)))
+        ray_indices = ray_indices[is_closer]
+        selection = selection[is_closer]
+
+        closest_t[ray_indices] = t[selection]
+        closest_triangle_ids[ray_indices] = triangle_ids[selection]
+        closest_u[ray_indices] = u[selection]
+        closest_v[ray_indices] = v[selection]
+
+    def compute_closest_intersections(self, origins, directions, t_min=0.0, t_max=np.inf, ray_chunk_size=65536):
+        """
+        Computes for each ray the intersection with the smallest parameter t in [t_min, t_max].
+
+        :param origins: (R,3) array
+        :param directions: (R,3) array
+        :param t_min: use -np.inf to consider the whole line (instead of the ray)
+        :param t_max:
+        :param ray_chunk_size: number of rays traversed simultaneously (limits the memory consumption)
+        :return: t, triangle_ids, u, v (arrays of length R). For rays without an intersection
+            t is inf, the triangle id is -1 and u, v are nan. (u, v) are the barycentric
+            coordinates of the intersection point, i.e. p = (1-u-v) * vertex_0 + u * vertex_1 + v * vertex_2
+        """
+        origins = np.asarray(origins, dtype=float).reshape((-1, 3))
+        directions = np.asarray(directions, dtype=float).reshape((-1, 3))
+        assert origins.shape == directions.shape
+
+        num_rays = len(origins)
+        t = np.full(num_rays, np.inf)
+        triangle_ids = np.full(num_rays, -1, dtype=np.int64)
+        u = np.full(num_rays, np.nan)
+        v = np.full(num_rays, np.nan)
+        if len(self) == 0:
+            return t, triangle_ids, u, v
+
+        for chunk_start in range(0, num_rays, ray_chunk_size):
+            chunk = slice(chunk_start, chunk_start + ray_chunk_size)
+            t[chunk], triangle_ids[chunk], u[chunk], v[chunk] = self._compute_closest_intersections_of_chunk(
+                origins[chunk], directions[chunk], t_min, t_max)
+        return t, triangle_ids, u, v
+
+    def compute_closest_intersection_points(self, origins, directions, t_min=0.0, t_max=np.inf):
+        """
+        :return: (R,3) array of intersection points (nan for rays without intersection), t, triangle_ids
+        """
+        origins = np.asarray(origins, dtype=float).reshape((-1, 3))
+        directions = np.asarray(directions, dtype=float).reshape((-1, 3))
+        t, triangle_ids, u, v = self.compute_closest_intersections(origins, directions, t_min, t_max)
+        with np.errstate(invalid='ignore'):
+            intersection_points = origins + t[:, np.newaxis] * directions
+        intersection_points[triangle_ids < 0] = np.nan
+        return intersection_points, t, triangle_ids
+
+    def _compute_closest_points_of_chunk(self, points, centroid_kd_tree):
+
+        num_points = len(points)
+        # Use the closest triangle of the nearest centroid as upper bound (enables early pruning)
+        _, closest_triangle_ids = centroid_kd_tree.query(points)
+        closest_triangle_ids = closest_triangle_ids.astype(np.int64)
+        closest_points = BoundingVolumeHierarchy.compute_point_triangle_closest_points_paired(
+            points,
+            self.triangle_vertices[closest_triangle_ids, 0],
+            self.triangle_vertices[closest_triangle_ids, 1],
+            self.triangle_vertices[closest_triangle_ids, 2])
+        closest_squared_distances = np.sum((points - closest_points) ** 2, axis=1)
+
+        # The traversal front consists of (point, node) pairs
+        point_indices = np.arange(num_points, dtype=np.int64)
+        node_indices = np.zeros(num_points, dtype=np.int64)
+        while len(point_indices) > 0:
+            # Squared distance of the points to the boxes (lower bound of the triangle distances)
+            box_offsets = np.maximum(
+                np.maximum(self.node_bb_mins[node_indices] - points[point_indices], 0.0),
+                points[point_indices] - self.node_bb_maxs[node_indices])
+            box_squared_distances = np.sum(box_offsets ** 2, axis=1)
+            is_relevant = box_squared_distances <= closest_squared_distances[point_indices]
+            point_indices = point_indices[is_relevant]
+            node_indices = node_indices[is_relevant]
+
+            is_leaf = self.node_left[node_indices] < 0
+            leaf_point_indices = point_indices[is_leaf]
+            leaf_node_indices = node_indices[is_leaf]
+            if len(leaf_point_indices) > 0:
+                leaf_starts = self.node_start[leaf_node_indices]
+                leaf_sizes = self.node_end[leaf_node_indices] - leaf_starts
+                pair_point_indices = np.repeat(leaf_point_indices, leaf_sizes)
+                pair_offsets = np.arange(len(pair_point_indices)) - np.repeat(np.cumsum(leaf_sizes) - leaf_sizes, leaf_sizes)
+                pair_positions = np.repeat(leaf_starts, leaf_sizes) + pair_offsets
+
+                pair_closest_points = BoundingVolumeHierarchy.compute_point_triangle_closest_points_paired(
+                    points[pair_point_indices],
+                    self._ordered_vertices_0[pair_positions],
+                    self._ordered_vertices_1[pair_positions],
+                    self._ordered_vertices_2[pair_positions])
+                pair_squared_distances = np.sum((points[pair_point_indices] - pair_closest_points) ** 2, axis=1)
+
+                # Select the closest triangle per point
+                order = np.lexsort((pair_squared_distances, pair_point_indices))
+                sorted_point_indices = pair_point_indices[order]
+                is_first = np.ones(len(order), dtype=bool)
+                is_first[1:] = sorted_point_indices[1:] != sorted_point_indices[:-1]
+                selection = order[is_first]
+                selected_point_indices = pair_point_indices[selection]
+                is_closer = pair_squared_distances[selection] < closest_squared_distances[selected_point_indices]
+                selection = selection[is_closer]
+                selected_point_indices = selected_point_indices[is_closer]
+
+                closest_squared_distances[selected_point_indices] = pair_squared_distances[selection]
+                closest_triangle_ids[selected_point_indices] = self.triangle_order[pair_positions[selection]]
+                closest_points[selected_point_indices] = pair_closest_points[selection]
+
+            inner_point_indices = point_indices[~is_leaf]
+            inner_node_indices = node_indices[~is_leaf]
+            point_indices = np.concatenate((inner_point_indices, inner_point_indices))
+            node_indices = np.concatenate(
+                (self.node_left[inner_node_indices], self.node_right[inner_node_indices]))
+
+        return np.sqrt(closest_squared_distances), closest_triangle_ids, closest_points
+
+    def compute_closest_points(self, points, point_chunk_size=65536):
+        """
+        Computes for each point the closest point on the triangles.
+
+        :param points: (N,3) array
+        :return: distances, triangle_ids, closest_points
+        """
+        points = np.asarray(points, dtype=float).reshape((-1, 3))
+        assert len(self) > 0
+
+        num_points = len(points)
+        distances = np.empty(num_points, dtype=float)
+        triangle_ids = np.empty(num_points, dtype=np.int64)
+        closest_points = np.empty((num_points, 3), dtype=float)
+        centroid_kd_tree = cKDTree(self.triangle_vertices.mean(axis=1))
+        for chunk_start in range(0, num_points, point_chunk_size):
+            chunk = slice(chunk_start, chunk_start + point_chunk_size)
+            distances[chunk], triangle_ids[chunk], closest_points[chunk] = \
+                self._compute_closest_points_of_chunk(points[chunk], centroid_kd_tree)
+        return distances, triangle_ids, closest_points
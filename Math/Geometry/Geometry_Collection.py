@@ -1,6 +1,8 @@
 from Utility.Types.Ray import Ray
 from Utility.Types.Point import Point
+from Utility.Types.Triangle import Triangle
 from Utility.Logging_Extension import logger
+from Utility.Math.Geometry.Bounding_Volume_Hierarchy import BoundingVolumeHierarchy
 import numpy as np
 import math
 
@@ -125,14 +127,60 @@ class GeometryCollection:
         else:
             return None, None
 
+    @staticmethod
+    def compute_rays_plane_intersections(ray_pos_vecs, ray_dir_vecs, plane):
+        """
+        Vectorized version of compute_ray_plane_intersection().
+        :param ray_pos_vecs: (N,3) array
+        :param ray_dir_vecs: (N,3) array
+        :param plane:
+        :return: coords, t, is_parallel (coords and t are nan for rays parallel to the plane)
+        """
+        ray_pos_vecs = np.asarray(ray_pos_vecs, dtype=float).reshape((-1, 3))
+        ray_dir_vecs = np.asarray(ray_dir_vecs, dtype=float).reshape((-1, 3))
+        normal_vec = np.asarray(plane.normal_vec, dtype=float)
+
+        ray_dirs_dot_plane_normal = ray_dir_vecs.dot(normal_vec)
+        is_parallel = ray_dirs_dot_plane_normal == 0
+
+        t = np.full(len(ray_pos_vecs), np.nan)
+        is_intersecting = ~is_parallel
+        t[is_intersecting] = (plane.pos_vec - ray_pos_vecs[is_intersecting]).dot(normal_vec) / \
+            ray_dirs_dot_plane_normal[is_intersecting]
+
+        coords = ray_pos_vecs + t[:, np.newaxis] * ray_dir_vecs
+        return coords, t, is_parallel
+
     @staticmethod
     def compute_rays_triangles_closest_intersection_points(rays,
                                                            triangles,
-                                                           color_intersection_points=[0, 255, 0]):
+                                                           color_intersection_points=[0, 255, 0],
+                                                           use_bvh=False):
+        """
+        :param use_bvh: if True, the triangles are organized in a bounding volume hierarchy and
+            all rays are processed in a single batch (instead of testing each ray-triangle pair)
+        """
+        if use_bvh:
+            bvh = BoundingVolumeHierarchy.init_from_triangles(triangles)
+            # Like compute_ray_triangles_closest_intersection_point() consider also negative parameters
+            coords, _, triangle_ids = bvh.compute_closest_intersection_points(
+                np.array([ray.pos_vec for ray in rays], dtype=float),
+                np.array([ray.dir_vec for ray in rays], dtype=float),
+                t_min=-np.inf)
+            intersection_points = []
+            for coord, triangle_id in zip(coords, triangle_ids):
+                if triangle_id >= 0:
+                    intersection_points.append(Point(coord=coord, color=color_intersection_points))
+                else:
+                    intersection_points.append(None)
+            return intersection_points
+
+        # Pack the triangles only once for all rays
+        triangle_vertices = Triangle.convert_triangles_to_vertex_array(triangles)
         intersection_points = []
         for ray in rays:
             intersection_point, _ = GeometryCollection.compute_ray_triangles_closest_intersection_point(
-                ray, triangles, color_intersection_point=color_intersection_points)
+                ray, triangle_vertices, color_intersection_point=color_intersection_points)
             intersection_points.append(intersection_point)
         return intersection_points
 
@@ -144,27 +192,23 @@ class GeometryCollection:
         Returns the parameter of the closest intersection of ray with any triangle in triangles and the corresponding
         intersection point.
         :param ray:
-        :param triangles:
+        :param triangles: list of Triangle objects or (T,3,3) array (see Triangle.convert_triangles_to_vertex_array())
         :param color_intersection_point:
         :return:
         """
 
         assert ray is not None
 
+        if not isinstance(triangles, np.ndarray):
+            triangles = Triangle.convert_triangles_to_vertex_array(triangles)
+
+        ts, _, _, is_valid = GeometryCollection.compute_rays_triangles_intersection_parameters(
+            ray.pos_vec, ray.dir_vec, triangles)
+
         # the closest intersection is the intersection with the smallest t value
         t = None
-        # print('len(triangles)')
-        # print(len(triangles))
-        for triangle in triangles:
-            #print(triangle)
-            t_temp, u_temp, v_temp = GeometryCollection.compute_ray_triangle_intersection_intersecting_parameter(
-                ray, triangle)
-            # check if we found a valid intersection
-            if t_temp is not None:
-                if t is None:
-                    t = t_temp
-                elif t is not None and t_temp < t:
-                    t = t_temp
+        if np.any(is_valid):
+            t = np.min(ts[is_valid])
 
         if t is not None:
             return Point(coord=ray.pos_vec + t * ray.dir_vec, color=color_intersection_point), t
@@ -173,7 +217,58 @@ class GeometryCollection:
 
 
     @staticmethod
-    def compute_ray_triangle_intersection_intersecting_parameter(ray, triangle):
+    def compute_rays_triangles_intersection_parameters(ray_pos_vecs,
+                                                       ray_dir_vecs,
+                                                       triangle_vertices,
+                                                       culling=False):
+        """
+        Vectorized version of compute_ray_triangle_intersection_intersecting_parameter(),
+        which tests each ray against each triangle (using numpy broadcasting).
+
+        The memory consumption is proportional to R*T, i.e. split large ray sets into chunks.
+
+        :param ray_pos_vecs: (R,3) or (3,) array
+        :param ray_dir_vecs: (R,3) or (3,) array
+        :param triangle_vertices: (T,3,3) array (see Triangle.convert_triangles_to_vertex_array())
+        :param culling: if True, triangles with a back facing side (w.r.t. the ray) are ignored
+        :return: t, u, v, is_valid with shape (R,T) (or (T,) for a single ray)
+        """
+
+        ray_pos_vecs = np.asarray(ray_pos_vecs, dtype=float)
+        ray_dir_vecs = np.asarray(ray_dir_vecs, dtype=float)
+        single_ray = ray_pos_vecs.ndim == 1
+        ray_pos_vecs = ray_pos_vecs.reshape((-1, 1, 3))
+        ray_dir_vecs = ray_dir_vecs.reshape((-1, 1, 3))
+
+        vertices_0 = triangle_vertices[np.newaxis, :, 0]
+        edges_1 = triangle_vertices[np.newaxis, :, 1] - vertices_0
+        edges_2 = triangle_vertices[np.newaxis, :, 2] - vertices_0
+
+        pvecs = np.cross(ray_dir_vecs, edges_2)
+        dets = np.sum(edges_1 * pvecs, axis=2)
+        if culling:
+            is_valid = dets >= GeometryCollection.epsilon
+        else:
+            is_valid = np.abs(dets) >= GeometryCollection.epsilon
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_dets = 1.0 / dets
+
+        tvecs = ray_pos_vecs - vertices_0
+        u = np.sum(tvecs * pvecs, axis=2) * inv_dets
+        is_valid &= (u >= 0.0) & (u <= 1.0)
+
+        qvecs = np.cross(tvecs, edges_1)
+        v = np.sum(ray_dir_vecs * qvecs, axis=2) * inv_dets
+        is_valid &= (v >= 0.0) & (u + v <= 1.0)
+
+        t = np.sum(edges_2 * qvecs, axis=2) * inv_dets
+
+        if single_ray:
+            return t[0], u[0], v[0], is_valid[0]
+        return t, u, v, is_valid
+
+    @staticmethod
+    def compute_ray_triangle_intersection_intersecting_parameter(ray, triangle, culling=False):
         """
         Mueller-Trumbore-Algorithm:
             http://cg-dev.ltas.ulg.ac.be/inf/Fast%20MinimumStorage%20RayTriangle%20Intersection.pdf
@@ -194,7 +289,24 @@ class GeometryCollection:
         # if determinant is near zero, ray lies in plane of triangle
         det = np.dot(edge1, pvec)
 
-        # TODO implement culling branch
+        if culling:
+            # the culling branch (defers the division)
+            if det < GeometryCollection.epsilon:
+                return None, None, None
+
+            tvec = ray.pos_vec - triangle.vertex_0
+            u = np.dot(tvec, pvec)
+            if u < 0.0 or u > det:
+                return None, None, None
+
+            qvec = np.cross(tvec, edge1)
+            v = np.dot(ray.dir_vec, qvec)
+            if v < 0.0 or u + v > det:
+                return None, None, None
+
+            inv_det = 1.0 / det
+            t = np.dot(edge2, qvec) * inv_det
+            return t, u * inv_det, v * inv_det
 
         # the non-culling branch
         if -GeometryCollection.epsilon < det < GeometryCollection.epsilon:
@@ -330,28 +442,75 @@ class GeometryCollection:
         return plane.normal_vec.dot(point - plane.pos_vec)
 
     @staticmethod
-    def generate_points_along_rays(ray_list, color=np.array([255, 0 , 0]), amount_steps=100, scale=None):
+    def compute_lines_min_line_line_distance(pos_vecs, dir_vecs, comp_eps=0.00001, chunk_size=1024):
+        """
+        Vectorized computation of the smallest (non-zero) distance between all pairs of lines
+        (see compute_line_line_distance()). Returns inf, if there is no such pair.
+        """
+        pos_vecs = np.asarray(pos_vecs, dtype=float).reshape((-1, 3))
+        dir_vecs = np.asarray(dir_vecs, dtype=float).reshape((-1, 3))
+        is_degenerated = np.all(np.abs(dir_vecs) < comp_eps, axis=1)
+
+        min_distance = float('inf')
+        for chunk_start in range(0, len(pos_vecs), chunk_size):
+            # Line pairs (i, j) with i in [chunk_start, chunk_end) and j > i
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            cam_2_to_cam_1 = pos_vecs[chunk, np.newaxis] - pos_vecs[np.newaxis]
+            d1343 = np.sum(cam_2_to_cam_1 * dir_vecs[np.newaxis], axis=2)
+            d4321 = dir_vecs[chunk].dot(dir_vecs.T)
+            d1321 = np.sum(cam_2_to_cam_1 * dir_vecs[chunk, np.newaxis], axis=2)
+            d4343 = np.sum(dir_vecs * dir_vecs, axis=1)[np.newaxis]
+            d2121 = np.sum(dir_vecs[chunk] * dir_vecs[chunk], axis=1)[:, np.newaxis]
+            denom = d2121 * d4343 - d4321 * d4321
+
+            row_indices = np.arange(len(pos_vecs))[chunk, np.newaxis]
+            is_valid = (np.arange(len(pos_vecs))[np.newaxis] > row_indices) & (np.abs(denom) >= comp_eps)
+            is_valid &= ~is_degenerated[chunk, np.newaxis] & ~is_degenerated[np.newaxis]
+            if not np.any(is_valid):
+                continue
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mu_1 = (d1343 * d4321 - d1321 * d4343) / denom
+                mu_2 = (d1343 + d4321 * mu_1) / d4343
+            p1 = pos_vecs[chunk, np.newaxis] + mu_1[:, :, np.newaxis] * dir_vecs[chunk, np.newaxis]
+            p2 = pos_vecs[np.newaxis] + mu_2[:, :, np.newaxis] * dir_vecs[np.newaxis]
+            distances = np.linalg.norm(p1 - p2, axis=2)[is_valid]
+            distances = distances[distances != 0]
+            if len(distances) > 0:
+                min_distance = min(min_distance, float(distances.min()))
+        return min_distance
+
+    @staticmethod
+    def generate_coords_along_rays(ray_pos_vecs, ray_dir_vecs, amount_steps=100, scale=None):
+        """
+        Vectorized version of generate_points_along_rays().
+        :param ray_pos_vecs: (N,3) array
+        :param ray_dir_vecs: (N,3) array
+        :return: (N * (amount_steps + 1), 3) array (the coords of each ray are stored consecutively)
+        """
+        ray_pos_vecs = np.asarray(ray_pos_vecs, dtype=float).reshape((-1, 3))
+        ray_dir_vecs = np.asarray(ray_dir_vecs, dtype=float).reshape((-1, 3))
 
         if scale is None:
             # use the distance of the rays to determine a scale value
+            scale = GeometryCollection.compute_lines_min_line_line_distance(ray_pos_vecs, ray_dir_vecs)
+            logger.info('min_distance: ' + str(scale))
+
+        # we need amount_steps+1 to cover also the start and the end point
+        # (the length of the direction vector is the distance in which we need too draw points)
+        step_factors = np.arange(amount_steps + 1, dtype=float) / float(amount_steps) * float(scale)
+        coords = ray_pos_vecs[:, np.newaxis] + step_factors[np.newaxis, :, np.newaxis] * ray_dir_vecs[:, np.newaxis]
+        return coords.reshape((-1, 3))
+
+    @staticmethod
+    def generate_points_along_rays(ray_list, color=np.array([255, 0 , 0]), amount_steps=100, scale=None):
 
-            min_distance = float('inf')
-            for index, ray_1 in enumerate(ray_list):
-                min_ray_ray_distance = float('inf')
-                for ray_2 in ray_list[index:]:      # Consider only the remaining
-                    line_line_distance = GeometryCollection.compute_line_line_distance(
-                        ray_1.pos_vec, ray_1.dir_vec, ray_2.pos_vec, ray_2.dir_vec)
-                    if line_line_distance:
-                        min_ray_ray_distance = min(min_ray_ray_distance, line_line_distance)
-                min_distance = min(min_distance, min_ray_ray_distance)
-            logger.info('min_distance: ' + str(min_distance))
-
-            scale = min_distance
-
-        points_along_rays = []
-        for ray in ray_list:
-            points_along_rays += GeometryCollection.generate_points_along_ray(ray, color, amount_steps, scale)
-        return points_along_rays
+        coords = GeometryCollection.generate_coords_along_rays(
+            np.array([ray.pos_vec for ray in ray_list], dtype=float),
+            np.array([ray.dir_vec for ray in ray_list], dtype=float),
+            amount_steps,
+            scale)
+        return [Point(coord=coord, color=color) for coord in coords]
 
 
     @staticmethod
@@ -0,0 +1,311 @@
+import multiprocessing
+import numpy as np
+from collections import OrderedDict
+from scipy.spatial import cKDTree
+from pathos.multiprocessing import ProcessingPool
+from Utility.Logging_Extension import logger
+from Utility.Math.Geometry.Bounding_Volume_Hierarchy import BoundingVolumeHierarchy
+from Utility.Types.Enums.Sub_Sampling_Mode import SubSamplingMode
+from Utility.Types.Point_Cloud import PointCloud
+
+
+class PointCloudCollection:
+    """
+    In-memory point cloud operations on (N,3) coordinate arrays (resp. PointClouds).
+
+    The sub sampling modes, the outlier filter and the distance computations correspond to the
+    ones of CloudCompare (see CloudCompare.cc_subsampling(), CloudCompare.cc_statistical_outlier_removal(),
+    CloudCompare.cc_compute_cloud_to_cloud_distance() and CloudCompare.cc_compute_cloud_to_mesh_distance()),
+    i.e. the cloud does not need to be written to disk and processed by an external process.
+    """
+
+    @staticmethod
+    def compute_random_subsampling_indices(coords, num_remaining_points, seed=None):
+        """
+        :param num_remaining_points: number of points to keep
+        :return: sorted indices of the remaining points
+        """
+        num_points = len(coords)
+        if num_remaining_points >= num_points:
+            return np.arange(num_points)
+        random_state = np.random.RandomState(seed)
+        return np.sort(random_state.choice(num_points, num_remaining_points, replace=False))
+
+    @staticmethod
+    def compute_octree_subsampling_indices(coords, octree_level):
+        """
+        Subdivides the bounding cube of the coords 2^octree_level times along each
+        axis and keeps the point closest to the center of each occupied cell.
+        :return: sorted indices of the remaining points
+        """
+        assert 0 <= octree_level <= 21
+        coords = np.asarray(coords, dtype=float).reshape((-1, 3))
+        if len(coords) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        num_cells_per_axis = 1 << octree_level
+        bb_min = coords.min(axis=0)
+        cube_size = np.max(coords.max(axis=0) - bb_min)
+        cell_size = cube_size / num_cells_per_axis if cube_size > 0 else 1.0
+
+        cell_indices = np.floor((coords - bb_min) / cell_size).astype(np.int64)
+        np.clip(cell_indices, 0, num_cells_per_axis - 1, out=cell_indices)
+        cell_keys = (cell_indices[:, 0] << (2 * octree_level)) | (cell_indices[:, 1] << octree_level) | \
+            cell_indices[:, 2]
+
+        cell_centers = bb_min + (cell_indices + 0.5) * cell_size
+        distances_to_center = np.sum((coords - cell_centers) ** 2, axis=1)
+
+        # Sort by cell and (within each cell) by the distance to the cell center
+        order = np.lexsort((distances_to_center, cell_keys))
+        sorted_keys = cell_keys[order]
+        is_first = np.ones(len(order), dtype=bool)
+        is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        return np.sort(order[is_first])
+
+    @staticmethod
+    def compute_spatial_subsampling_indices(coords, min_distance, seed=0):
+        """
+        Selects a subset of the points, such that the distance between any two
+        remaining points is at least min_distance.
+
+        The points are first reduced to one candidate per cell of a grid with a
+        cell diagonal of min_distance (points of the same cell would violate the
+        distance constraint anyway). Then a maximal independent set of the
+        graph connecting candidates closer than min_distance is computed in
+        parallel rounds: in each round the candidates with a (random) priority
+        lower than the priorities of all their undecided neighbors are kept and
+        their neighbors are removed. Each removed point lies within
+        2 * min_distance of a remaining point.
+
+        :return: sorted indices of the remaining points
+        """
+        assert min_distance > 0
+        coords = np.asarray(coords, dtype=float).reshape((-1, 3))
+        if len(coords) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # One candidate (the first point) per grid cell
+        cell_size = min_distance / np.sqrt(3.0)
+        cell_indices = np.floor((coords - coords.min(axis=0)) / cell_size).astype(np.int64)
+        _, candidate_indices = np.unique(cell_indices, axis=0, return_index=True)
+        candidate_indices = np.sort(candidate_indices)
+        candidate_coords = coords[candidate_indices]
+        num_candidates = len(candidate_indices)
+
+        neighbor_pairs = cKDTree(candidate_coords).query_pairs(
+            min_distance * (1.0 - 1e-12), output_type='ndarray')
+        # Consider both directions of each pair
+        sources = np.concatenate((neighbor_pairs[:, 0], neighbor_pairs[:, 1]))
+        targets = np.concatenate((neighbor_pairs[:, 1], neighbor_pairs[:, 0]))
+
+        priorities = np.random.RandomState(seed).permutation(num_candidates)
+        is_undecided = np.ones(num_candidates, dtype=bool)
+        is_kept = np.zeros(num_candidates, dtype=bool)
+        while np.any(is_undecided):
+            min_neighbor_priorities = np.full(num_candidates, num_candidates, dtype=np.int64)
+            np.minimum.at(min_neighbor_priorities, sources, priorities[targets])
+
+            is_new_kept = is_undecided & (priorities < min_neighbor_priorities)
+            is_kept |= is_new_kept
+            is_undecided &= ~is_new_kept
+            is_removed = np.zeros(num_candidates, dtype=bool)
+            is_removed[targets[is_new_kept[sources]]] = True
+            is_undecided &= ~is_removed
+
+            # Only pairs of undecided candidates are relevant for the next round
+            is_active_pair = is_undecided[sources] & is_undecided[targets]
+            sources = sources[is_active_pair]
+            targets = targets[is_active_pair]
+
+        return candidate_indices[is_kept]
+
+    @staticmethod
+    def compute_mean_neighbor_distances(coords, number_of_neighbors, chunk_size=100000, num_workers=-1):
+        """
+        Computes for each point the mean distance to its number_of_neighbors nearest neighbors.
+        The queries are processed in chunks (limiting the memory consumption), each chunk
+        is distributed over num_workers threads (-1 uses all cpus).
+        """
+        coords = np.asarray(coords, dtype=float).reshape((-1, 3))
+        kd_tree = cKDTree(coords)
+        mean_distances = np.empty(len(coords), dtype=float)
+        for chunk_start in range(0, len(coords), chunk_size):
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            # The closest point of each query is the point itself
+            distances, _ = kd_tree.query(coords[chunk], k=number_of_neighbors + 1, workers=num_workers)
+            mean_distances[chunk] = np.mean(distances[:, 1:], axis=1)
+        return mean_distances
+
+    @staticmethod
+    def compute_statistical_outlier_mask(coords,
+                                         number_of_neighbors=6,
+                                         sigma_multiplier=1.0,
+                                         chunk_size=100000,
+                                         num_workers=-1):
+        """
+        Statistical outlier removal (SOR) filter, which resembles the one of CloudCompare and PCL:
+            http://pointclouds.org/documentation/tutorials/statistical_outlier.php
+
+        A point is an outlier, if the mean distance to its neighbors is larger than
+        mean + sigma_multiplier * std (computed over the mean distances of all points).
+
+        :return: boolean mask of the points to keep (use it to filter colors, normals, measurements, ...)
+        """
+        coords = np.asarray(coords, dtype=float).reshape((-1, 3))
+        if len(coords) <= number_of_neighbors:
+            return np.ones(len(coords), dtype=bool)
+        mean_distances = PointCloudCollection.compute_mean_neighbor_distances(
+            coords, number_of_neighbors, chunk_size, num_workers)
+        distance_threshold = np.mean(mean_distances) + sigma_multiplier * np.std(mean_distances, ddof=1)
+        return mean_distances <= distance_threshold
+
+    @staticmethod
+    def statistical_outlier_removal(point_cloud, number_of_neighbors=6, sigma_multiplier=1.0):
+        """
+        In-memory alternative to CloudCompare.statistical_outlier_removal()
+        :param point_cloud: PointCloud or (N,3) array
+        :return: PointCloud or (M,3) array
+        """
+        logger.info('statistical_outlier_removal: ...')
+        if isinstance(point_cloud, PointCloud):
+            coords = point_cloud.coords
+        else:
+            coords = np.asarray(point_cloud, dtype=float).reshape((-1, 3))
+        keep_mask = PointCloudCollection.compute_statistical_outlier_mask(
+            coords, number_of_neighbors, sigma_multiplier)
+        logger.vinfo('Number of removed points', len(keep_mask) - np.count_nonzero(keep_mask))
+        logger.info('statistical_outlier_removal: Done')
+        if isinstance(point_cloud, PointCloud):
+            return point_cloud.get_subset(keep_mask)
+        return coords[keep_mask]
+
+    @staticmethod
+    def compute_subsampling_indices(coords, subsampling_mode, subsampling_parameter):
+        """
+        :param subsampling_mode: SubSamplingMode
+        :param subsampling_parameter: number of points (RANDOM), minimum distance (SPATIAL) or octree level (OCTREE)
+        """
+        if subsampling_mode == SubSamplingMode.RANDOM:
+            return PointCloudCollection.compute_random_subsampling_indices(coords, int(subsampling_parameter))
+        elif subsampling_mode == SubSamplingMode.SPATIAL:
+            return PointCloudCollection.compute_spatial_subsampling_indices(coords, float(subsampling_parameter))
+        elif subsampling_mode == SubSamplingMode.OCTREE:
+            return PointCloudCollection.compute_octree_subsampling_indices(coords, int(subsampling_parameter))
+        else:
+            logger.vinfo('subsampling_mode', subsampling_mode)
+            assert False
+
+    @staticmethod
+    def subsample_point_cloud(point_cloud, subsampling_mode, subsampling_parameter):
+        """
+        In-memory alternative to CloudCompare.cc_subsampling()
+        :param point_cloud: PointCloud or (N,3) array
+        :return: PointCloud or (M,3) array
+        """
+        logger.info('subsample_point_cloud: ...')
+        if isinstance(point_cloud, PointCloud):
+            coords = point_cloud.coords
+        else:
+            coords = np.asarray(point_cloud, dtype=float).reshape((-1, 3))
+        indices = PointCloudCollection.compute_subsampling_indices(
+            coords, subsampling_mode, subsampling_parameter)
+        logger.vinfo('Number of remaining points', len(indices))
+        logger.info('subsample_point_cloud: Done')
+        if isinstance(point_cloud, PointCloud):
+            return point_cloud.get_subset(indices)
+        return coords[indices]
+
+    @staticmethod
+    def compute_distance_statistics(distances):
+        distances = np.asarray(distances, dtype=float)
+        statistics = OrderedDict()
+        statistics['num_points'] = len(distances)
+        if len(distances) == 0:
+            return statistics
+        statistics['mean'] = float(np.mean(distances))
+        statistics['std'] = float(np.std(distances))
+        statistics['median'] = float(np.median(distances))
+        statistics['min'] = float(np.min(distances))
+        statistics['max'] = float(np.max(distances))
+        statistics['rms'] = float(np.sqrt(np.mean(distances ** 2)))
+        return statistics
+
+    @staticmethod
+    def compute_cloud_to_cloud_distances(compared_coords, reference_coords, chunk_size=100000, num_workers=-1):
+        """
+        In-memory alternative to CloudCompare.cc_compute_cloud_to_cloud_distance(), i.e.
+        computes for each compared point the distance to the nearest reference point.
+
+        :param num_workers: number of threads used per chunk (-1 uses all cpus)
+        :return: distances, statistics
+        """
+        logger.info('compute_cloud_to_cloud_distances: ...')
+        compared_coords = np.asarray(compared_coords, dtype=float).reshape((-1, 3))
+        kd_tree = cKDTree(np.asarray(reference_coords, dtype=float).reshape((-1, 3)))
+        distances = np.empty(len(compared_coords), dtype=float)
+        for chunk_start in range(0, len(compared_coords), chunk_size):
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            distances[chunk], _ = kd_tree.query(compared_coords[chunk], workers=num_workers)
+        statistics = PointCloudCollection.compute_distance_statistics(distances)
+        logger.vinfo('statistics', statistics)
+        logger.info('compute_cloud_to_cloud_distances: Done')
+        return distances, statistics
+
+    @staticmethod
+    def _compute_cloud_to_mesh_distances_of_chunk(bvh, compared_coords, signed):
+        distances, triangle_ids, closest_points = bvh.compute_closest_points(compared_coords)
+        if signed:
+            # The orientation of the triangle (vertex order) defines the sign
+            triangle_vertices = bvh.triangle_vertices[triangle_ids]
+            normals = np.cross(
+                triangle_vertices[:, 1] - triangle_vertices[:, 0],
+                triangle_vertices[:, 2] - triangle_vertices[:, 0])
+            is_behind = np.einsum('ij,ij->i', compared_coords - closest_points, normals) < 0
+            distances[is_behind] *= -1
+        return distances
+
+    @staticmethod
+    def compute_cloud_to_mesh_distances(compared_coords,
+                                        triangle_vertices,
+                                        signed=False,
+                                        chunk_size=100000,
+                                        use_multiprocessing=True):
+        """
+        In-memory alternative to CloudCompare.cc_compute_cloud_to_mesh_distance(), i.e.
+        computes for each compared point the distance to the closest point of the mesh.
+
+        :param triangle_vertices: (T,3,3) array (see Triangle.convert_mesh_to_vertex_array()) or BoundingVolumeHierarchy
+        :param signed: if True, points behind the closest triangle have a negative distance
+        :param use_multiprocessing: if True, the chunks are processed in a process pool
+        :return: distances, statistics
+        """
+        logger.info('compute_cloud_to_mesh_distances: ...')
+        compared_coords = np.asarray(compared_coords, dtype=float).reshape((-1, 3))
+        if isinstance(triangle_vertices, BoundingVolumeHierarchy):
+            bvh = triangle_vertices
+        else:
+            bvh = BoundingVolumeHierarchy(triangle_vertices)
+
+        chunks = [compared_coords[chunk_start: chunk_start + chunk_size]
+                  for chunk_start in range(0, len(compared_coords), chunk_size)]
+        if use_multiprocessing and len(chunks) > 1 and multiprocessing.cpu_count() > 1:
+            with ProcessingPool() as pool:
+                results = []
+                for chunk in chunks:
+                    result = pool.apipe(
+                        PointCloudCollection._compute_cloud_to_mesh_distances_of_chunk, *[bvh, chunk, signed])
+                    results.append(result)
+                chunk_distances = [result.get() for result in results]
+        else:
+            chunk_distances = [PointCloudCollection._compute_cloud_to_mesh_distances_of_chunk(bvh, chunk, signed)
+                               for chunk in chunks]
+
+        if len(chunk_distances) > 0:
+            distances = np.concatenate(chunk_distances)
+        else:
+            distances = np.empty(0, dtype=float)
+        statistics = PointCloudCollection.compute_distance_statistics(distances)
+        logger.vinfo('statistics', statistics)
+        logger.info('compute_cloud_to_mesh_distances: Done')
+        return distances, statistics
@@ -1,7 +1,7 @@
 import os
 import numpy as np
-from pathos.multiprocessing import ProcessingPool
 from Utility.CloudCompare.CloudCompare import CloudCompare
+from Utility.CloudCompare.CloudCompare_Job_Runner import CloudCompareJobRunner
 from Utility.Logging_Extension import logger
 
 
@@ -42,7 +42,8 @@ class TransformationTool(object):
                                                        save_clouds=False,
                                                        save_meshes=False,
                                                        lazy=True,
-                                                       log_info_sub_methods=True
+                                                       log_info_sub_methods=True,
+                                                       max_num_workers=None
                                                        ):
 
         logger.info('apply_single_transformation_to_multiple_models: ...')
@@ -55,6 +56,7 @@ class TransformationTool(object):
              if (os.path.isfile(os.path.join(model_idp, model_file))
                  and os.path.splitext(model_file)[1] == '.ply')])
 
+        transformation_operations = []
         for model_file in sorted(model_files):
 
             output_path_to_transformed_model_file = os.path.join(
@@ -62,17 +64,20 @@ class TransformationTool(object):
 
             input_path_to_model_file = os.path.join(model_idp, model_file)
 
-            TransformationTool.apply_single_transformation_to_single_model(
-                ifp_model=input_path_to_model_file,
-                ifp_transformation=transformation_ifp,
-                ofp_model=output_path_to_transformed_model_file,
-                save_point_clouds=save_clouds,
-                save_meshes=save_meshes,
-                lazy=lazy,
-                log_info=log_info_sub_methods
-            )
+            if log_info_sub_methods:
+                logger.vinfo('output_path_to_transformed_model_file', output_path_to_transformed_model_file)
+
+            transformation_operations.append(
+                (input_path_to_model_file, transformation_ifp, output_path_to_transformed_model_file))
+
+        # The models are transformed with a few (concurrent) CloudCompare calls
+        job_runner = CloudCompareJobRunner(max_num_workers=max_num_workers)
+        jobs = job_runner.create_transformation_jobs(
+            transformation_operations, save_clouds, save_meshes, lazy=lazy)
+        jobs = job_runner.run(jobs)
 
         logger.info('apply_single_transformation_to_multiple_models: Done')
+        return jobs
 
     @staticmethod
     def apply_multiple_transformations_to_single_model(transformation_files_idp,
@@ -82,7 +87,8 @@ class TransformationTool(object):
                                                        save_point_clouds=False,
                                                        save_meshes=False,
                                                        lazy=True,
-                                                       log_info_sub_methods=False):
+                                                       log_info_sub_methods=False,
+                                                       max_num_workers=None):
 
 
         logger.info('apply_multiple_transformations_to_single_model: ...')
@@ -105,39 +111,33 @@ class TransformationTool(object):
         # Make sure .obj file was converted correctly
         assert os.path.isfile(model_ply_ifp)
 
-        results = []
-        with ProcessingPool() as pool:
-            for transformation_file in sorted(transformation_files):       # TODO FIXME
-                logger.vinfo('transformation_file', transformation_file)
-
-                transformed_model_ofp = os.path.join(
-                    transformed_model_odp,
-                    os.path.splitext(transformation_file)[0] + '_' +
-                    suffix +
-                    os.path.splitext(model_ply_ifp)[1])
-
-                logger.vinfo('transformed_model_ofp', transformed_model_ofp)
-
-                input_path_to_transformation_file = os.path.join(
-                    transformation_files_idp, transformation_file)
-                assert os.path.isfile(input_path_to_transformation_file)
-
-                result = pool.apipe(
-                    TransformationTool.apply_single_transformation_to_single_model,
-                    *[model_ply_ifp,
-                      input_path_to_transformation_file,
-                      transformed_model_ofp,
-                      save_point_clouds,
-                      save_meshes,
-                      lazy,
-                      log_info_sub_methods])
-                results.append(result)
-
-            # Collect the asynchronous calls
-            for result in results:
-                result.get()
+        transformation_operations = []
+        for transformation_file in sorted(transformation_files):
+            logger.vinfo('transformation_file', transformation_file)
+
+            transformed_model_ofp = os.path.join(
+                transformed_model_odp,
+                os.path.splitext(transformation_file)[0] + '_' +
+                suffix +
+                os.path.splitext(model_ply_ifp)[1])
+
+            logger.vinfo('transformed_model_ofp', transformed_model_ofp)
+
+            input_path_to_transformation_file = os.path.join(
+                transformation_files_idp, transformation_file)
+            assert os.path.isfile(input_path_to_transformation_file)
+
+            transformation_operations.append(
+                (model_ply_ifp, input_path_to_transformation_file, transformed_model_ofp))
+
+        # The transformations are applied with a few (concurrent) CloudCompare calls
+        job_runner = CloudCompareJobRunner(max_num_workers=max_num_workers)
+        jobs = job_runner.create_transformation_jobs(
+            transformation_operations, save_point_clouds, save_meshes, lazy=lazy)
+        jobs = job_runner.run(jobs)
 
         logger.info('apply_multiple_transformations_to_single_model: Done')
+        return jobs
 
     @staticmethod
     def apply_single_transformation_to_single_model(ifp_model,
@@ -5,8 +5,10 @@ import copy
 import numpy as np
 import math
 from Utility.Logging_Extension import logger
+from Utility.Cache.Raster_Cache import raster_cache
 from Utility.Types.Extrinsics import Extrinsics
 from Utility.Types.Intrinsics import Intrinsics
+from Utility.Types.Point_Cloud import PointCloud
 from Utility.Types.Ray import Ray
 
 
@@ -365,6 +367,11 @@ class Camera(Extrinsics, Intrinsics):
     # ============================== Measurements ===============================================================
     def compute_measurement_pos_of_points(self, points):
 
+        if isinstance(points, PointCloud):
+            track_table = points.measurements
+            observation_indices = track_table.get_observation_indices_of_camera(self.camera_index)
+            return list(zip(track_table.xs[observation_indices], track_table.ys[observation_indices]))
+
         measurement_pos = []
         for point in points:
             for measurement in point.measurements:
@@ -382,7 +389,7 @@ class Camera(Extrinsics, Intrinsics):
         assert self.width is not None
         assert self.height is not None
 
-        focal_length = self._calibration_mat[0][0]
+        focal_length = self.get_calibration_mat()[0][0]
         rays = []
         for x_y in x_y_positions:
             #logger.info(x_y)
@@ -403,17 +410,61 @@ class Camera(Extrinsics, Intrinsics):
             rays.append(Ray(pos_vec=ray_pos_vec, dir_vec=ray_dir_vec))
         return rays
 
+    def generate_camera_ray_arrays(self, x_y_positions, convert_to_world_coords=True):
+        """
+        Vectorized alternative to generate_camera_rays(), which considers the
+        full calibration matrix (fx, fy, cx, cy and skew).
+
+        In contrast to generate_camera_rays() the direction vectors are
+        canonical (i.e. the z component is 1 in camera coordinates), such that
+        the ray parameter t of a point corresponds to its depth.
+
+        :param x_y_positions: (N,2) array of image coordinates
+        :param convert_to_world_coords:
+        :return: pos_vecs, dir_vecs: (N,3) arrays
+        """
+
+        x_y_positions = np.asarray(x_y_positions, dtype=float).reshape((-1, 2))
+        num_rays = len(x_y_positions)
+
+        x_y_positions_hom = np.ones((num_rays, 3), dtype=float)
+        x_y_positions_hom[:, 0:2] = x_y_positions
+
+        # Compute the direction vectors in CAMERA COORDINATES, i.e. K^-1 * (x, y, 1)^T
+        # (row vectors are multiplied from the right with the transposed matrix)
+        inv_calibration_mat = np.linalg.inv(self.get_calibration_mat())
+        dir_vecs = x_y_positions_hom.dot(inv_calibration_mat.T)
+
+        if convert_to_world_coords:
+            # Compute the direction vectors in WORLD COORDINATES (R^T * dir_vec)
+            dir_vecs = dir_vecs.dot(self.get_rotation_mat())
+            pos_vecs = np.tile(self.get_camera_center(), (num_rays, 1))
+        else:
+            pos_vecs = np.zeros((num_rays, 3), dtype=float)
+
+        return pos_vecs, dir_vecs
+
     def set_depth_map(self, depth_map_ifp, depth_map_callback, depth_map_semantic):
         self.depth_map_fp = depth_map_ifp
         self.depth_map_callback = depth_map_callback
         self.depth_map_semantic = depth_map_semantic
 
-    def get_depth_map(self):
+    def get_depth_map(self, use_cache=False):
+        """
+        :param use_cache: if True, the depth map is read through the shared raster cache
+            (the returned array is read-only in this case)
+        """
         if os.path.isfile(self.depth_map_fp):
+            if use_cache:
+                return raster_cache.get(self.depth_map_fp, self.depth_map_callback)
             return self.depth_map_callback(self.depth_map_fp)
         else:
             return None
 
+    def prefetch_depth_map(self):
+        if self.depth_map_fp is not None:
+            raster_cache.prefetch(self.depth_map_fp, self.depth_map_callback)
+
 
     def convert_depth_map_to_world_coords(self,
                                           depth_map,
@@ -451,6 +502,44 @@ class Camera(Extrinsics, Intrinsics):
                                         depth_map_display_sparsity=100,
                                         inverted_cam_model=False):
 
+        cam_coords_tiles = list(self.iterate_depth_map_coord_tiles(
+            depth_map,
+            depth_map_semantic,
+            shift_to_pixel_center,
+            depth_map_display_sparsity,
+            inverted_cam_model=inverted_cam_model))
+        if len(cam_coords_tiles) == 0:
+            return np.zeros((0, 3), dtype=float)
+        return np.concatenate(cam_coords_tiles)
+
+    def iterate_depth_map_coord_tiles(self,
+                                      depth_map,
+                                      depth_map_semantic,
+                                      shift_to_pixel_center,  # False for Colmap, True for MVE
+                                      depth_map_display_sparsity=100,
+                                      inverted_cam_model=False,
+                                      num_rows_per_tile=None,
+                                      dtype=float,
+                                      convert_to_world_coords=False):
+        """
+        Back-projects the depth map block by block (num_rows_per_tile rows at
+        once) and yields the coordinates of the non-background pixels of each
+        block as (N,3) array. Background pixels are removed before any
+        coordinates are computed, i.e. the transient memory is proportional to
+        the size of a block (and not to the size of the whole depth map).
+
+        The concatenation of all blocks corresponds to the result of
+        convert_depth_map_to_cam_coords() (resp. convert_depth_map_to_world_coords()).
+
+        with PLYStreamWriter(ofp, with_colors=False) as writer:
+            for coords in cam.iterate_depth_map_coord_tiles(
+                    depth_map, semantic, False, num_rows_per_tile=256, dtype=np.float32, convert_to_world_coords=True):
+                writer.append_chunk(coords)
+
+        :param num_rows_per_tile: None processes the whole depth map at once
+        :param dtype: use np.float32 to halve the memory consumption
+        """
+
         assert 0 < depth_map_display_sparsity
 
         height, width = depth_map.shape
@@ -469,93 +558,86 @@ class Camera(Extrinsics, Intrinsics):
         fx, fy, skew, cx, cy = self.split_intrinsic_mat(self.get_calibration_mat())
         logger.vinfo('fx, fy, skew, cx, cy: ', str([fx, fy, skew, cx, cy]))
 
-        indices = np.indices((height, width))
-        y_index_list = indices[0].flatten()
-        x_index_list = indices[1].flatten()
-
         if inverted_cam_model:  # For Blender, VTK, etc
             # Use the local coordinate system of the camera to analyze its viewing directions
             # The Blender camera coordinate system looks along the negative z axis (blue),
             # the up axis points along the y axis (green).
-            y_index_list = y_index_list[::-1]  # Reverse order of indices
-            x_index_list = x_index_list[::-1]  # Reverse order of indices
-            fx = -fx
-            fy = -fy
             assert False    # TODO Verify this
 
-        depth_values = depth_map.flatten()
-
-        assert len(x_index_list) == len(y_index_list) == len(depth_values)
-
-        if shift_to_pixel_center:
-            # https://github.com/simonfuhrmann/mve/blob/master/libs/mve/depthmap.cc
-            #  math::Vec3f v = invproj * math::Vec3f(
-            #       (float)x + 0.5f, (float)y + 0.5f, 1.0f);
-            u_index_coord_list = x_step_size * x_index_list + 0.5
-            v_index_coord_list = y_step_size * y_index_list + 0.5
-        else:
-            # https://github.com/colmap/colmap/blob/dev/src/base/reconstruction.cc
-            #   // COLMAP assumes that the upper left pixel center is (0.5, 0.5)
-            # i.e. pixels are already shifted
-            u_index_coord_list = x_step_size * x_index_list
-            v_index_coord_list = y_step_size * y_index_list
-
-        # The cannoncial vectors are defined according to p.155 of
-        # "Multiple View Geometry" by Hartley and Zisserman using a canonical
-        # focal length of 1 , i.e. vec = [(x - cx) / fx, (y - cy) / fy, 1]
-        x_coords_canonical = (u_index_coord_list - cx) / fx + (cy - v_index_coord_list) * skew / (fx * fy)
-        y_coords_canonical = (v_index_coord_list - cy) / fy
-        z_coords_canonical = np.ones(len(depth_values), dtype=float)
-
-        # Determine non-background data
-        # non_background_flags = np.logical_not(np.isnan(depth_values))
-        depth_values_not_nan = np.nan_to_num(depth_values)
-        non_background_flags = depth_values_not_nan > 0
-
-        x_coords_canonical_filtered = x_coords_canonical[non_background_flags]
-        y_coords_canonical_filtered = y_coords_canonical[non_background_flags]
-        z_coords_canonical_filtered = z_coords_canonical[non_background_flags]
-        depth_values_filtered = depth_values[non_background_flags]
-
-        if depth_map_display_sparsity != 100:
-            x_coords_canonical_filtered = x_coords_canonical_filtered[::depth_map_display_sparsity]
-            y_coords_canonical_filtered = y_coords_canonical_filtered[::depth_map_display_sparsity]
-            z_coords_canonical_filtered = z_coords_canonical_filtered[::depth_map_display_sparsity]
-            depth_values_filtered = depth_values_filtered[::depth_map_display_sparsity]
-
-        if depth_map_semantic == Camera.DEPTH_MAP_WRT_CANONICAL_VECTORS:
-            # In this case, the depth values are defined w.r.t. the canonical
-            # vectors. This kind of depth data is used by Colmap.
-            x_coords_filtered = x_coords_canonical_filtered * depth_values_filtered
-            y_coords_filtered = y_coords_canonical_filtered * depth_values_filtered
-            z_coords_filtered = z_coords_canonical_filtered * depth_values_filtered
-
-        elif depth_map_semantic == Camera.DEPTH_MAP_WRT_UNIT_VECTORS:
-            # In this case the depth values are defined w.r.t. the normalized
-            # canonical vectors. This kind of depth data is used by MVE.
-            cannonical_norms_filtered = np.linalg.norm(
-                np.array(
-                    [x_coords_canonical_filtered,
-                     y_coords_canonical_filtered,
-                     z_coords_canonical_filtered],
-                    dtype=float),
-                axis=0)
-            # Instead of normalizing the x,y and z component, we divide the
-            # depth values by the corresponding norm.
-            normalized_depth_values_filtered = depth_values_filtered / cannonical_norms_filtered
-            x_coords_filtered = x_coords_canonical_filtered * normalized_depth_values_filtered
-            y_coords_filtered = y_coords_canonical_filtered * normalized_depth_values_filtered
-            z_coords_filtered = z_coords_canonical_filtered * normalized_depth_values_filtered
+        assert depth_map_semantic in [Camera.DEPTH_MAP_WRT_CANONICAL_VECTORS, Camera.DEPTH_MAP_WRT_UNIT_VECTORS]
+
+        if convert_to_world_coords:
+            rotation_mat = self.get_rotation_mat().astype(dtype)
+            camera_center = self.get_camera_center().astype(dtype)
+
+        if num_rows_per_tile is None:
+            num_rows_per_tile = max(height, 1)
+
+        # Number of non-background pixels in the previous blocks (required to
+        # select every n-th non-background pixel across block boundaries)
+        num_previous_non_background = 0
+        for first_row in range(0, height, num_rows_per_tile):
+            depth_map_tile = depth_map[first_row: first_row + num_rows_per_tile]
+
+            # Determine non-background data (nan values are background)
+            with np.errstate(invalid='ignore'):
+                non_background_flags = depth_map_tile > 0
+            y_index_list, x_index_list = np.nonzero(non_background_flags)
+            depth_values_filtered = depth_map_tile[y_index_list, x_index_list]
+
+            num_non_background = len(depth_values_filtered)
+            if depth_map_display_sparsity != 100:
+                first_selected = (-num_previous_non_background) % depth_map_display_sparsity
+                y_index_list = y_index_list[first_selected::depth_map_display_sparsity]
+                x_index_list = x_index_list[first_selected::depth_map_display_sparsity]
+                depth_values_filtered = depth_values_filtered[first_selected::depth_map_display_sparsity]
+            num_previous_non_background += num_non_background
+
+            if len(depth_values_filtered) == 0:
+                continue
+
+            x_index_list = x_index_list.astype(dtype)
+            y_index_list = (y_index_list + first_row).astype(dtype)
+            depth_values_filtered = depth_values_filtered.astype(dtype)
+
+            if shift_to_pixel_center:
+                # https://github.com/simonfuhrmann/mve/blob/master/libs/mve/depthmap.cc
+                #  math::Vec3f v = invproj * math::Vec3f(
+                #       (float)x + 0.5f, (float)y + 0.5f, 1.0f);
+                u_index_coord_list = x_step_size * x_index_list + 0.5
+                v_index_coord_list = y_step_size * y_index_list + 0.5
+            else:
+                # https://github.com/colmap/colmap/blob/dev/src/base/reconstruction.cc
+                #   // COLMAP assumes that the upper left pixel center is (0.5, 0.5)
+                # i.e. pixels are already shifted
+                u_index_coord_list = x_step_size * x_index_list
+                v_index_coord_list = y_step_size * y_index_list
+
+            # The cannoncial vectors are defined according to p.155 of
+            # "Multiple View Geometry" by Hartley and Zisserman using a canonical
+            # focal length of 1 , i.e. vec = [(x - cx) / fx, (y - cy) / fy, 1]
+            coords = np.empty((len(depth_values_filtered), 3), dtype=dtype)
+            coords[:, 0] = (u_index_coord_list - cx) / fx + (cy - v_index_coord_list) * skew / (fx * fy)
+            coords[:, 1] = (v_index_coord_list - cy) / fy
+            coords[:, 2] = 1
+
+            if depth_map_semantic == Camera.DEPTH_MAP_WRT_CANONICAL_VECTORS:
+                # In this case, the depth values are defined w.r.t. the canonical
+                # vectors. This kind of depth data is used by Colmap.
+                coords *= depth_values_filtered[:, np.newaxis]
+            else:
+                # In this case the depth values are defined w.r.t. the normalized
+                # canonical vectors. This kind of depth data is used by MVE.
+                # Instead of normalizing the x,y and z component, we divide the
+                # depth values by the corresponding norm.
+                coords *= (depth_values_filtered / np.linalg.norm(coords, axis=1))[:, np.newaxis]
 
-        else:
-            assert False
-
-        cam_coords = np.dstack(
-            (x_coords_filtered,
-             y_coords_filtered,
-             z_coords_filtered))[0]
+            if convert_to_world_coords:
+                # world_coord = R^T * cam_coord + c (for row vectors)
+                coords = coords.dot(rotation_mat)
+                coords += camera_center
 
-        return cam_coords
+            yield coords
 
     @staticmethod
     def parse_camera_image_files(cameras, path_to_images):
@@ -0,0 +1,4 @@
+class SubSamplingMode:
+    RANDOM = 'RANDOM'
+    SPATIAL = 'SPATIAL'
+    OCTREE = 'OCTREE'
@@ -0,0 +1,375 @@
+import numpy as np
+from collections import OrderedDict
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+from Utility.Classes.Frozen_Class import FrozenClass
+from Utility.Types.Point import Point
+from Utility.Types.Track_Table import TrackTable
+
+
+class PointScalarsView(MutableMapping):
+    """
+    Write-through mapping of the scalars of a single entry of a PointCloud.
+
+    Like Point.scalars, missing scalar keys return None. Assigning a new
+    scalar key adds a scalar (initialized with nan) to the point cloud.
+    """
+
+    def __init__(self, point_cloud, index):
+        self._point_cloud = point_cloud
+        self._index = index
+
+    def __getitem__(self, scalar_key):
+        if scalar_key not in self._point_cloud.scalars:
+            return None
+        return self._point_cloud.scalars[scalar_key][self._index]
+
+    def __setitem__(self, scalar_key, scalar_value):
+        if scalar_key not in self._point_cloud.scalars:
+            self._point_cloud.add_scalar(scalar_key, np.full(len(self._point_cloud), np.nan))
+        self._point_cloud.scalars[scalar_key][self._index] = scalar_value
+
+    def __delitem__(self, scalar_key):
+        raise TypeError('Scalars are defined for all points, use the scalars of the PointCloud')
+
+    def __iter__(self):
+        return iter(self._point_cloud.scalars)
+
+    def __len__(self):
+        return len(self._point_cloud.scalars)
+
+    def __contains__(self, scalar_key):
+        return scalar_key in self._point_cloud.scalars
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class PointView(Point):
+    """
+    Lazy view of a single entry of a PointCloud.
+
+    Provides the interface of Point for old call sites without copying the
+    point data. Coordinates and normals are numpy views into the arrays of
+    the point cloud, i.e. in-place modifications (and assignments) are
+    written back to the point cloud. Colors are returned as int arrays (like
+    Point.color, i.e. arithmetic does not wrap around at 256), changes must
+    be assigned.
+    """
+
+    def __init__(self, point_cloud, index):
+        # Do NOT call Point.__init__(), since this would allocate new arrays
+        object.__setattr__(self, '_point_cloud', point_cloud)
+        object.__setattr__(self, '_index', index)
+        self.is_object_point = None
+
+    @property
+    def coord(self):
+        return self._point_cloud.coords[self._index]
+
+    @coord.setter
+    def coord(self, coord):
+        self._point_cloud.coords[self._index] = coord
+
+    @property
+    def color(self):
+        return self._point_cloud.colors[self._index].astype(int)
+
+    @color.setter
+    def color(self, color):
+        self._point_cloud.colors[self._index] = color
+
+    @property
+    def normal(self):
+        if self._point_cloud.normals is None:
+            return np.array([0, 0, 0], dtype=float)
+        return self._point_cloud.normals[self._index]
+
+    @normal.setter
+    def normal(self, normal):
+        assert self._point_cloud.normals is not None
+        self._point_cloud.normals[self._index] = normal
+
+    @property
+    def with_normal(self):
+        return self._point_cloud.normals is not None
+
+    @with_normal.setter
+    def with_normal(self, with_normal):
+        # Normals are defined for all points of a point cloud or for none
+        assert with_normal == self.with_normal
+
+    @property
+    def id(self):
+        return self._point_cloud.ids[self._index]
+
+    @id.setter
+    def id(self, point_id):
+        self._point_cloud.ids[self._index] = point_id
+
+    @property
+    def scalars(self):
+        return PointScalarsView(self._point_cloud, self._index)
+
+    @property
+    def measurements(self):
+        return self._point_cloud.get_measurements_of_point(self._index)
+
+    @measurements.setter
+    def measurements(self, measurements):
+        # Note: This rebuilds the TrackTable of the point cloud, use PointCloud.set_measurements() for all points
+        self._point_cloud.set_measurements_of_point(self._index, measurements)
+
+    def __str__(self):
+        return 'PointView: ' + str(self._index) + ' ' + str(self.coord) + ' ' + str(self.color)
+
+
+class PointCloud(FrozenClass):
+    """
+    Columnar (struct-of-arrays) representation of a set of points.
+
+    In contrast to a list of Point objects, all points share the same arrays:
+        coords:         (N,3) float array
+        colors:         (N,3) uint8 array
+        normals:        (N,3) float array or None
+        scalars:        ordered dict mapping a scalar name to an (N,) array
+        ids:            (N,) int array
+        measurements:   TrackTable (with one track per point) or None
+
+    Iterating over a point cloud (or indexing it with an integer) yields lazy
+    PointView objects, i.e. code written for lists of Points keeps working.
+    """
+
+    def __init__(self, coords, colors=None, normals=None, scalars=None, ids=None, measurements=None):
+
+        self.coords = np.asarray(coords, dtype=float).reshape((-1, 3))
+        num_points = len(self.coords)
+
+        if colors is None:
+            self.colors = np.full((num_points, 3), 255, dtype=np.uint8)
+        else:
+            self.colors = np.asarray(colors, dtype=np.uint8).reshape((-1, 3))
+
+        if normals is None:
+            self.normals = None
+        else:
+            self.normals = np.asarray(normals, dtype=float).reshape((-1, 3))
+
+        self.scalars = OrderedDict()
+        if scalars is not None:
+            for scalar_key, scalar_values in scalars.items():
+                self.scalars[scalar_key] = np.asarray(scalar_values)
+
+        if ids is None:
+            self.ids = np.arange(num_points)
+        else:
+            self.ids = np.asarray(ids, dtype=int)
+
+        # Measurements are stored as TrackTable (one track per point)
+        if measurements is None or isinstance(measurements, TrackTable):
+            self.measurements = measurements
+        else:
+            self.measurements = TrackTable.init_from_measurement_lists(measurements)
+
+        self.check_consistency()
+
+    @classmethod
+    def init_from_points(cls, points):
+
+        num_points = len(points)
+        coords = np.empty((num_points, 3), dtype=float)
+        colors = np.empty((num_points, 3), dtype=np.uint8)
+
+        with_normals = num_points > 0 and all(point.with_normal for point in points)
+        normals = np.empty((num_points, 3), dtype=float) if with_normals else None
+
+        scalar_keys = list(points[0].scalars.keys()) if num_points > 0 else []
+        scalars = OrderedDict([(scalar_key, np.empty(num_points, dtype=float)) for scalar_key in scalar_keys])
+
+        with_measurements = num_points > 0 and points[0].measurements is not None
+        measurements = [] if with_measurements else None
+
+        ids = np.arange(num_points)
+        for index, point in enumerate(points):
+            coords[index] = point.coord
+            colors[index] = point.color
+            if with_normals:
+                normals[index] = point.normal
+            for scalar_key in scalar_keys:
+                scalars[scalar_key][index] = point.scalars[scalar_key]
+            if with_measurements:
+                measurements.append(point.measurements)
+            if point.id is not None:
+                ids[index] = point.id
+
+        return cls(coords, colors, normals, scalars, ids, measurements)
+
+    def check_consistency(self):
+        num_points = len(self.coords)
+        assert len(self.colors) == num_points
+        assert self.normals is None or len(self.normals) == num_points
+        assert len(self.ids) == num_points
+        for scalar_values in self.scalars.values():
+            assert len(scalar_values) == num_points
+        assert self.measurements is None or len(self.measurements) == num_points
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield PointView(self, index)
+
+    def __getitem__(self, index_or_indices):
+        """
+        An integer returns a PointView, a slice, an index array or a boolean
+        mask returns a new PointCloud
+        """
+        if isinstance(index_or_indices, (int, np.integer)):
+            index = int(index_or_indices)
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError('point index out of range')
+            return PointView(self, index)
+        return self.get_subset(index_or_indices)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return 'PointCloud: ' + str(len(self)) + ' points, normals: ' + str(self.has_normals()) + \
+               ', scalars: ' + str(list(self.scalars.keys())) + \
+               ', measurements: ' + str(self.has_measurements())
+
+    def has_normals(self):
+        return self.normals is not None
+
+    def has_measurements(self):
+        return self.measurements is not None
+
+    def get_coords(self):
+        return self.coords
+
+    def get_colors(self):
+        return self.colors
+
+    def get_normals(self):
+        return self.normals
+
+    def get_point(self, index):
+        return PointView(self, index)
+
+    def get_measurements_of_point(self, index):
+        if self.measurements is None:
+            return None
+        return self.measurements.get_measurements(index)
+
+    def set_measurements_of_point(self, index, measurements):
+        """
+        :param measurements: list of <Measurement> (None is treated as empty list)
+        """
+        if measurements is None:
+            if self.measurements is None:
+                return
+            measurements = []
+        if self.measurements is None:
+            # Create a table with empty tracks
+            self.measurements = TrackTable(np.zeros(len(self) + 1, dtype=np.int64), [], [], [], [])
+        self.measurements.set_measurements(index, measurements)
+
+    def set_measurements(self, measurements):
+        """
+        :param measurements: TrackTable or list with one list of <Measurement> per point
+        """
+        if measurements is not None and not isinstance(measurements, TrackTable):
+            measurements = TrackTable.init_from_measurement_lists(measurements)
+        assert measurements is None or len(measurements) == len(self)
+        self.measurements = measurements
+
+    def get_subset(self, index_or_mask):
+        """
+        Returns a new PointCloud containing the points selected by a slice,
+        an index array or a boolean mask
+        """
+        if isinstance(index_or_mask, slice):
+            indices = np.arange(len(self))[index_or_mask]
+        else:
+            index_or_mask = np.asarray(index_or_mask)
+            if index_or_mask.dtype == bool:
+                assert len(index_or_mask) == len(self)
+                indices = np.flatnonzero(index_or_mask)
+            else:
+                indices = index_or_mask.astype(int)
+
+        normals = None
+        if self.normals is not None:
+            normals = self.normals[indices]
+
+        scalars = OrderedDict(
+            [(scalar_key, scalar_values[indices]) for scalar_key, scalar_values in self.scalars.items()])
+
+        measurements = None
+        if self.measurements is not None:
+            measurements = self.measurements.get_subset(indices)
+
+        return PointCloud(
+            self.coords[indices],
+            self.colors[indices],
+            normals,
+            scalars,
+            self.ids[indices],
+            measurements)
+
+    def add_scalar(self, scalar_key, scalar_values):
+        scalar_values = np.asarray(scalar_values)
+        assert len(scalar_values) == len(self)
+        self.scalars[scalar_key] = scalar_values
+
+    def to_points(self):
+        """
+        Converts the columnar representation into a list of (independent) Point objects
+        """
+        points = []
+        for index in range(len(self)):
+            point = Point(coord=self.coords[index], color=self.colors[index])
+            if self.normals is not None:
+                point.set_normal(self.normals[index])
+            for scalar_key, scalar_values in self.scalars.items():
+                point.scalars[scalar_key] = scalar_values[index]
+            if self.measurements is not None:
+                point.measurements = self.measurements.get_measurements_as_copies(index)
+            point.id = self.ids[index]
+            points.append(point)
+        return points
+
+    @staticmethod
+    def concatenate(point_clouds):
+        assert len(point_clouds) > 0
+        with_normals = all(point_cloud.has_normals() for point_cloud in point_clouds)
+        with_measurements = all(point_cloud.has_measurements() for point_cloud in point_clouds)
+        scalar_keys = [scalar_key for scalar_key in point_clouds[0].scalars
+                       if all(scalar_key in point_cloud.scalars for point_cloud in point_clouds)]
+
+        normals = None
+        if with_normals:
+            normals = np.concatenate([point_cloud.normals for point_cloud in point_clouds])
+
+        scalars = OrderedDict(
+            [(scalar_key, np.concatenate([point_cloud.scalars[scalar_key] for point_cloud in point_clouds]))
+             for scalar_key in scalar_keys])
+
+        measurements = None
+        if with_measurements:
+            measurements = TrackTable.concatenate(
+                [point_cloud.measurements for point_cloud in point_clouds])
+
+        return PointCloud(
+            np.concatenate([point_cloud.coords for point_cloud in point_clouds]),
+            np.concatenate([point_cloud.colors for point_cloud in point_clouds]),
+            normals,
+            scalars,
+            np.concatenate([point_cloud.ids for point_cloud in point_clouds]),
+            measurements)
@@ -11,6 +11,9 @@ from PIL import Image
 from Utility.Classes.Frozen_Class import FrozenClass
 from Utility.File_Handler.MVS_Colmap_FileHandler import MVSColmapFileHandler
 from Utility.Types.Point import Point
+from Utility.Types.Point_Cloud import PointCloud
+from Utility.Types.Voxel_Grid import VoxelGrid
+from pathos.multiprocessing import ProcessingPool
 
 class Reconstruction(FrozenClass):
 
@@ -18,7 +21,7 @@ class Reconstruction(FrozenClass):
         """
         TODO
         :param cams:
-        :param points:
+        :param points: list of Points or PointCloud
         :param image_folder_path:
         :param sparse_reconstruction_type:
         """
@@ -36,9 +39,10 @@ class Reconstruction(FrozenClass):
         self.dense_points = None
 
     @classmethod
-    def init_from_nvm(cls, nvm_file_path, image_folder_path, sparse_reconstruction_type, principal_point):
+    def init_from_nvm(cls, nvm_file_path, image_folder_path, sparse_reconstruction_type, principal_point,
+                      as_point_cloud=False):
 
-        cams, points = NVMFileHandler.parse_nvm_file(nvm_file_path)
+        cams, points = NVMFileHandler.parse_nvm_file(nvm_file_path, as_point_cloud=as_point_cloud)
         for cam in cams:
             cam.set_principal_point(principal_point)
 
@@ -53,6 +57,9 @@ class Reconstruction(FrozenClass):
         return self.get_points_visible_in_camera(camera_index, self.dense_points)
 
     def get_points_visible_in_camera(self, camera_index, points):
+        if isinstance(points, PointCloud):
+            # The inverted index of the track table avoids a scan over all points
+            return points.get_subset(points.measurements.get_point_indices_of_camera(camera_index))
         visible_points = []
         for index, point in enumerate(points):
             for measurement in point.measurements:
@@ -94,6 +101,73 @@ class Reconstruction(FrozenClass):
         fn_to_cam = {fn: self.camera_index_to_camera[cam_idx] for fn, cam_idx in fn_to_cam_idx.items()}
         return fn_to_cam
 
+    def get_depth_map(self, camera_index, num_read_ahead=2):
+        """
+        Returns the (cached, read-only) depth map of the camera and reads the
+        depth maps of the next num_read_ahead cameras in the background
+        """
+        camera_indices = sorted(self.camera_index_to_camera.keys())
+        position = camera_indices.index(camera_index)
+        for next_camera_index in camera_indices[position + 1: position + 1 + num_read_ahead]:
+            self.camera_index_to_camera[next_camera_index].prefetch_depth_map()
+        return self.camera_index_to_camera[camera_index].get_depth_map(use_cache=True)
+
+    @staticmethod
+    def _fuse_depth_map_of_camera(camera, voxel_size, shift_to_pixel_center, num_rows_per_tile):
+        """
+        Returns the (voxel downsampled) world coordinates of the depth map of the camera
+        """
+        voxel_grid = VoxelGrid(voxel_size)
+        depth_map = camera.get_depth_map()
+        if depth_map is None:
+            logger.info('No depth map found: ' + str(camera.depth_map_fp))
+            return voxel_grid
+        for world_coords in camera.iterate_depth_map_coord_tiles(
+                depth_map,
+                camera.depth_map_semantic,
+                shift_to_pixel_center,
+                num_rows_per_tile=num_rows_per_tile,
+                convert_to_world_coords=True):
+            voxel_grid.add_coords(world_coords, camera_index=camera.camera_index)
+        # Merge the buffered tiles in the worker
+        voxel_grid.flush()
+        return voxel_grid
+
+    def fuse_depth_maps(self, voxel_size, shift_to_pixel_center, num_rows_per_tile=256, use_multiprocessing=True):
+        """
+        Back-projects the depth maps of all cameras (see Camera.set_depth_map())
+        and merges the resulting points in a voxel grid, i.e. the memory
+        consumption is bounded by the number of occupied voxels.
+
+        :param voxel_size: edge length of the voxels (the points of a voxel are replaced by their centroid)
+        :param shift_to_pixel_center: False for Colmap, True for MVE
+        :return: point_cloud, source_camera_indices (the camera index of the first point of each voxel)
+        """
+        logger.info('fuse_depth_maps: ...')
+        cams = [cam for cam in self.get_cameras_as_list() if cam.depth_map_fp is not None]
+        logger.vinfo('Number of depth maps', len(cams))
+
+        voxel_grid = VoxelGrid(voxel_size)
+        if use_multiprocessing:
+            with ProcessingPool() as pool:
+                # The partial grids are merged as soon as they are available
+                camera_voxel_grids = pool.imap(
+                    Reconstruction._fuse_depth_map_of_camera,
+                    cams,
+                    [voxel_size] * len(cams),
+                    [shift_to_pixel_center] * len(cams),
+                    [num_rows_per_tile] * len(cams))
+                for camera_voxel_grid in camera_voxel_grids:
+                    voxel_grid.add_voxel_grid(camera_voxel_grid)
+        else:
+            for cam in cams:
+                voxel_grid.add_voxel_grid(Reconstruction._fuse_depth_map_of_camera(
+                    cam, voxel_size, shift_to_pixel_center, num_rows_per_tile))
+
+        logger.vinfo('Number of fused points', len(voxel_grid))
+        logger.info('fuse_depth_maps: Done')
+        return voxel_grid.to_point_cloud(), voxel_grid.get_camera_indices()
+
     def get_cameras_as_list(self):
         return self.camera_index_to_camera.values()
 
@@ -116,7 +190,7 @@ class Reconstruction(FrozenClass):
     def remove_dense_points(self):
         self.dense_points = None
 
-    def set_dense_points_from_colmap_mvs(self, input_path_to_mvs_colmap_file, n_th_point=2):
+    def set_dense_points_from_colmap_mvs(self, input_path_to_mvs_colmap_file, n_th_point=2, as_point_cloud=False):
 
         logger.info('set_dense_points_from_colmap_mvs: ...')
         logger.info('The first time this may take a while')
@@ -125,19 +199,24 @@ class Reconstruction(FrozenClass):
         self.dense_points = MVSColmapFileHandler.parse_MVS_colmap_file(
             input_path_to_mvs_colmap_file,
             file_name_to_camera_id,
-            n_th_point=n_th_point)
+            n_th_point=n_th_point,
+            as_point_cloud=as_point_cloud)
         logger.info('set_dense_points_from_colmap_mvs: Done')
 
-    def set_dense_points_from_nvm(self, input_path_to_nvm_file):
+    def set_dense_points_from_nvm(self, input_path_to_nvm_file, as_point_cloud=False):
         logger.info('set_dense_points_from_nvm: ...')
         assert self.dense_points is None
-        _, self.dense_points = NVMFileHandler.parse_nvm_file(input_path_to_nvm_file)
+        _, self.dense_points = NVMFileHandler.parse_nvm_file(
+            input_path_to_nvm_file, as_point_cloud=as_point_cloud)
         logger.info('set_dense_points_from_nvm: Done')
 
-    def set_dense_points_from_ply(self, input_path_to_ply_file):
+    def set_dense_points_from_ply(self, input_path_to_ply_file, as_point_cloud=False):
         logger.info('set_dense_points_from_ply: ...')
         assert self.dense_points is None
-        dense_points, _ = PLYFileHandler.parse_ply_file(input_path_to_ply_file)
+        if as_point_cloud:
+            dense_points, _ = PLYFileHandler.parse_ply_file_as_point_cloud(input_path_to_ply_file)
+        else:
+            dense_points, _ = PLYFileHandler.parse_ply_file(input_path_to_ply_file)
         if len(dense_points) > 0:
             self.dense_points = dense_points
         logger.info('set_dense_points_from_ply: Done')
@@ -223,12 +302,72 @@ class Reconstruction(FrozenClass):
         logger.vinfo('num_invalid_projections', num_invalid_projections)
         return points_background_mod
 
+    def update_measurements_with_point_projections_batched(self, point_cloud):
+        """
+        Vectorized version of update_measurements_with_point_projections_efficient().
+
+        The observations are grouped by camera (using the inverted index of the
+        track table) and the corresponding points are projected with a single
+        numpy call per camera. The (clipped) projections are written in place
+        into the track table of point_cloud, i.e. the points are NOT copied.
+        :param point_cloud: PointCloud with measurements
+        :return: point_cloud
+        """
+        assert isinstance(point_cloud, PointCloud)
+        assert point_cloud.has_measurements()
+
+        track_table = point_cloud.measurements
+        observation_point_indices = track_table.get_observation_point_indices()
+        camera_indices = track_table.get_camera_indices_with_observations()
+
+        # Stack the world to image (3x4) matrices of all cameras, i.e. K * [R | -Rc]
+        projection_mats = np.empty((len(camera_indices), 3, 4), dtype=float)
+        for stack_index, camera_index in enumerate(camera_indices):
+            camera = self.camera_index_to_camera[camera_index]
+            # Radial distortion is not supported by the single point projection either
+            assert not camera.has_radial_distortion()
+            projection_mats[stack_index] = camera.get_calibration_mat().dot(
+                camera.get_4x4_world_to_cam_mat()[0:3, :])
+
+        coords_hom = np.ones((len(point_cloud), 4), dtype=float)
+        coords_hom[:, 0:3] = point_cloud.coords
+
+        num_invalid_projections = 0
+        for stack_index, camera_index in enumerate(camera_indices):
+            camera = self.camera_index_to_camera[camera_index]
+            observation_indices = track_table.get_observation_indices_of_camera(camera_index)
+
+            # The third component corresponds to the depth w.r.t. the camera
+            image_points_hom = coords_hom[observation_point_indices[observation_indices]].dot(
+                projection_mats[stack_index].T)
+            in_front_of_camera = image_points_hom[:, 2] > 0
+
+            # Avoid a division by zero for points behind the camera (these are discarded anyway)
+            depths = np.where(in_front_of_camera, image_points_hom[:, 2], 1.0)
+            xs = image_points_hom[:, 0] / depths
+            ys = image_points_hom[:, 1] / depths
+
+            # Same visibility criterion as project_single_point_cam_coord_into_camera_image_as_image_coord()
+            visible = in_front_of_camera & (np.abs(xs) < camera.width) & (np.abs(ys) < camera.height)
+            num_invalid_projections += int(np.count_nonzero(~visible))
+
+            # Replace previous measurements and clip them if necessary
+            visible_observation_indices = observation_indices[visible]
+            track_table.xs[visible_observation_indices] = np.minimum(camera.width - 1, xs[visible])
+            track_table.ys[visible_observation_indices] = np.minimum(camera.height - 1, ys[visible])
+
+        logger.vinfo('num_invalid_projections', num_invalid_projections)
+        return point_cloud
+
     def update_measurements_with_point_projections(self, points_background_original, debug=False, debug_offset=0):
 
         logger.info('update_measurements_with_point_projections: ...')
         if debug:
             self.update_measurements_with_point_projections_debug(points_background_original, debug_offset=debug_offset)
             assert False
+        elif isinstance(points_background_original, PointCloud):
+            points_background_mod = self.update_measurements_with_point_projections_batched(
+                points_background_original)
         else:
             points_background_mod = self.update_measurements_with_point_projections_efficient(
                 points_background_original)
@@ -248,7 +387,7 @@ class Reconstruction(FrozenClass):
         logger.vinfo('use_h5_files', use_h5_files)
 
         from Utility.Image.Image_Drawing_Interface import ImageDrawingInterface
-        cam_index_list = self.camera_index_to_camera.keys()
+        cam_index_list = list(self.camera_index_to_camera.keys())
 
         if use_dense_points:
             points = self.dense_points
@@ -271,15 +410,23 @@ class Reconstruction(FrozenClass):
                     self.image_folder_path, current_cam.file_name)
                 logger.vinfo('image_like_path: ', image_like_path)
 
-            pixels_visible = []
-            pixels_colors = []
+            if isinstance(points, PointCloud):
+                track_table = points.measurements
+                observation_indices = track_table.get_observation_indices_of_camera(current_cam_index)
+                point_indices = track_table.get_observation_point_indices()[observation_indices]
+                pixels_visible = np.column_stack(
+                    (track_table.xs[observation_indices], track_table.ys[observation_indices]))
+                pixels_colors = points.colors[point_indices]
+            else:
+                pixels_visible = []
+                pixels_colors = []
 
-            for point in points:
-                for measurement in point.measurements:
-                    if current_cam_index == measurement.camera_index:
-                        image_point = measurement.x, measurement.y
-                        pixels_visible.append(image_point)
-                        pixels_colors.append(point.color)
+                for point in points:
+                    for measurement in point.measurements:
+                        if current_cam_index == measurement.camera_index:
+                            image_point = measurement.x, measurement.y
+                            pixels_visible.append(image_point)
+                            pixels_colors.append(point.color)
 
             if show_non_occluded_points:
                 ImageDrawingInterface.show_pixel_positions_in_image(
@@ -299,7 +446,10 @@ class Reconstruction(FrozenClass):
 
         assert 4 < new_number < len(self.points)
         random_indices = random.sample(range(len(self.points)), new_number)
-        self.points = [self.points[i] for i in random_indices]
+        if isinstance(self.points, PointCloud):
+            self.points = self.points.get_subset(random_indices)
+        else:
+            self.points = [self.points[i] for i in random_indices]
 
     @staticmethod
     def parse_camera_image_files(path_to_images, cameras):
@@ -311,7 +461,20 @@ class Reconstruction(FrozenClass):
     @staticmethod
     def convert_measurement_to_image_coordinates(camera_index_to_camera, points):
         logger.info('convert_measurement_to_image_coordinates: ...')
-        if points is not None and len(points) > 0:
+        if isinstance(points, PointCloud):
+            track_table = points.measurements
+            if track_table is not None and not track_table.x_y_are_image_coords:
+                logger.info('Conversion of measurements are necessary!')
+                # Process all observations of a camera at once
+                for camera_index in track_table.get_camera_indices_with_observations():
+                    camera = camera_index_to_camera[camera_index]
+                    observation_indices = track_table.get_observation_indices_of_camera(camera_index)
+                    track_table.xs[observation_indices] += camera.width / 2
+                    track_table.ys[observation_indices] += camera.height / 2
+                track_table.x_y_are_image_coords = True
+            else:
+                logger.info('No conversion of measurements necessary.')
+        elif points is not None and len(points) > 0:
             if not points[0].measurements[0].x_y_are_image_coords:
                 logger.info('Conversion of measurements are necessary!')
 
@@ -12,7 +12,8 @@ class ExtractionTask(Task):
                  jpg_quality=2,
                  start_time=None,
                  end_time=None,
-                 indent_level_space=1):
+                 indent_level_space=1,
+                 num_segments=1):
 
         self.__dict__.update(locals())
         del self.self  # redundant (and a circular reference)
@@ -0,0 +1,302 @@
+import numpy as np
+from Utility.Classes.Frozen_Class import FrozenClass
+from Utility.Types.Point import Measurement
+
+
+class MeasurementView(Measurement):
+    """
+    Lazy view of a single observation stored in a TrackTable.
+
+    Provides the interface of Measurement for old call sites. Assignments
+    (e.g. measurement.x = ...) are written back to the track table.
+    """
+
+    def __init__(self, track_table, observation_index):
+        # Do NOT call Measurement.__init__(), the values are stored in the track table
+        object.__setattr__(self, '_track_table', track_table)
+        object.__setattr__(self, '_observation_index', observation_index)
+
+    @property
+    def camera_index(self):
+        return int(self._track_table.camera_indices[self._observation_index])
+
+    @camera_index.setter
+    def camera_index(self, camera_index):
+        self._track_table.camera_indices[self._observation_index] = camera_index
+        self._track_table.invalidate_camera_index()
+
+    @property
+    def feature_index(self):
+        return int(self._track_table.feature_indices[self._observation_index])
+
+    @feature_index.setter
+    def feature_index(self, feature_index):
+        self._track_table.feature_indices[self._observation_index] = feature_index
+
+    @property
+    def x(self):
+        return self._track_table.xs[self._observation_index]
+
+    @x.setter
+    def x(self, x):
+        self._track_table.xs[self._observation_index] = x
+
+    @property
+    def y(self):
+        return self._track_table.ys[self._observation_index]
+
+    @y.setter
+    def y(self, y):
+        self._track_table.ys[self._observation_index] = y
+
+    @property
+    def x_y_are_image_coords(self):
+        # The coordinate convention is defined for the whole table
+        return self._track_table.x_y_are_image_coords
+
+    @x_y_are_image_coords.setter
+    def x_y_are_image_coords(self, x_y_are_image_coords):
+        self._track_table.x_y_are_image_coords = x_y_are_image_coords
+
+
+class TrackTable(FrozenClass):
+    """
+    Compressed sparse row (CSR) representation of the measurements (tracks) of a set of points.
+
+    The observations of point i are stored at the positions
+        point_offsets[i], ..., point_offsets[i+1] - 1
+    of the parallel arrays camera_indices, feature_indices, xs and ys.
+
+    In addition, the table provides an inverted index (built on demand), which
+    allows to access all observations of a camera as a slice (instead of
+    scanning the tracks of all points).
+
+    See Measurement for the semantic of the camera indices and the x / y values.
+    """
+
+    def __init__(self,
+                 point_offsets,
+                 camera_indices,
+                 feature_indices,
+                 xs,
+                 ys,
+                 x_y_are_image_coords=None):
+
+        self.point_offsets = np.asarray(point_offsets, dtype=np.int64)
+        self.camera_indices = np.asarray(camera_indices, dtype=np.int64)
+        self.feature_indices = np.asarray(feature_indices, dtype=np.int64)
+        self.xs = np.asarray(xs, dtype=float)
+        self.ys = np.asarray(ys, dtype=float)
+
+        # If True, x and y are within [0, width] x [0, height]
+        # If False, x and y are within [-width/2, width/2] x [-height/2, height/2]
+        self.x_y_are_image_coords = x_y_are_image_coords
+
+        # Inverted index (see _build_camera_index())
+        self._camera_order = None
+        self._camera_to_range = None
+        self._observation_point_indices = None
+
+        self.check_consistency()
+
+    @classmethod
+    def init_from_track_lengths(cls,
+                                track_lengths,
+                                camera_indices,
+                                feature_indices,
+                                xs,
+                                ys,
+                                x_y_are_image_coords=None):
+        point_offsets = np.zeros(len(track_lengths) + 1, dtype=np.int64)
+        np.cumsum(track_lengths, out=point_offsets[1:])
+        return cls(point_offsets, camera_indices, feature_indices, xs, ys, x_y_are_image_coords)
+
+    @classmethod
+    def init_from_measurement_lists(cls, measurement_lists):
+        """
+        :param measurement_lists: list with one list of <Measurement> per point
+        """
+        track_lengths = [len(measurements) for measurements in measurement_lists]
+        num_observations = sum(track_lengths)
+        camera_indices = np.empty(num_observations, dtype=np.int64)
+        feature_indices = np.empty(num_observations, dtype=np.int64)
+        xs = np.empty(num_observations, dtype=float)
+        ys = np.empty(num_observations, dtype=float)
+
+        x_y_are_image_coords = None
+        observation_index = 0
+        for measurements in measurement_lists:
+            for measurement in measurements:
+                camera_indices[observation_index] = measurement.camera_index
+                feature_indices[observation_index] = measurement.feature_index
+                xs[observation_index] = measurement.x
+                ys[observation_index] = measurement.y
+                x_y_are_image_coords = measurement.x_y_are_image_coords
+                observation_index += 1
+
+        return cls.init_from_track_lengths(
+            track_lengths, camera_indices, feature_indices, xs, ys, x_y_are_image_coords)
+
+    def check_consistency(self):
+        assert len(self.point_offsets) > 0
+        assert self.point_offsets[0] == 0
+        num_observations = self.point_offsets[-1]
+        assert len(self.camera_indices) == num_observations
+        assert len(self.feature_indices) == num_observations
+        assert len(self.xs) == num_observations
+        assert len(self.ys) == num_observations
+
+    def __len__(self):
+        return self.get_num_points()
+
+    def __str__(self):
+        return 'TrackTable: ' + str(self.get_num_points()) + ' points, ' + \
+               str(self.get_num_observations()) + ' observations'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get_num_points(self):
+        return len(self.point_offsets) - 1
+
+    def get_num_observations(self):
+        return len(self.camera_indices)
+
+    def get_track_lengths(self):
+        return np.diff(self.point_offsets)
+
+    def get_track_range(self, point_index):
+        return self.point_offsets[point_index], self.point_offsets[point_index + 1]
+
+    def get_measurements(self, point_index):
+        """
+        Returns the observations of a point as list of (lazy) measurements
+        """
+        start, end = self.get_track_range(point_index)
+        return [MeasurementView(self, observation_index) for observation_index in range(start, end)]
+
+    def get_measurements_as_copies(self, point_index):
+        """
+        Returns the observations of a point as list of independent <Measurement> objects
+        """
+        start, end = self.get_track_range(point_index)
+        return [Measurement(self.camera_indices[observation_index],
+                            self.feature_indices[observation_index],
+                            self.xs[observation_index],
+                            self.ys[observation_index],
+                            self.x_y_are_image_coords)
+                for observation_index in range(start, end)]
+
+    def set_measurements(self, point_index, measurements):
+        """
+        Replaces the observations of a point (requires to copy all observations)
+        :param measurements: list of <Measurement>
+        """
+        # Read the values first, since the measurements could be views of this table
+        camera_indices = [measurement.camera_index for measurement in measurements]
+        feature_indices = [measurement.feature_index for measurement in measurements]
+        xs = [measurement.x for measurement in measurements]
+        ys = [measurement.y for measurement in measurements]
+        if len(measurements) > 0 and self.x_y_are_image_coords is None:
+            self.x_y_are_image_coords = measurements[-1].x_y_are_image_coords
+
+        start, end = self.get_track_range(point_index)
+        self.camera_indices = np.concatenate(
+            (self.camera_indices[:start], np.asarray(camera_indices, dtype=np.int64), self.camera_indices[end:]))
+        self.feature_indices = np.concatenate(
+            (self.feature_indices[:start], np.asarray(feature_indices, dtype=np.int64), self.feature_indices[end:]))
+        self.xs = np.concatenate((self.xs[:start], np.asarray(xs, dtype=float), self.xs[end:]))
+        self.ys = np.concatenate((self.ys[:start], np.asarray(ys, dtype=float), self.ys[end:]))
+        self.point_offsets[point_index + 1:] += len(measurements) - (end - start)
+
+        self.invalidate_camera_index()
+        self._observation_point_indices = None
+        self.check_consistency()
+
+    def get_measurement_mat(self):
+        """
+        Returns an (M,4) array, where each row is <camera index> <feature index> <x> <y>
+        """
+        return np.column_stack((self.camera_indices, self.feature_indices, self.xs, self.ys))
+
+    def get_observation_point_indices(self):
+        """
+        Returns for each observation the index of the corresponding point
+        """
+        if self._observation_point_indices is None:
+            self._observation_point_indices = np.repeat(
+                np.arange(self.get_num_points()), self.get_track_lengths())
+        return self._observation_point_indices
+
+    def _build_camera_index(self):
+        # A stable sort preserves the point order within each camera
+        self._camera_order = np.argsort(self.camera_indices, kind='stable')
+        sorted_camera_indices = self.camera_indices[self._camera_order]
+        unique_camera_indices, starts, counts = np.unique(
+            sorted_camera_indices, return_index=True, return_counts=True)
+        self._camera_to_range = {
+            int(camera_index): (start, start + count)
+            for camera_index, start, count in zip(unique_camera_indices, starts, counts)}
+
+    def invalidate_camera_index(self):
+        """
+        Must be called after modifying camera_indices in place
+        """
+        self._camera_order = None
+        self._camera_to_range = None
+
+    def get_camera_indices_with_observations(self):
+        if self._camera_to_range is None:
+            self._build_camera_index()
+        return sorted(self._camera_to_range.keys())
+
+    def get_observation_indices_of_camera(self, camera_index):
+        """
+        Returns the indices of all observations in the camera with camera_index (in point order)
+        """
+        if self._camera_to_range is None:
+            self._build_camera_index()
+        start, end = self._camera_to_range.get(camera_index, (0, 0))
+        return self._camera_order[start:end]
+
+    def get_point_indices_of_camera(self, camera_index):
+        """
+        Returns the (sorted) indices of all points with an observation in the camera with camera_index
+        """
+        observation_indices = self.get_observation_indices_of_camera(camera_index)
+        return np.unique(self.get_observation_point_indices()[observation_indices])
+
+    def get_subset(self, point_indices):
+        point_indices = np.asarray(point_indices, dtype=np.int64)
+        starts = self.point_offsets[point_indices]
+        track_lengths = self.point_offsets[point_indices + 1] - starts
+
+        # Compute the observation indices of all selected tracks without a python loop
+        subset_offsets = np.zeros(len(point_indices) + 1, dtype=np.int64)
+        np.cumsum(track_lengths, out=subset_offsets[1:])
+        observation_indices = np.repeat(starts - subset_offsets[:-1], track_lengths) + \
+            np.arange(subset_offsets[-1])
+
+        return TrackTable(
+            subset_offsets,
+            self.camera_indices[observation_indices],
+            self.feature_indices[observation_indices],
+            self.xs[observation_indices],
+            self.ys[observation_indices],
+            self.x_y_are_image_coords)
+
+    @staticmethod
+    def concatenate(track_tables):
+        assert len(track_tables) > 0
+        point_offsets = [np.zeros(1, dtype=np.int64)]
+        observation_offset = 0
+        for track_table in track_tables:
+            point_offsets.append(track_table.point_offsets[1:] + observation_offset)
+            observation_offset += track_table.get_num_observations()
+        return TrackTable(
+            np.concatenate(point_offsets),
+            np.concatenate([track_table.camera_indices for track_table in track_tables]),
+            np.concatenate([track_table.feature_indices for track_table in track_tables]),
+            np.concatenate([track_table.xs for track_table in track_tables]),
+            np.concatenate([track_table.ys for track_table in track_tables]),
+            track_tables[0].x_y_are_image_coords)
@@ -12,6 +12,27 @@ class Triangle(FrozenClass):
         self.vertex_1 = vertex_1
         self.vertex_2 = vertex_2
 
+    @staticmethod
+    def convert_triangles_to_vertex_array(triangles):
+        """
+        Packs the vertices of the triangles into a single (T,3,3) array, i.e.
+        vertex_array[i, j] is the j-th vertex of the i-th triangle
+        """
+        return np.array(
+            [[triangle.vertex_0, triangle.vertex_1, triangle.vertex_2] for triangle in triangles],
+            dtype=float).reshape((-1, 3, 3))
+
+    @staticmethod
+    def convert_mesh_to_vertex_array(coords, faces):
+        """
+        :param coords: (N,3) array of mesh vertices
+        :param faces: list of Face objects or (T,3) array of vertex indices
+        :return: (T,3,3) array (see convert_triangles_to_vertex_array())
+        """
+        if not isinstance(faces, np.ndarray):
+            faces = np.array([face.vertex_indices for face in faces], dtype=int).reshape((-1, 3))
+        return np.asarray(coords, dtype=float)[faces]
+
     def return_normal(self):
         normal = np.cross(self.vertex_0 - self.vertex_1, self.vertex_0 - self.vertex_2)
         return np.divide(normal, np.linalg.norm(normal))
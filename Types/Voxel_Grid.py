@@ -0,0 +1,144 @@
+import numpy as np
+from Utility.Classes.Frozen_Class import FrozenClass
+from Utility.Types.Point_Cloud import PointCloud
+
+
+class VoxelGrid(FrozenClass):
+    """
+    Sparse (hashed) voxel grid accumulating points.
+
+    Only occupied voxels are stored: each voxel is identified by a single
+    int64 key (the packed integer voxel coordinates) and holds the sum of the
+    coords / colors and the number of the points falling into it. The keys
+    are kept sorted. Added points are reduced to their voxels and buffered,
+    the buffer is merged with the grid once it is as large as the grid
+    itself, i.e. the total merge cost grows only with O(n log n).
+
+    The memory consumption depends only on the number of occupied voxels (and
+    not on the number of added points).
+    """
+
+    # Number of bits per dimension of a packed key (the voxel coordinates must lie in [-2^20, 2^20))
+    key_bits = 21
+
+    def __init__(self, voxel_size):
+        assert voxel_size > 0
+        self.voxel_size = float(voxel_size)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.coord_sums = np.empty((0, 3), dtype=float)
+        self.color_sums = np.empty((0, 3), dtype=float)
+        self.counts = np.empty(0, dtype=np.int64)
+        # Camera index of the first point added to the voxel (-1 if unknown)
+        self.camera_indices = np.empty(0, dtype=np.int64)
+        # Reduced (but not yet merged) voxels, see flush()
+        self._pending_voxels = []
+        self._num_pending_voxels = 0
+
+    def __len__(self):
+        self.flush()
+        return len(self.keys)
+
+    @staticmethod
+    def compute_voxel_indices(coords, voxel_size):
+        """
+        :return: (N,3) int64 array of integer voxel coordinates
+        """
+        return np.floor(np.asarray(coords, dtype=float) / voxel_size).astype(np.int64)
+
+    @staticmethod
+    def compute_voxel_keys(coords, voxel_size):
+        """
+        Packs the integer voxel coordinates of each coord into a single int64
+        """
+        voxel_indices = VoxelGrid.compute_voxel_indices(coords, voxel_size)
+        offset = 1 << (VoxelGrid.key_bits - 1)
+        voxel_indices += offset
+        assert np.all(voxel_indices >= 0) and np.all(voxel_indices < (1 << VoxelGrid.key_bits)), \
+            'Voxel coordinates out of range, use a larger voxel size'
+        return (voxel_indices[:, 0] << (2 * VoxelGrid.key_bits)) | \
+               (voxel_indices[:, 1] << VoxelGrid.key_bits) | \
+               voxel_indices[:, 2]
+
+    @staticmethod
+    def _reduce(keys, coord_sums, color_sums, counts, camera_indices):
+        """
+        Sums up the entries with equal keys (the first camera index is kept)
+        """
+        # A stable sort keeps the earlier entries in front of later ones
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        is_first = np.ones(len(keys), dtype=bool)
+        is_first[1:] = keys[1:] != keys[:-1]
+        first_positions = np.flatnonzero(is_first)
+        return (keys[first_positions],
+                np.add.reduceat(coord_sums[order], first_positions, axis=0),
+                np.add.reduceat(color_sums[order], first_positions, axis=0),
+                np.add.reduceat(counts[order], first_positions),
+                camera_indices[order][first_positions])
+
+    def _merge(self, keys, coord_sums, color_sums, counts, camera_indices):
+        if len(keys) == 0:
+            return
+        pending_voxels = VoxelGrid._reduce(keys, coord_sums, color_sums, counts, camera_indices)
+        self._pending_voxels.append(pending_voxels)
+        self._num_pending_voxels += len(pending_voxels[0])
+        if self._num_pending_voxels >= len(self.keys):
+            self.flush()
+
+    def flush(self):
+        """
+        Merges the buffered voxels into the grid
+        """
+        if len(self._pending_voxels) == 0:
+            return
+        voxel_arrays = [(self.keys, self.coord_sums, self.color_sums, self.counts, self.camera_indices)]
+        voxel_arrays += self._pending_voxels
+        self._pending_voxels = []
+        self._num_pending_voxels = 0
+        self.keys, self.coord_sums, self.color_sums, self.counts, self.camera_indices = VoxelGrid._reduce(
+            *[np.concatenate(arrays) for arrays in zip(*voxel_arrays)])
+
+    def add_coords(self, coords, colors=None, camera_index=-1):
+        """
+        :param coords: (N,3) array
+        :param colors: (N,3) array (white if None)
+        :param camera_index: int or (N,) array with the camera index of each coord
+        """
+        coords = np.asarray(coords, dtype=float).reshape((-1, 3))
+        num_coords = len(coords)
+        if colors is None:
+            colors = np.full((num_coords, 3), 255, dtype=float)
+        camera_indices = np.broadcast_to(np.asarray(camera_index, dtype=np.int64), (num_coords,))
+        self._merge(
+            VoxelGrid.compute_voxel_keys(coords, self.voxel_size),
+            coords,
+            np.asarray(colors, dtype=float).reshape((-1, 3)),
+            np.ones(num_coords, dtype=np.int64),
+            camera_indices)
+
+    def add_voxel_grid(self, other):
+        assert self.voxel_size == other.voxel_size
+        other.flush()
+        self._merge(other.keys, other.coord_sums, other.color_sums, other.counts, other.camera_indices)
+
+    def get_coords(self):
+        """
+        :return: the centroid of the points of each voxel
+        """
+        self.flush()
+        return self.coord_sums / self.counts[:, np.newaxis]
+
+    def get_colors(self):
+        self.flush()
+        return np.round(self.color_sums / self.counts[:, np.newaxis]).astype(np.uint8)
+
+    def get_counts(self):
+        self.flush()
+        return self.counts
+
+    def get_camera_indices(self):
+        self.flush()
+        return self.camera_indices
+
+    def to_point_cloud(self):
+        return PointCloud(self.get_coords(), self.get_colors())